@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# bench_backend_startup.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Time and memory that it takes to load the backend components, for the
+EIP-only and mail-only clients, compared to loading all of them as the
+backend used to do.
+
+Each profile is measured in a fresh python process.
+
+Run as:  python pkg/benchmarks/bench_backend_startup.py
+"""
+import resource
+import subprocess
+import sys
+import time
+
+
+PROFILES = {
+    'all': ('provider', 'register', 'user', 'eip', 'soledad', 'keymanager',
+            'mail'),
+    'eip': ('provider', 'register', 'user', 'eip'),
+    'mail': ('provider', 'register', 'user', 'soledad', 'keymanager',
+             'mail'),
+}
+
+
+def _rss_kb():
+    # in KB on linux, in bytes on OSX
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss
+
+
+def measure(profile):
+    """
+    Load the components of a profile, in this process.
+    """
+    import zope.proxy
+
+    start = time.time()
+    from leap.bitmask.backend import leapbackend
+
+    class _Backend(object):
+        # just what the component factories need
+        _signaler = None
+        _bypass_checks = False
+        _soledad_proxy = zope.proxy.ProxyBase(None)
+        _keymanager_proxy = zope.proxy.ProxyBase(None)
+
+    backend = _Backend()
+    for prefix in PROFILES[profile]:
+        leapbackend.LeapBackend.COMPONENTS[prefix](backend)
+    elapsed = time.time() - start
+
+    print '%f %d %d' % (elapsed, _rss_kb(), len(sys.modules))
+
+
+def main():
+    print '%8s %10s %10s %8s' % ('profile', 'time (ms)', 'rss (KB)',
+                                 'modules')
+    for profile in ('all', 'eip', 'mail'):
+        output = subprocess.check_output(
+            [sys.executable, __file__, profile])
+        elapsed, rss, modules = output.split()
+        print '%8s %10.1f %10s %8s' % (
+            profile, float(elapsed) * 1000, rss, modules)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        measure(sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# bench_cli.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Time that it takes to run the same commands with one bitmask_cli process
+per command, and with a single bitmask_cli shell.
+
+The bitmask daemon has to be running.
+
+Run as:  python pkg/benchmarks/bench_cli.py [COMMANDS]
+"""
+import subprocess
+import sys
+import time
+
+
+COMMANDS = 100
+COMMAND = 'status'
+CLI = [sys.executable, '-m', 'leap.bitmask.cli.bitmask_cli']
+
+
+def one_process_per_command(count):
+    start = time.time()
+    for _ in range(count):
+        subprocess.check_output(CLI + ['--json', COMMAND])
+    return time.time() - start
+
+
+def shell(count):
+    start = time.time()
+    proc = subprocess.Popen(
+        CLI + ['--json', 'shell'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output, _ = proc.communicate('%s\n' % COMMAND * count)
+    elapsed = time.time() - start
+
+    replies = output.splitlines()
+    if len(replies) != count:
+        raise RuntimeError('got %d replies for %d commands'
+                           % (len(replies), count))
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COMMANDS
+
+    print '%d x bitmask_cli %s' % (count, COMMAND)
+    for name, run in (('processes', one_process_per_command),
+                      ('shell', shell)):
+        elapsed = run(count)
+        print '%10s %10.1f ms %8.2f ms/command' % (
+            name, elapsed * 1000, elapsed * 1000 / count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# bench_eip_start.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Time from the click on 'Turn ON' until the VPN is connected, for a cold
+start (the EIP config and client certificate are checked against the
+provider first) and for the warm starts that follow it.
+
+It drives the EIP backend component the way the GUI does: eip_setup, then
+eip_start once the client certificate is ready. The signals are received by
+a plain PULL socket instead of the Qt signaling server, so that this can run
+without a GUI.
+
+It needs a provider that was already bootstrapped with the client, that
+allows anonymous VPN, and the privileged helpers that the client needs to
+launch openvpn.
+
+Run as:  python pkg/benchmarks/bench_eip_start.py <provider domain> [runs]
+"""
+import os
+import Queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import zmq
+
+from twisted.internet import reactor, threads
+
+from leap.bitmask.backend import signaler
+from leap.bitmask.config import flags
+
+
+TIMEOUT = 120  # secs
+
+
+class SignalReceiver(threading.Thread):
+    """
+    Receives the backend signals, with the time they arrived.
+    """
+
+    def __init__(self, socket):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._socket = socket
+        self.signals = Queue.Queue()
+
+    def run(self):
+        while True:
+            for request in self._socket.recv_multipart():
+                signal = zmq.utils.jsonapi.loads(request)['signal']
+                self.signals.put((time.time(), signal))
+
+    def wait_for(self, *names):
+        """
+        Wait for one of the signals, and return its name and when it came.
+        """
+        deadline = time.time() + TIMEOUT
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise RuntimeError('Timed out waiting for %s' % (names,))
+            try:
+                received, signal = self.signals.get(timeout=remaining)
+            except Queue.Empty:
+                continue
+            if signal in names:
+                return signal, received
+
+
+def connect(eip, receiver, domain):
+    """
+    Turn EIP on and off, as the GUI does.
+
+    :return: the seconds from the setup until the client certificate was
+             ready, and until openvpn was connected.
+    :rtype: tuple
+    """
+    start = time.time()
+    eip.setup_eip(domain)
+    signal, ready = receiver.wait_for(
+        'eip_client_certificate_ready', 'eip_cancelled_setup')
+    if signal != 'eip_client_certificate_ready':
+        raise RuntimeError('EIP setup failed')
+
+    eip.start()
+    signal, connected = receiver.wait_for(
+        'eip_connected', 'eip_connection_aborted', 'eip_process_finished')
+    if signal != 'eip_connected':
+        raise RuntimeError('Could not connect: %s' % (signal,))
+
+    eip.stop()
+    receiver.wait_for('eip_stopped', 'eip_process_finished')
+    return ready - start, connected - start
+
+
+def run(domain, runs):
+    from leap.bitmask.backend.components import EIP
+
+    tmpdir = tempfile.mkdtemp()
+    flags.ZMQ_HAS_CURVE = False
+    signaler.Signaler.SERVER = 'ipc://%s' % os.path.join(tmpdir, 'signaler')
+
+    context = zmq.Context()
+    server = context.socket(zmq.PULL)
+    server.bind(signaler.Signaler.SERVER)
+    receiver = SignalReceiver(server)
+    receiver.start()
+
+    client = signaler.Signaler()
+    client.start()
+    try:
+        eip = EIP(signaler=client)
+        print '%6s %12s %16s' % ('start', 'setup (ms)', 'connected (ms)')
+        for i in range(runs):
+            setup, connected = connect(eip, receiver, domain)
+            print '%6s %12.1f %16.1f' % (
+                'cold' if i == 0 else 'warm', setup * 1000, connected * 1000)
+    finally:
+        client.stop()
+        server.close()
+        shutil.rmtree(tmpdir)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    domain = sys.argv[1]
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    # the component calls block, as in the backend workers
+    d = threads.deferToThread(run, domain, runs)
+    d.addErrback(lambda failure: sys.stderr.write(
+        failure.getErrorMessage() + '\n'))
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# bench_signaler.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+CPU usage of an idle Signaler, and latency of the signals it sends.
+
+The signals are received by a plain PULL socket instead of the Qt signaling
+server, so that this can run without a GUI. The latency is measured from
+the call to Signaler.signal() until the signal is read by the receiver.
+
+Run as:  python pkg/benchmarks/bench_signaler.py
+"""
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+
+import zmq
+
+from leap.bitmask.backend import signaler
+from leap.bitmask.config import flags
+
+
+IDLE_SECONDS = 5
+SIGNALS = 2000
+SIGNAL = 'backend_bad_call'
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def receive(socket, count, latencies):
+    while len(latencies) < count:
+        for request in socket.recv_multipart():
+            sent = zmq.utils.jsonapi.loads(request)['data']
+            latencies.append(time.time() - sent)
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    flags.ZMQ_HAS_CURVE = False
+    signaler.Signaler.SERVER = 'ipc://%s' % os.path.join(tmpdir, 'signaler')
+
+    context = zmq.Context()
+    server = context.socket(zmq.PULL)
+    server.bind(signaler.Signaler.SERVER)
+
+    client = signaler.Signaler()
+    client.start()
+    try:
+        start = cpu_time()
+        time.sleep(IDLE_SECONDS)
+        idle = (cpu_time() - start) / IDLE_SECONDS
+
+        latencies = []
+        receiver = threading.Thread(
+            target=receive, args=(server, SIGNALS, latencies))
+        receiver.start()
+        for i in range(SIGNALS):
+            # unique data for each signal, so that none gets coalesced
+            client.signal(SIGNAL, time.time())
+            if i % 10 == 0:
+                time.sleep(0.001)
+        receiver.join()
+
+        print 'idle cpu:     %.2f%%' % (idle * 100)
+        print 'latency p50:  %.3f ms' % (percentile(latencies, 50) * 1000)
+        print 'latency p99:  %.3f ms' % (percentile(latencies, 99) * 1000)
+    finally:
+        client.stop()
+        server.close()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# bench_uuid_map.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Login latency of the UserMap uuid lookup, with 1, 50 and 500 stored accounts.
+
+Compares the indexed lookup with the old one, that had to try to decrypt
+every record. The old lookup is measured on a file in the old format, with
+the user we look for in the last record.
+
+Run as:  python pkg/benchmarks/bench_uuid_map.py
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from leap.bitmask.core import uuid_map
+
+
+SIZES = (1, 50, 500)
+PASSWD = 'secret passphrase'
+
+
+def _userid(i):
+    return 'user%d@provider.example.org' % i
+
+
+def _uuid(i):
+    return '%032x' % i
+
+
+def populate(path, n, legacy=False):
+    lines = [uuid_map._encode_uuid_map(_userid(i), _uuid(i), PASSWD)
+             for i in range(n)]
+    if legacy:
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines))
+        return
+    um = uuid_map.UserMap()
+    for i, line in enumerate(lines):
+        um._records[um._blind_index(_userid(i))] = line
+    um.dump()
+
+
+def time_lookup(n):
+    # a fresh map each time, so that nothing is cached
+    um = uuid_map.UserMap()
+    start = time.time()
+    uuid = um.lookup_uuid(_userid(n - 1), PASSWD)
+    elapsed = time.time() - start
+    assert uuid == _uuid(n - 1)
+    return elapsed
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    uuid_map.MAP_PATH = os.path.join(tmpdir, 'uuids')
+    try:
+        print '%8s %14s %14s' % ('accounts', 'indexed (ms)', 'legacy (ms)')
+        for n in SIZES:
+            populate(uuid_map.MAP_PATH, n)
+            indexed = time_lookup(n)
+            os.unlink(uuid_map.MAP_PATH)
+
+            populate(uuid_map.MAP_PATH, n, legacy=True)
+            legacy = time_lookup(n)
+            os.unlink(uuid_map.MAP_PATH)
+
+            print '%8d %14.1f %14.1f' % (n, indexed * 1000, legacy * 1000)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,3 +21,18 @@ resource_graph:
 	./pkg/scripts/monitor_resource.zsh `pgrep bitmask` $(RESOURCE_TIME)
 	display bitmask-resources.png
 
+
+bench_uuid_map:
+	python pkg/benchmarks/bench_uuid_map.py
+
+bench_signaler:
+	python pkg/benchmarks/bench_signaler.py
+
+bench_backend_startup:
+	python pkg/benchmarks/bench_backend_startup.py
+
+bench_cli:
+	python pkg/benchmarks/bench_cli.py
+
+bench_eip_start:
+	python pkg/benchmarks/bench_eip_start.py $(PROVIDER)
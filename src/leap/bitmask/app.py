@@ -46,6 +46,11 @@ import os
 import platform
 import sys
 
+from leap.bitmask.importprofile import profile_imports_if_requested
+
+# XXX this has to run before the rest of the imports to measure them.
+profile_imports_if_requested()
+
 
 if platform.system() == "Darwin":
     # XXX please ignore pep8 complains, this needs to be executed
@@ -57,24 +62,20 @@ if platform.system() == "Darwin":
 
 
 from leap.bitmask import __version__ as VERSION
-from leap.bitmask.backend.backend_proxy import BackendProxy
-from leap.bitmask.backend_app import run_backend
 from leap.bitmask.config import flags
-from leap.bitmask.frontend_app import run_frontend
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.platform_init.locks import we_are_the_one_and_only
-from leap.bitmask.services.mail import plumber
 from leap.bitmask.util import leap_argparse, flags_to_dict, here
 from leap.bitmask.util.requirement_checker import check_requirements
 
 from leap.common.config import flags as common_flags
 
-from leap.mail import __version__ as MAIL_VERSION
-
 import codecs
 codecs.register(lambda name: codecs.lookup('utf-8')
                 if name == 'cp65001' else None)
-import psutil
+
+# NOTE: the backend, the frontend, leap.mail and psutil are imported where
+# they are used, they take a long time to load and not every run needs them.
 
 
 def qt_hack_ubuntu():
@@ -87,6 +88,8 @@ def kill_the_children():
     """
     Make sure no lingering subprocesses are left in case of a bad termination.
     """
+    import psutil
+
     me = os.getpid()
     parent = psutil.Process(me)
     print "Killing all the children processes..."
@@ -116,6 +119,7 @@ def do_display_version(opts):
     """
     # TODO move to a different module: commands?
     if opts.version:
+        from leap.mail import __version__ as MAIL_VERSION
         print "Bitmask version: %s" % (VERSION,)
         print "leap.mail version: %s" % (MAIL_VERSION,)
         sys.exit(0)
@@ -126,6 +130,8 @@ def do_mail_plumbing(opts):
     Analize options and do mailbox plumbing if requested.
     """
     # TODO move to a different module: commands?
+    from leap.bitmask.services.mail import plumber
+
     if opts.repair:
         plumber.repair_account(opts.acct)
         sys.exit(0)
@@ -226,6 +232,11 @@ def start_app():
 
     check_requirements()
 
+    from leap.bitmask.backend.backend_proxy import BackendProxy
+    from leap.bitmask.backend_app import run_backend
+    from leap.bitmask.frontend_app import run_frontend
+    from leap.mail import __version__ as MAIL_VERSION
+
     logger.info('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
     logger.info('Bitmask version %s' % VERSION)
     logger.info('leap.mail version %s' % MAIL_VERSION)
@@ -33,6 +33,7 @@ API = (
     "eip_get_gateway_country_code",
     "eip_get_gateways_list",
     "eip_get_initialized_providers",
+    "eip_get_traffic",
     "eip_setup",
     "eip_start",
     "eip_stop",
@@ -68,6 +69,23 @@ API = (
     "user_login",
     "user_logout",
     "user_register",
+    "backend_get_stats",
+)
+
+# API calls that the user is not actively waiting for. They run in the
+# backend worker pool after any pending interactive call (see workers.py).
+BACKGROUND_API = (
+    "eip_check_dns",
+    "eip_get_gateway_country_code",
+    "eip_get_gateways_list",
+    "eip_get_initialized_providers",
+    "eip_get_traffic",
+    "keymanager_list_keys",
+    "provider_get_all_services",
+    "provider_get_pinned_providers",
+    "provider_get_supported_services",
+    "soledad_get_service_token",
+    "user_get_logged_in_status",
 )
 
 
@@ -89,6 +107,7 @@ SIGNALS = (
     "eip_get_gateways_list",
     "eip_get_gateways_list_error",
     "eip_get_initialized_providers",
+    "eip_get_traffic",
     "eip_network_unreachable",
     "eip_no_gateway",
     "eip_no_pkexec_error",
@@ -101,6 +120,7 @@ SIGNALS = (
     "eip_process_restart_tls",
     "eip_state_changed",
     "eip_status_changed",
+    "eip_stop_progress",
     "eip_stopped",
     "eip_tear_fw_down",
     "eip_bitmask_root_vpn_down",
@@ -23,7 +23,8 @@ import time
 
 import psutil
 
-from twisted.internet import defer, reactor, threads, task
+from twisted.internet import defer, reactor, task
+from twisted.python.failure import Failure
 
 import txzmq
 import zmq
@@ -31,34 +32,69 @@ try:
     from zmq.auth.thread import ThreadAuthenticator
 except ImportError:
     pass
+try:
+    from zmq.utils.monitor import parse_monitor_message
+except ImportError:
+    pass
 
-from leap.bitmask.backend.api import API, PING_REQUEST
+from leap.bitmask.backend import workers
+from leap.bitmask.backend.api import API, BACKGROUND_API, PING_REQUEST
 from leap.bitmask.backend.signaler import Signaler
 from leap.bitmask.backend.utils import get_backend_certificates
+from leap.bitmask.backend.utils import set_zmq_heartbeats
 from leap.bitmask.config import flags
 from leap.bitmask.logs.utils import get_logger
 
 logger = get_logger()
 
 
-class TxZmqREPConnection(object):
+class TxZmqROUTERConnection(object):
     """
-    A twisted based zmq rep connection.
+    A twisted based zmq router connection.
+
+    Every request carries an id chosen by the client, and the reply is sent
+    back, tagged with that id, as soon as the request has been processed:
+
+        request:  [request_id, request_json]
+        reply:    [request_id, response_json]
+
+    The requests are processed concurrently, so the replies may arrive in a
+    different order than the requests were sent.
+
+    If the current ZMQ supports it, the connections to the clients are kept
+    alive with ZMTP heartbeats, and on_disconnect is called whenever one of
+    them goes away.
     """
 
-    def __init__(self, server_address, process_request):
+    MONITOR_ADDR = "inproc://bitmask.backend.monitor"
+
+    def __init__(self, server_address, process_request, on_disconnect=None,
+                 heartbeat_interval=2, heartbeat_timeout=6):
         """
         Initialize the connection.
 
         :param server_address: The address of the backend zmq server.
         :type server: str
-        :param process_request: A callable used to process incoming requests.
-        :type process_request: callable(messageParts)
+        :param process_request: A callable used to process incoming requests,
+                                that returns a Deferred with the result.
+        :type process_request: callable(request_json)
+        :param on_disconnect: A callable to call when a client goes away.
+        :type on_disconnect: callable()
+        :param heartbeat_interval: seconds between heartbeats.
+        :type heartbeat_interval: float
+        :param heartbeat_timeout: seconds without an answer to a heartbeat
+                                  before a client is considered gone.
+        :type heartbeat_timeout: float
         """
         self._server_address = server_address
         self._process_request = process_request
+        self._on_disconnect = on_disconnect
+        self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_timeout = heartbeat_timeout
         self._zmq_factory = None
         self._zmq_connection = None
+        self._monitor = None
+        self.heartbeats = False
         self._init_txzmq()
 
     def _init_txzmq(self):
@@ -67,14 +103,18 @@ class TxZmqREPConnection(object):
         """
         self._zmq_factory = txzmq.ZmqFactory()
         self._zmq_factory.registerForShutdown()
-        self._zmq_connection = txzmq.ZmqREPConnection(self._zmq_factory)
+        self._zmq_connection = txzmq.ZmqRouterConnection(self._zmq_factory)
 
         context = self._zmq_factory.context
         socket = self._zmq_connection.socket
 
-        def _gotMessage(messageId, messageParts):
-            self._zmq_connection.reply(messageId, "OK")
-            self._process_request(messageParts)
+        def _gotMessage(sender, request_id, request_json):
+            d = self._process_request(request_json)
+            d.addCallbacks(_encode_result, _encode_error)
+            d.addCallback(_reply, sender, request_id)
+
+        def _reply(response, sender, request_id):
+            self._zmq_connection.sendMultipart(sender, [request_id, response])
 
         self._zmq_connection.gotMessage = _gotMessage
 
@@ -92,11 +132,57 @@ class TxZmqREPConnection(object):
             socket.curve_secretkey = secret
             socket.curve_server = True  # must come before bind
 
+        self.heartbeats = set_zmq_heartbeats(
+            socket, self._heartbeat_interval, self._heartbeat_timeout)
+        if self.heartbeats and self._on_disconnect is not None:
+            socket.monitor(self.MONITOR_ADDR, zmq.EVENT_DISCONNECTED)
+            self._monitor = _TxZmqMonitorConnection(
+                self._zmq_factory, self.MONITOR_ADDR, self._on_event)
+
         proto, addr = self._server_address.split('://')  # tcp/ipc, ip/socket
         socket.bind(self._server_address)
         if proto == 'ipc':
             os.chmod(addr, 0600)
 
+    def _on_event(self, event):
+        if event['event'] == zmq.EVENT_DISCONNECTED:
+            self._on_disconnect()
+
+
+class _TxZmqMonitorConnection(txzmq.ZmqConnection):
+    """
+    A twisted based connection to the monitor socket of another socket.
+    """
+
+    socketType = zmq.PAIR
+
+    def __init__(self, factory, address, on_event):
+        """
+        :param address: the address the socket monitor was bound to.
+        :type address: str
+        :param on_event: called with the parsed monitor events.
+        :type on_event: callable(dict)
+        """
+        self._on_event = on_event
+        endpoint = txzmq.ZmqEndpoint(txzmq.ZmqEndpointType.connect, address)
+        txzmq.ZmqConnection.__init__(self, factory, endpoint)
+
+    def messageReceived(self, message):
+        self._on_event(parse_monitor_message(message))
+
+
+def _encode_result(result):
+    try:
+        return json.dumps({'result': result, 'error': None})
+    except (TypeError, ValueError):
+        logger.warning("Could not serialize result: {0!r}".format(result))
+        return json.dumps({'result': None, 'error': None})
+
+
+def _encode_error(failure):
+    return json.dumps({'result': None,
+                       'error': failure.getErrorMessage() or repr(failure)})
+
 
 class Backend(object):
     """
@@ -114,61 +200,88 @@ class Backend(object):
         BIND_ADDR = "ipc://%s" % SOCKET_FILE
 
     PING_INTERVAL = 2  # secs
+    FRONTEND_CHECK_INTERVAL = 10  # secs, with ZMTP heartbeats
+    HEARTBEAT_INTERVAL = 2  # secs
+    HEARTBEAT_TIMEOUT = 6  # secs
+    WORKER_THREADS = 4
+    STOP_TIMEOUT = 3  # secs
 
-    def __init__(self, frontend_pid=None):
+    def __init__(self, frontend_pid=None, worker_threads=None):
         """
         Backend constructor, create needed instances.
+
+        :param frontend_pid: the pid of the frontend, to stop when it dies.
+        :type frontend_pid: int
+        :param worker_threads: how many API calls can run at the same time.
+        :type worker_threads: int
         """
         self._signaler = Signaler()
         self._frontend_pid = frontend_pid
         self._frontend_checker = None
-        self._ongoing_defers = []
-        self._zmq_connection = TxZmqREPConnection(
-            self.BIND_ADDR, self._process_request)
+        self._stopping = False
+        self._workers = workers.WorkerPool(
+            worker_threads or self.WORKER_THREADS)
+        self._zmq_connection = TxZmqROUTERConnection(
+            self.BIND_ADDR, self._process_request,
+            on_disconnect=self._check_frontend_alive,
+            heartbeat_interval=self.HEARTBEAT_INTERVAL,
+            heartbeat_timeout=self.HEARTBEAT_TIMEOUT)
 
     def _check_frontend_alive(self):
         """
         Check if the frontend is alive and stop the backend if it is not.
+
+        With ZMTP heartbeats this runs when a client goes away, and it is
+        also polled every FRONTEND_CHECK_INTERVAL, in case the frontend dies
+        before it connects. Otherwise it is polled every PING_INTERVAL.
         """
         pid = self._frontend_pid
         if pid is not None and not psutil.pid_exists(pid):
             logger.critical("The frontend is down!")
             self.stop()
 
-    def _stop_reactor(self):
+    def _stop_reactor(self, started):
         """
-        Stop the Twisted reactor, but first wait a little for some threads to
-        complete their work.
+        Stop the Twisted reactor, but first wait a little for the running
+        API calls to complete their work.
+
+        The wait does not block any thread: it ends as soon as the worker
+        pool is idle, or after STOP_TIMEOUT seconds, when the calls that
+        are still pending get cancelled.
 
-        Note: this method needs to be run in a different thread so the
-        time.sleep() does not block and other threads can finish.
-        i.e.:
-            use threads.deferToThread(this_method) instead of this_method()
+        :param started: when the backend started to stop.
+        :type started: float
         """
-        wait_max = 3  # seconds
-        wait_step = 0.5
-        wait = 0
-        while self._ongoing_defers and wait < wait_max:
-            time.sleep(wait_step)
-            wait += wait_step
-            msg = "Waiting for running threads to finish... {0}/{1}"
-            msg = msg.format(wait, wait_max)
-            logger.debug(msg)
-
-        # after a timeout we shut down the existing threads.
-        for d in self._ongoing_defers:
-            d.cancel()
-
-        logger.debug("Stopping the Twisted reactor...")
-        reactor.stop()
+        d = self._workers.wait_idle()
+        timeout = reactor.callLater(self.STOP_TIMEOUT, d.cancel)
+
+        def _stop(result):
+            if timeout.active():
+                timeout.cancel()
+            if self._workers.pending:
+                logger.warning(
+                    "{0} calls did not finish in time, cancelling them."
+                    .format(self._workers.pending))
+                # after a timeout we shut down the existing threads.
+                self._workers.cancel_all()
+
+            logger.debug("Stopping the Twisted reactor, {0:.3f}s after the "
+                         "backend was asked to stop.".format(
+                             time.time() - started))
+            reactor.stop()
+
+        d.addBoth(_stop)
 
     def run(self):
         """
         Start the ZMQ server and run the loop to handle requests.
         """
         self._signaler.start()
+        interval = self.PING_INTERVAL
+        if self._zmq_connection.heartbeats:
+            interval = self.FRONTEND_CHECK_INTERVAL
         self._frontend_checker = task.LoopingCall(self._check_frontend_alive)
-        self._frontend_checker.start(self.PING_INTERVAL)
+        self._frontend_checker.start(interval)
         logger.debug("Starting Twisted reactor.")
         reactor.run()
         logger.debug("Finished Twisted reactor.")
@@ -177,10 +290,20 @@ class Backend(object):
         """
         Stop the server and the zmq request parse loop.
         """
+        if self._stopping:
+            return
+        self._stopping = True
+
         logger.debug("Stopping the backend...")
         self._signaler.stop()
-        self._frontend_checker.stop()
-        threads.deferToThread(self._stop_reactor)
+        # this can be called from a worker thread, by the stop request
+        reactor.callFromThread(self._stop_in_reactor, time.time())
+
+    def _stop_in_reactor(self, started):
+        checker = self._frontend_checker
+        if checker is not None and checker.running:
+            checker.stop()
+        self._stop_reactor(started)
 
     def _process_request(self, request_json):
         """
@@ -189,10 +312,13 @@ class Backend(object):
 
         :param request_json: a json specification of a request.
         :type request_json: str
+
+        :return: a Deferred that fires with the result of the call.
+        :rtype: Deferred
         """
         if request_json == PING_REQUEST:
             # do not process request if it's just a ping
-            return
+            return defer.succeed(None)
 
         try:
             # request = zmq.utils.jsonapi.loads(request_json)
@@ -205,13 +331,14 @@ class Backend(object):
             msg = msg.format(request_json, e)
             msg = msg.format(request_json)
             logger.critical(msg)
-            raise
+            return defer.fail(e)
 
         if api_method not in API:
-            logger.error("Invalid API call '{0}'".format(api_method))
-            return
+            msg = "Invalid API call '{0}'".format(api_method)
+            logger.error(msg)
+            return defer.fail(Exception(msg))
 
-        self._run_in_thread(api_method, kwargs)
+        return self._run_in_thread(api_method, kwargs)
 
     def _run_in_thread(self, api_method, kwargs):
         """
@@ -221,6 +348,9 @@ class Backend(object):
         :type api_method: str
         :param kwargs: the arguments dict that will be sent to the callable.
         :type kwargs: tuple
+
+        :return: a Deferred that fires with the result of the method.
+        :rtype: Deferred
         """
         func = getattr(self, api_method)
 
@@ -231,28 +361,38 @@ class Backend(object):
         # logger.debug("Running method: '{0}' "
         #            "with args: '{1}' in a thread".format(api_method, kwargs))
 
-        # run the action in a thread and keep track of it
-        d = threads.deferToThread(method)
-        d.addCallback(self._done_action, d)
-        d.addErrback(self._done_action, d)
-        self._ongoing_defers.append(d)
+        priority = workers.INTERACTIVE
+        if api_method in BACKGROUND_API:
+            priority = workers.BACKGROUND
+
+        # run the action in the worker pool, that keeps track of it
+        d = self._workers.run(method, priority)
+        d.addBoth(self._done_action)
+        return d
 
-    def _done_action(self, failure, d):
+    def _done_action(self, result):
         """
-        Remove the defer from the ongoing list.
+        Log the failure of an action, if it failed.
 
-        :param failure: the failure that triggered the errback.
-                        None if no error.
-        :type failure: twisted.python.failure.Failure
-        :param d: defer to remove
-        :type d: twisted.internet.defer.Deferred
+        :param result: the result of the action, or the failure that
+                       triggered the errback.
+        :type result: object or twisted.python.failure.Failure
+
+        :return: the given result, so it can be sent back to the caller.
         """
-        if failure is not None:
-            if failure.check(defer.CancelledError):
+        if isinstance(result, Failure):
+            if result.check(defer.CancelledError):
                 logger.debug("A defer was cancelled.")
             else:
-                logger.error("There was a failure - {0!r}".format(failure))
-                logger.error(failure.getTraceback())
+                logger.error("There was a failure - {0!r}".format(result))
+                logger.error(result.getTraceback())
+        return result
+
+    def backend_get_stats(self):
+        """
+        Return the state of the worker pool: the calls running and queued,
+        and how long the calls have waited to start, by priority.
 
-        if d in self._ongoing_defers:
-            self._ongoing_defers.remove(d)
+        :rtype: dict
+        """
+        return self._workers.stats()
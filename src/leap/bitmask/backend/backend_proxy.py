@@ -21,17 +21,27 @@ to the backend.
 # XXX should document the relationship to the API here.
 
 import functools
+import itertools
+import json
 import threading
 
 import zmq
 from zmq.eventloop import ioloop
 from zmq.eventloop.minitornado.ioloop import PollIOLoop
 from zmq.eventloop import zmqstream
+try:
+    from zmq.utils.monitor import parse_monitor_message
+except ImportError:
+    pass
+
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
 
 from leap.bitmask.backend.api import API, STOP_REQUEST, PING_REQUEST
 from leap.bitmask.backend.settings import Settings
 from leap.bitmask.backend.utils import generate_zmq_certificates_if_needed
 from leap.bitmask.backend.utils import get_backend_certificates
+from leap.bitmask.backend.utils import set_zmq_heartbeats
 from leap.bitmask.config import flags
 from leap.bitmask.logs.utils import get_logger
 
@@ -49,12 +59,23 @@ class _ZMQIOLoop(ioloop.ZMQIOLoop):
         return PollIOLoop.instance()
 
 
-class ZmqREQConnection(threading.Thread):
+class BackendError(Exception):
     """
-    A threaded zmq req connection.
+    The backend failed to run an API call.
     """
 
-    def __init__(self, server_address, on_recv):
+
+class ZmqDEALERConnection(threading.Thread):
+    """
+    A threaded zmq dealer connection.
+
+    If the current ZMQ supports it, the connection to the server is kept
+    alive with ZMTP heartbeats, and on_connection_change is called whenever
+    the server comes up or goes away.
+    """
+
+    def __init__(self, server_address, on_recv, on_connection_change=None,
+                 heartbeat_interval=2, heartbeat_timeout=6):
         """
         Initialize the connection.
 
@@ -62,12 +83,25 @@ class ZmqREQConnection(threading.Thread):
         :type server: str
         :param on_recv: The callback to be executed when a message is
             received.
-        :type on_recv: callable(msg)
+        :type on_recv: callable(msg_parts)
+        :param on_connection_change: The callback to be executed when the
+            connection to the server is made or lost.
+        :type on_connection_change: callable(connected)
+        :param heartbeat_interval: seconds between heartbeats.
+        :type heartbeat_interval: float
+        :param heartbeat_timeout: seconds without an answer to a heartbeat
+            before the server is considered gone.
+        :type heartbeat_timeout: float
         """
         threading.Thread.__init__(self)
         self._server_address = server_address
         self._on_recv = on_recv
+        self._on_connection_change = on_connection_change
+        self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_timeout = heartbeat_timeout
         self._stream = None
+        self._monitor_stream = None
+        self.heartbeats = False
         self._init_zmq()
 
     def _init_zmq(self):
@@ -76,7 +110,7 @@ class ZmqREQConnection(threading.Thread):
         """
         logger.debug("Setting up ZMQ connection to server...")
         context = zmq.Context()
-        socket = context.socket(zmq.REQ)
+        socket = context.socket(zmq.DEALER)
 
         # we use zmq's eventloop in order to asynchronously send requests
         loop = _ZMQIOLoop.instance()
@@ -98,6 +132,18 @@ class ZmqREQConnection(threading.Thread):
 
         self._stream.on_recv(self._on_recv)
 
+        self.heartbeats = set_zmq_heartbeats(
+            socket, self._heartbeat_interval, self._heartbeat_timeout)
+        if self.heartbeats and self._on_connection_change is not None:
+            monitor = socket.get_monitor_socket(
+                zmq.EVENT_CONNECTED | zmq.EVENT_DISCONNECTED)
+            self._monitor_stream = zmqstream.ZMQStream(monitor, loop)
+            self._monitor_stream.on_recv(self._on_monitor_event)
+
+    def _on_monitor_event(self, msg):
+        event = parse_monitor_message(msg)
+        self._on_connection_change(event['event'] == zmq.EVENT_CONNECTED)
+
     def run(self):
         """
         Run the threaded stream connection loop.
@@ -123,16 +169,35 @@ class ZmqREQConnection(threading.Thread):
         # already processing lots of events, but it can cause the message
         # to never send if the zmq socket is the only one it’s handling.
         #
-        # Because of that, we want ZmqREQConnection.send to hand off the
+        # Because of that, we want ZmqDEALERConnection.send to hand off the
         # stream.send to the IOLoop’s thread via IOLoop.add_callback:
         self._stream.io_loop.add_callback(
-            lambda: self._stream.send(*args, **kwargs))
+            lambda: self._stream.send_multipart(*args, **kwargs))
+
+
+def _fire(d, result):
+    """
+    Fire d with result, or fail it if result is a Failure, in the reactor
+    thread.
+    """
+    if isinstance(result, Failure):
+        reactor.callFromThread(d.errback, result)
+    else:
+        reactor.callFromThread(d.callback, result)
 
 
 class BackendProxy(object):
     """
     The BackendProxy handles calls from the GUI and forwards (through ZMQ)
     to the backend.
+
+    The backend emits the signals for each call. A call made with
+    track=True also returns a Deferred that fires with the result of the
+    call once the backend has run it, so several calls can be in flight at
+    the same time. The Deferreds fire in the reactor thread, so tracking
+    needs the Twisted reactor running in the caller process. The GUI does
+    not run it, and only listens to the signals, so the calls are not
+    tracked by default.
     """
 
     if flags.ZMQ_HAS_CURVE:
@@ -141,7 +206,9 @@ class BackendProxy(object):
     else:
         SERVER = "ipc:///tmp/bitmask.socket.0"
 
-    PING_INTERVAL = 2  # secs
+    PING_INTERVAL = 2  # secs, only used without ZMTP heartbeats
+    HEARTBEAT_INTERVAL = 2  # secs
+    HEARTBEAT_TIMEOUT = 6  # secs
 
     def __init__(self):
         """
@@ -150,20 +217,72 @@ class BackendProxy(object):
         generate_zmq_certificates_if_needed()
         self._do_work = threading.Event()
         self._work_lock = threading.Lock()
-        self._connection = ZmqREQConnection(self.SERVER, self._set_online)
-        self._heartbeat = threading.Timer(self.PING_INTERVAL,
-                                          self._heartbeat_loop)
+        self._connection = ZmqDEALERConnection(
+            self.SERVER, self._on_recv,
+            on_connection_change=self._on_connection_change,
+            heartbeat_interval=self.HEARTBEAT_INTERVAL,
+            heartbeat_timeout=self.HEARTBEAT_TIMEOUT)
+        self._counter = itertools.count()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # the connection tells us when the backend comes and goes if it has
+        # heartbeats, otherwise we have to ping it.
+        self._heartbeat = None
+        if not self._connection.heartbeats:
+            self._heartbeat = threading.Timer(self.PING_INTERVAL,
+                                              self._heartbeat_loop)
         self._ping_event = threading.Event()
         self.online = False
         self.settings = Settings()
 
-    def _set_online(self, _):
+    def _on_recv(self, msg):
         """
-        Mark the backend as being online.
+        Fire the Deferred of the call that the received reply answers.
+
+        This is used as the zmq connection's on_recv callback, so it runs in
+        the zmq loop thread, and the Deferred is fired in the reactor thread.
+
+        :param msg: the request id and the json-encoded response.
+        :type msg: list of str
+        """
+        self._set_online()
+
+        request_id, response_json = msg
+        with self._pending_lock:
+            d = self._pending.pop(request_id, None)
+        if d is None:
+            # a ping, or a call that does not care about its result
+            return
+
+        try:
+            response = json.loads(response_json)
+        except ValueError as e:
+            _fire(d, Failure(
+                BackendError("Malformed response: {0!r}".format(e))))
+            return
+
+        if response.get('error') is not None:
+            _fire(d, Failure(BackendError(response['error'])))
+        else:
+            _fire(d, response.get('result'))
 
-        This is used as the zmq connection's on_recv callback, and so it is
-        passed the received message as a parameter. Because we currently don't
-        use that message, we just ignore it for now.
+    def _on_connection_change(self, connected):
+        """
+        Mark the backend as online or offline when the connection to it is
+        made or lost (or its heartbeats time out).
+
+        :param connected: whether the connection is up.
+        :type connected: bool
+        """
+        if connected:
+            self._set_online()
+        else:
+            logger.warning("Lost the connection to the backend.")
+            self._set_offline()
+
+    def _set_online(self):
+        """
+        Mark the backend as being online.
         """
         self.online = True
         # the following event is used when checking whether the backend is
@@ -175,6 +294,7 @@ class BackendProxy(object):
         Mark the backend as being offline.
         """
         self.online = False
+        self._ping_event.clear()
 
     def check_online(self):
         """
@@ -183,7 +303,7 @@ class BackendProxy(object):
         :rtype: bool
         """
         logger.debug("Checking whether backend is online...")
-        self._send_request(PING_REQUEST)
+        self._send_request(PING_REQUEST, track=False)
         # self._ping_event will eventually be set by the zmq connection's
         # on_recv callback, so we use a small timeout in order to response
         # quickly if the backend is offline
@@ -200,7 +320,8 @@ class BackendProxy(object):
         self._do_work.set()
         self._connection.start()
         self.check_online()
-        self._heartbeat.start()
+        if self._heartbeat is not None:
+            self._heartbeat.start()
 
     def _stop(self):
         """
@@ -208,8 +329,15 @@ class BackendProxy(object):
         """
         with self._work_lock:  # avoid sending after connection was closed
             self._do_work.clear()
-            self._heartbeat.cancel()
+            if self._heartbeat is not None:
+                self._heartbeat.cancel()
         self._connection.stop()
+
+        with self._pending_lock:
+            pending = self._pending.values()
+            self._pending.clear()
+        for d in pending:
+            _fire(d, Failure(BackendError("The backend proxy was stopped.")))
         logger.debug("BackendProxy worker stopped.")
 
     def _heartbeat_loop(self):
@@ -217,7 +345,7 @@ class BackendProxy(object):
         Sends a PING request every PING_INTERVAL just to know that the server
         is alive.
         """
-        self._send_request(PING_REQUEST)
+        self._send_request(PING_REQUEST, track=False)
 
         # lets acquire the lock to prevent heartbeat timer to get cancel while
         # we set a new one
@@ -234,7 +362,14 @@ class BackendProxy(object):
         :param kwargs: named arguments to forward to the backend api method.
         :type kwargs: dict
 
-        Note: is mandatory to have the kwarg 'api_method' defined.
+        Note: is mandatory to have the kwarg 'api_method' defined. The kwarg
+        'track' is not forwarded, it tells whether to keep track of the
+        result.
+
+        :return: if tracked, a Deferred that fires with the result of the
+                 call, or fails with BackendError. It fires in the reactor
+                 thread. The caller has to handle its errors.
+        :rtype: Deferred or None
         """
         if args:
             # Use a custom message to be more clear about using kwargs *only*
@@ -243,6 +378,7 @@ class BackendProxy(object):
         api_method = kwargs.pop('api_method', None)
         if api_method is None:
             raise Exception("Missing argument, no method name specified.")
+        track = kwargs.pop('track', False)
 
         request = {
             'api_method': api_method,
@@ -261,23 +397,41 @@ class BackendProxy(object):
             raise
 
         # queue the call in order to handle the request in a thread safe way.
-        self._send_request(request_json)
+        d = self._send_request(request_json, track=track)
 
         if api_method == STOP_REQUEST:
             self._stop()
+        return d
 
-    def _send_request(self, request):
+    def _send_request(self, request, track=False):
         """
-        Send the given request to the server.
-        This is used from a thread safe loop in order to avoid sending a
-        request without receiving a response from a previous one.
+        Send the given request to the server, tagged with a new request id.
 
         :param request: the request to send.
         :type request: str
+        :param track: whether to keep track of the reply.
+        :type track: bool
+
+        :return: a Deferred that fires with the result, if tracked.
+        :rtype: Deferred
         """
+        request_id = str(next(self._counter))
+        d = None
+        if track:
+            d = defer.Deferred()
+            with self._pending_lock:
+                self._pending[request_id] = d
+
         with self._work_lock:  # avoid sending after connection was closed
             if self._do_work.is_set():
-                self._connection.send(request)
+                self._connection.send([request_id, request])
+                return d
+
+        if d is not None:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            d.errback(BackendError("The backend proxy is not running."))
+        return d
 
     def __getattribute__(self, name):
         """
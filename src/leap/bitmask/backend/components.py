@@ -31,6 +31,8 @@ from functools import partial
 
 from twisted.internet import threads, defer, reactor
 from twisted.python import log
+from twisted.python.threadable import isInIOThread
+from twisted.python.failure import Failure
 
 import zope.interface
 import zope.proxy
@@ -41,33 +43,18 @@ from leap.bitmask.crypto.srpauth import SRPAuth
 from leap.bitmask.crypto.srpregister import SRPRegister
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.platform_init import IS_LINUX
-from leap.bitmask import pix
 from leap.bitmask.provider.pinned import PinnedProviders
 from leap.bitmask.provider.providerbootstrapper import ProviderBootstrapper
 from leap.bitmask.services import get_supported, EIP_SERVICE
 from leap.bitmask.services.eip import eipconfig
-from leap.bitmask.services.eip import get_openvpn_management
-from leap.bitmask.services.eip.eipbootstrapper import EIPBootstrapper
-
-from leap.bitmask.services.eip import vpnlauncher, vpnprocess
-from leap.bitmask.services.eip import linuxvpnlauncher, darwinvpnlauncher
-from leap.bitmask.services.eip import get_vpn_launcher
-
-from leap.bitmask.services.mail.imapcontroller import IMAPController
-from leap.bitmask.services.mail.smtpbootstrapper import SMTPBootstrapper
-from leap.bitmask.services.mail.smtpconfig import SMTPConfig
-
-from leap.bitmask.services.soledad.soledadbootstrapper import \
-    SoledadBootstrapper
 from leap.bitmask.util import force_eval
-from leap.bitmask.util.privilege_policies import LinuxPolicyChecker
+from leap.bitmask.util.resolver import dns_cache
 
 from leap.common import certs as leap_certs
 
-from leap.keymanager import openpgp
-
-from leap.soledad.client.secrets import PassphraseTooShort
-from leap.soledad.client.secrets import NoStorageSecret
+# NOTE: the modules that only one component needs (the vpn launchers, the
+# soledad, keymanager and mail stacks) are imported by that component, so
+# that they are only loaded if the component is used. See LeapBackend.
 
 logger = get_logger()
 
@@ -230,7 +217,8 @@ class Provider(object):
 
     def get_supported_services(self, domain):
         """
-        Signal a list of supported services provided by the given provider.
+        Signal and return a list of supported services provided by the given
+        provider.
 
         :param domain: the provider to get the services from.
         :type domain: str
@@ -242,10 +230,12 @@ class Provider(object):
 
         self._signaler.signal(
             self._signaler.prov_get_supported_services, services)
+        return services
 
     def get_all_services(self, providers):
         """
-        Signal a list of services provided by all the configured providers.
+        Signal and return a list of services provided by all the configured
+        providers.
 
         :param providers: the list of providers to get the services.
         :type providers: list
@@ -259,12 +249,14 @@ class Provider(object):
             services = self._get_services(domain)
             services_all = services_all.union(set(services))
 
+        services_all = list(services_all)
         self._signaler.signal(
-            self._signaler.prov_get_all_services, list(services_all))
+            self._signaler.prov_get_all_services, services_all)
+        return services_all
 
     def get_details(self, domain, lang=None):
         """
-        Signal a dict with the current ProviderConfig settings.
+        Signal and return a dict with the current ProviderConfig settings.
 
         :param domain: the domain name of the provider.
         :type domain: str
@@ -274,20 +266,21 @@ class Provider(object):
         Signals:
             prov_get_details -> dict
         """
-        self._signaler.signal(
-            self._signaler.prov_get_details,
-            self._provider_config.get_light_config(domain, lang))
+        details = self._provider_config.get_light_config(domain, lang)
+        self._signaler.signal(self._signaler.prov_get_details, details)
+        return details
 
     def get_pinned_providers(self):
         """
-        Signal the list of pinned provider domains.
+        Signal and return the list of pinned provider domains.
 
         Signals:
             prov_get_pinned_providers -> list of provider domains
         """
+        domains = PinnedProviders.domains()
         self._signaler.signal(
-            self._signaler.prov_get_pinned_providers,
-            PinnedProviders.domains())
+            self._signaler.prov_get_pinned_providers, domains)
+        return domains
 
 
 class Register(object):
@@ -342,6 +335,14 @@ class EIP(object):
 
     zope.interface.implements(ILEAPService)
 
+    MAX_FW_WAIT_RETRIES = 25
+    FW_WAIT_STEP = 0.5  # secs
+
+    # The EIP config and the client certificate checked against the provider
+    # this long ago are used right away to connect, and checked again in the
+    # background. 0 disables the warm starts.
+    WARM_START_MAX_AGE = 12 * 60 * 60  # secs
+
     def __init__(self, signaler=None):
         """
         Constructor for the EIP component
@@ -350,11 +351,22 @@ class EIP(object):
                          back to the frontend
         :type signaler: Signaler
         """
+        from leap.bitmask.services.eip import vpnprocess
+        from leap.bitmask.services.eip.eipbootstrapper import EIPBootstrapper
+
         self.key = "eip"
         self._signaler = signaler
         self._eip_bootstrapper = EIPBootstrapper(signaler)
+        # checks the config in the background on warm starts. Without a
+        # signaler it has no signals to emit, so it is silent, and its
+        # failures reach _eip_refresh_failed.
+        self._eip_refresher = EIPBootstrapper()
         self._eip_setup_defer = None
+        # the config signaled by the last warm setup, for the next start
+        self._warm_eip_config = None
         self._provider_config = ProviderConfig()
+        self._fw_wait = None
+        self._fw_wait_call = None
 
         self._vpn = vpnprocess.VPN(signaler=signaler)
 
@@ -362,6 +374,10 @@ class EIP(object):
         """
         Initiate the setup for a provider
 
+        If the EIP config and the client certificate were checked less than
+        WARM_START_MAX_AGE seconds ago, they are signaled as ready right
+        away, and checked again in the background.
+
         :param domain: URL for the provider
         :type domain: unicode
         :param skip_network: Whether checks that involve network should be done
@@ -373,10 +389,13 @@ class EIP(object):
         """
         config = ProviderConfig.get_provider_config(domain)
         self._provider_config = config
+        self._warm_eip_config = None
         if config is not None:
             if skip_network:
                 return defer.Deferred()
             eb = self._eip_bootstrapper
+            if eb.is_fresh(config, self.WARM_START_MAX_AGE):
+                return self._warm_setup_eip(config)
             d = eb.run_eip_setup_checks(self._provider_config,
                                         download_if_needed=True)
             self._eip_setup_defer = d
@@ -384,6 +403,52 @@ class EIP(object):
         else:
             raise Exception("No provider setup loaded")
 
+    def _warm_setup_eip(self, provider_config):
+        """
+        Signal the EIP config and the client certificate as ready, and check
+        them against the provider in the background. A config that changed
+        is used from the next connection on, after a cold setup.
+
+        :param provider_config: the provider to setup.
+        :type provider_config: ProviderConfig
+
+        :returns: the defer for the background check.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        domain = provider_config.get_domain()
+        api_version = provider_config.get_api_version()
+        self._warm_eip_config = eipconfig.EIPConfig.get_eip_config(
+            domain, api_version)
+        serial = self._warm_eip_config.get_serial()
+        logger.debug("Warm start for %s, EIP config serial %s" %
+                     (domain, serial))
+
+        eb = self._eip_bootstrapper
+        if self._signaler is not None:
+            passed = {eb.PASSED_KEY: True, eb.ERROR_KEY: ""}
+            self._signaler.signal(self._signaler.eip_config_ready, passed)
+            self._signaler.signal(
+                self._signaler.eip_client_certificate_ready, passed)
+
+        d = self._eip_refresher.run_eip_setup_checks(
+            provider_config, download_if_needed=True)
+        d.addCallback(self._eip_refreshed, domain, api_version, serial)
+        d.addErrback(self._eip_refresh_failed, domain)
+        return d
+
+    def _eip_refreshed(self, _, domain, api_version, serial):
+        eip_config = eipconfig.EIPConfig.get_eip_config(domain, api_version)
+        if eip_config is not None and eip_config.get_serial() != serial:
+            logger.info("The EIP config for %s changed (serial %s -> %s), "
+                        "it will be used on the next connection." %
+                        (domain, serial, eip_config.get_serial()))
+            # the next setup signals what changed, instead of a warm start
+            self._eip_refresher.forget(domain)
+
+    def _eip_refresh_failed(self, failure, domain):
+        logger.warning("Could not check the EIP config for %s: %r" %
+                       (domain, failure.value))
+
     def cancel_setup_eip(self):
         """
         Cancel the ongoing setup eip defer (if any).
@@ -399,19 +464,24 @@ class EIP(object):
         :param restart: whether is is a restart.
         :type restart: bool
         """
+        from leap.bitmask.services.eip import get_openvpn_management
+
         provider_config = self._provider_config
-        eip_config = eipconfig.EIPConfig()
         domain = provider_config.get_domain()
 
-        loaded = eipconfig.load_eipconfig_if_needed(
-            provider_config, eip_config, domain)
+        # after a warm setup, the config that it signaled, even if the
+        # background check is writing a new one right now
+        eip_config, self._warm_eip_config = self._warm_eip_config, None
+        if eip_config is None:
+            eip_config = eipconfig.EIPConfig.get_eip_config(
+                domain, provider_config.get_api_version())
 
-        if not self._can_start(domain):
+        if not self._can_start(domain, eip_config):
             if self._signaler is not None:
                 self._signaler.signal(self._signaler.eip_connection_aborted)
             return
 
-        if not loaded:
+        if eip_config is None:
             if self._signaler is not None:
                 self._signaler.signal(self._signaler.eip_connection_aborted)
             logger.error("Tried to start EIP but cannot find any "
@@ -428,6 +498,10 @@ class EIP(object):
         """
         Start the service.
         """
+        from leap.bitmask.services.eip import vpnlauncher, vpnprocess
+        from leap.bitmask.services.eip import linuxvpnlauncher
+        from leap.bitmask.services.eip import darwinvpnlauncher
+
         signaler = self._signaler
 
         if not self._provider_config.loaded():
@@ -436,6 +510,9 @@ class EIP(object):
                                   "no provider loaded")
             return
 
+        # starting again makes the wait for the firewall to come down moot
+        reactor.callFromThread(self._cancel_firewall_wait)
+
         try:
             self._start_eip(*args, **kwargs)
         except vpnprocess.OpenVPNAlreadyRunning:
@@ -462,42 +539,112 @@ class EIP(object):
     def stop(self, shutdown=False, restart=False):
         """
         Stop the service.
+
+        This returns once openvpn has been asked to terminate, the wait for
+        the firewall to come down goes on in the reactor. The steps of the
+        bring down sequence are signaled with eip_stop_progress, and
+        eip_stopped once the firewall is down.
         """
-        self._vpn.terminate(shutdown, restart)
+        self._signal_stop_progress('stopping_openvpn')
+        d = self._vpn.terminate(shutdown, restart)
+        if shutdown and not isInIOThread():
+            # the backend goes away after this, so wait for the SIGTERM
+            threads.blockingCallFromThread(reactor, lambda: d)
         if IS_LINUX:
-            self._wait_for_firewall_down()
+            reactor.callFromThread(self._wait_for_firewall_down)
+
+    def _signal_stop_progress(self, step, started=None, **kwargs):
+        if self._signaler is None:
+            return
+        progress = dict(kwargs, step=step)
+        if started is not None:
+            progress['elapsed'] = time.time() - started
+        self._signaler.signal(self._signaler.eip_stop_progress, progress)
 
     def _wait_for_firewall_down(self):
         """
-        Wait for the firewall to come down.
+        Wait for the firewall to come down, checking every FW_WAIT_STEP
+        seconds, up to MAX_FW_WAIT_RETRIES times. Only the checks run in a
+        thread, the waits between them are reactor timers.
+
+        It must be called from the reactor thread. A wait that is still
+        going on is cancelled.
+
+        :return: a Deferred that fires with whether the firewall came down,
+                 and that can be cancelled to stop waiting.
+        :rtype: Deferred
         """
         # Due to how we delay the resolvconf action in linux.
         # XXX this *has* to wait for a reasonable lapse, since we have some
         # delay in vpn.terminate.
         # For a better solution it should be signaled from backend that
         # everything is clear to proceed, or a timeout happened.
-        MAX_FW_WAIT_RETRIES = 25
-        FW_WAIT_STEP = 0.5
+        self._cancel_firewall_wait()
+
+        d = defer.Deferred(canceller=self._cancel_firewall_check)
+        d.addBoth(self._firewall_wait_done, time.time())
+        self._fw_wait = d
+        self._check_firewall(d, 1)
+        return d
+
+    def _check_firewall(self, d, retry):
+        self._fw_wait_call = None
+        self._signal_stop_progress('waiting_for_firewall', retry=retry,
+                                   max_retries=self.MAX_FW_WAIT_RETRIES)
+
+        check = threads.deferToThread(self._vpn.is_fw_down)
+        check.addErrback(self._firewall_check_failed)
+        check.addCallback(self._firewall_checked, d, retry)
+
+    def _firewall_check_failed(self, failure):
+        logger.error("Could not check the firewall: {0!r}".format(failure))
+        return False
+
+    def _firewall_checked(self, is_down, d, retry):
+        if d.called:
+            # cancelled while checking
+            return
+        if is_down:
+            d.callback(True)
+        elif retry >= self.MAX_FW_WAIT_RETRIES:
+            d.callback(False)
+        else:
+            self._fw_wait_call = reactor.callLater(
+                self.FW_WAIT_STEP, self._check_firewall, d, retry + 1)
 
-        retry = 1
+    def _cancel_firewall_check(self, d):
+        call = self._fw_wait_call
+        if call is not None and call.active():
+            call.cancel()
+        self._fw_wait_call = None
 
-        while retry <= MAX_FW_WAIT_RETRIES:
-            if self._vpn.is_fw_down():
+    def _cancel_firewall_wait(self):
+        if self._fw_wait is not None:
+            self._fw_wait.cancel()
+
+    def _firewall_wait_done(self, result, started):
+        self._fw_wait = None
+
+        if isinstance(result, Failure):
+            result.trap(defer.CancelledError)
+            self._signal_stop_progress('cancelled', started)
+            return False
+
+        if result:
+            self._signal_stop_progress('firewall_down', started)
+            if self._signaler is not None:
                 self._signaler.signal(self._signaler.eip_stopped)
-                return
-            else:
-                # msg = "Firewall is not down yet, waiting... {0} of {1}"
-                # msg = msg.format(retry, MAX_FW_WAIT_RETRIES)
-                # logger.debug(msg)
-                time.sleep(FW_WAIT_STEP)
-                retry += 1
-        logger.warning("After waiting, firewall is not down... "
-                       "You might experience lack of connectivity")
+        else:
+            self._signal_stop_progress('firewall_timeout', started)
+            logger.warning("After waiting, firewall is not down... "
+                           "You might experience lack of connectivity")
+        return result
 
     def terminate(self):
         """
         Terminate the service, not necessarily in a nice way.
         """
+        reactor.callFromThread(self._cancel_firewall_wait)
         self._vpn.killit()
 
     def status(self):
@@ -546,6 +693,18 @@ class EIP(object):
             self._signaler.signal(self._signaler.eip_get_initialized_providers,
                                   filtered_domains)
 
+    def get_traffic(self):
+        """
+        Signal and return the traffic since openvpn started.
+
+        Signals:
+            eip_get_traffic -> dict, or None if openvpn is not running
+        """
+        traffic = self._vpn.get_traffic()
+        if self._signaler is not None:
+            self._signaler.signal(self._signaler.eip_get_traffic, traffic)
+        return traffic
+
     def tear_fw_down(self):
         """
         Tear the firewall down.
@@ -579,20 +738,20 @@ class EIP(object):
         provider_config = ProviderConfig.get_provider_config(domain)
         if EIP_SERVICE not in provider_config.get_services():
             return
-        eip_config = eipconfig.EIPConfig()
-
-        api_version = provider_config.get_api_version()
-        eip_config.set_api_version(api_version)
-        eip_loaded = eip_config.load(eipconfig.get_eipconfig_path(domain))
+        eip_config = eipconfig.EIPConfig.get_eip_config(
+            domain, provider_config.get_api_version())
 
         # check for other problems
-        if not eip_loaded or provider_config is None:
+        if eip_config is None or provider_config is None:
             if self._signaler is not None:
                 self._signaler.signal(
                     self._signaler.eip_get_gateways_list_error)
             return
 
-        gateways = eipconfig.VPNGatewaySelector(eip_config).get_gateways_list()
+        settings = Settings()
+        gateway_selector = eipconfig.VPNGatewaySelector(
+            eip_config, measured=settings.get_measure_gateways(), probe=False)
+        gateways = gateway_selector.get_gateways_list()
 
         if self._signaler is not None:
             self._signaler.signal(
@@ -612,14 +771,17 @@ class EIP(object):
         """
         settings = Settings()
 
-        eip_config = eipconfig.EIPConfig()
         provider_config = ProviderConfig.get_provider_config(domain)
+        eip_config = eipconfig.EIPConfig.get_eip_config(
+            domain, provider_config.get_api_version())
+        if eip_config is None:
+            logger.warning("Could not load the EIP config for %s, not "
+                           "signaling its gateway country code" % (domain,))
+            return
 
-        api_version = provider_config.get_api_version()
-        eip_config.set_api_version(api_version)
-        eip_config.load(eipconfig.get_eipconfig_path(domain))
-
-        gateway_selector = eipconfig.VPNGatewaySelector(eip_config)
+        # the same order the launcher used, without probing again
+        gateway_selector = eipconfig.VPNGatewaySelector(
+            eip_config, measured=settings.get_measure_gateways(), probe=False)
         gateway_conf = settings.get_selected_gateway(domain)
 
         if gateway_conf == GATEWAY_AUTOMATIC:
@@ -641,14 +803,19 @@ class EIP(object):
         self._signaler.signal(self._signaler.eip_get_gateway_country_code,
                               gateway_ccode)
 
-    def _can_start(self, domain):
+    def _can_start(self, domain, eip_config=None):
         """
         Returns True if it has everything that is needed to run EIP,
         False otherwise
 
         :param domain: the domain for the provider to check
         :type domain: str
+        :param eip_config: the EIP config to check, the one on disk if None.
+        :type eip_config: EIPConfig
         """
+        from leap.bitmask.services.eip import get_vpn_launcher
+        from leap.bitmask.util.privilege_policies import LinuxPolicyChecker
+
         if IS_LINUX and not LinuxPolicyChecker.is_up():
             logger.error("No polkit agent running.")
             return False
@@ -656,11 +823,9 @@ class EIP(object):
         provider_config = ProviderConfig.get_provider_config(domain)
         if EIP_SERVICE not in provider_config.get_services():
             return False
-        eip_config = eipconfig.EIPConfig()
-
-        api_version = provider_config.get_api_version()
-        eip_config.set_api_version(api_version)
-        eip_loaded = eip_config.load(eipconfig.get_eipconfig_path(domain))
+        if eip_config is None:
+            eip_config = eipconfig.EIPConfig.get_eip_config(
+                domain, provider_config.get_api_version())
 
         launcher = get_vpn_launcher()
         ovpn_path = force_eval(launcher.OPENVPN_BIN_PATH)
@@ -670,7 +835,7 @@ class EIP(object):
             return False
 
         # check for other problems
-        if not eip_loaded or provider_config is None:
+        if eip_config is None or provider_config is None:
             logger.error("Cannot load provider and eip config, cannot "
                          "autostart")
             return False
@@ -714,37 +879,18 @@ class EIP(object):
         :param domain: the domain to check.
         :type domain: str
         """
-        def do_check():
-            """
-            Try to resolve the domain name.
-            """
-            socket.gethostbyname(domain.encode('idna'))
-
-        def check_ok(_):
-            """
-            Callback handler for `do_check`.
-            """
-            self._signaler.signal(self._signaler.eip_dns_ok)
-            logger.debug("DNS check OK")
-
-        def check_err(failure):
-            """
-            Errback handler for `do_check`.
-
-            :param failure: the failure that triggered the errback.
-            :type failure: twisted.python.failure.Failure
-            """
-            logger.debug("Can't resolve hostname. {0!r}".format(failure))
-
-            self._signaler.signal(self._signaler.eip_dns_error)
-
+        # this already runs in a worker thread, and a cached answer (or
+        # failure) is reported without touching the network
+        try:
+            dns_cache.resolve(domain)
+        except socket.error as e:
             # python 2.7.4 raises socket.error
             # python 2.7.5 raises socket.gaierror
-            failure.trap(socket.gaierror, socket.error)
-
-        d = threads.deferToThread(do_check)
-        d.addCallback(check_ok)
-        d.addErrback(check_err)
+            logger.debug("Can't resolve hostname. {0!r}".format(e))
+            self._signaler.signal(self._signaler.eip_dns_error)
+        else:
+            self._signaler.signal(self._signaler.eip_dns_ok)
+            logger.debug("DNS check OK")
 
 
 class Soledad(object):
@@ -765,6 +911,9 @@ class Soledad(object):
                          back to the frontend
         :type signaler: Signaler
         """
+        from leap.bitmask.services.soledad.soledadbootstrapper import \
+            SoledadBootstrapper
+
         self.key = "soledad"
         self._soledad_proxy = soledad_proxy
         self._keymanager_proxy = keymanager_proxy
@@ -903,6 +1052,9 @@ class Soledad(object):
         :param failure: failure object containing problem.
         :type failure: twisted.python.failure.Failure
         """
+        from leap.soledad.client.secrets import PassphraseTooShort
+        from leap.soledad.client.secrets import NoStorageSecret
+
         if failure.check(NoStorageSecret):
             logger.error("No storage secret for password change in Soledad.")
         if failure.check(PassphraseTooShort):
@@ -969,6 +1121,8 @@ class Keymanager(object):
         :param filename: the name of the file where we want to save the keys.
         :type filename: str
         """
+        from leap.keymanager import openpgp
+
         keymanager = self._keymanager_proxy
 
         def export(keys):
@@ -1007,6 +1161,8 @@ class Keymanager(object):
         """
         Get information on our primary key pair
         """
+        from leap.keymanager import openpgp
+
         def signal_details(public_key):
             self._signaler.signal(self._signaler.keymanager_key_details,
                                   dict(public_key))
@@ -1037,6 +1193,11 @@ class Mail(object):
                          back to the frontend
         :type signaler: Signaler
         """
+        from leap.bitmask.services.mail.imapcontroller import IMAPController
+        from leap.bitmask.services.mail.smtpbootstrapper import \
+            SMTPBootstrapper
+        from leap.bitmask.services.mail.smtpconfig import SMTPConfig
+
         self.key = "mail"
         self._signaler = signaler
         self._soledad_proxy = soledad_proxy
@@ -1109,6 +1270,8 @@ class Mail(object):
         return threads.deferToThread(self._stop_imap_service)
 
     def start_pixelated_service(self, full_user_id):
+        from leap.bitmask import pix
+
         if pix.HAS_PIXELATED:
             reactor.callFromThread(
                 pix.start_pixelated_user_agent,
@@ -17,6 +17,8 @@
 """
 Backend for everything
 """
+import threading
+
 import zope.interface
 import zope.proxy
 
@@ -24,6 +26,7 @@ from leap.bitmask.backend import components
 from leap.bitmask.backend.backend import Backend
 from leap.bitmask.backend.settings import Settings
 from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.util.resolver import dns_cache
 
 logger = get_logger()
 
@@ -31,11 +34,59 @@ ERROR_KEY = "error"
 PASSED_KEY = "passed"
 
 
+class _Component(object):
+    """
+    A backend component that is created the first time it is used.
+    """
+
+    def __init__(self, prefix):
+        """
+        :param prefix: the prefix of the API methods that the component
+                       implements, used as the key in the COMPONENTS registry.
+        :type prefix: str
+        """
+        self.prefix = prefix
+
+    def __get__(self, backend, owner):
+        if backend is None:
+            return self
+        return backend.get_component(self.prefix)
+
+
 class LeapBackend(Backend):
     """
     Backend server subclass, used to implement the API methods.
+
+    The components are only created (and their dependencies imported) when
+    one of their API methods is called for the first time, so that the
+    backend of an EIP-only or a mail-only client does not load the others.
     """
 
+    # API method prefix -> factory of the component that implements them
+    COMPONENTS = {
+        'provider': lambda b: components.Provider(b._signaler,
+                                                  b._bypass_checks),
+        'register': lambda b: components.Register(b._signaler),
+        'user': lambda b: components.Authenticate(b._signaler),
+        'eip': lambda b: components.EIP(b._signaler),
+        'soledad': lambda b: components.Soledad(b._soledad_proxy,
+                                                b._keymanager_proxy,
+                                                b._signaler),
+        'keymanager': lambda b: components.Keymanager(b._keymanager_proxy,
+                                                      b._signaler),
+        'mail': lambda b: components.Mail(b._soledad_proxy,
+                                          b._keymanager_proxy,
+                                          b._signaler),
+    }
+
+    _provider = _Component('provider')
+    _register = _Component('register')
+    _authenticate = _Component('user')
+    _eip = _Component('eip')
+    _soledad = _Component('soledad')
+    _keymanager = _Component('keymanager')
+    _mail = _Component('mail')
+
     def __init__(self, bypass_checks=False, frontend_pid=None):
         """
         Constructor for the backend.
@@ -43,25 +94,62 @@ class LeapBackend(Backend):
         Backend.__init__(self, frontend_pid)
 
         self._settings = Settings()
+        self._bypass_checks = bypass_checks
 
         # Objects needed by several components, so we make a proxy and pass
         # them around
         self._soledad_proxy = zope.proxy.ProxyBase(None)
         self._keymanager_proxy = zope.proxy.ProxyBase(None)
 
-        # Component instances creation
-        self._provider = components.Provider(self._signaler, bypass_checks)
-        self._register = components.Register(self._signaler)
-        self._authenticate = components.Authenticate(self._signaler)
-        self._eip = components.EIP(self._signaler)
-        self._soledad = components.Soledad(self._soledad_proxy,
-                                           self._keymanager_proxy,
-                                           self._signaler)
-        self._keymanager = components.Keymanager(self._keymanager_proxy,
-                                                 self._signaler)
-        self._mail = components.Mail(self._soledad_proxy,
-                                     self._keymanager_proxy,
-                                     self._signaler)
+        self._components = {}
+        self._components_lock = threading.Lock()
+
+    def get_component(self, prefix):
+        """
+        Get the component for the given API method prefix, creating it if
+        this is the first time it is used.
+
+        The API methods run in worker threads, so this may be called from
+        several threads at the same time.
+
+        :param prefix: the API method prefix, as in COMPONENTS.
+        :type prefix: str
+        """
+        with self._components_lock:
+            component = self._components.get(prefix)
+            if component is None:
+                logger.debug("Loading the {0} component".format(prefix))
+                component = self.COMPONENTS[prefix](self)
+                self._components[prefix] = component
+            return component
+
+    def get_loaded_component(self, prefix):
+        """
+        Get the component for the given API method prefix if it has already
+        been created, without creating it.
+
+        The stop and close API methods use this, since there is nothing to
+        stop in a component that was never used.
+
+        :param prefix: the API method prefix, as in COMPONENTS.
+        :type prefix: str
+
+        :rtype: the component, or None if it has not been created
+        """
+        with self._components_lock:
+            return self._components.get(prefix)
+
+    def backend_get_stats(self):
+        """
+        Return the state of the worker pool, which of the components have
+        been loaded, and the hits of the DNS cache.
+
+        :rtype: dict
+        """
+        stats = Backend.backend_get_stats(self)
+        stats['components'] = sorted(self._components)
+        stats['dns_cache'] = dns_cache.stats()
+        return stats
 
     def _check_type(self, obj, expected_type):
         """
@@ -114,7 +202,8 @@ class LeapBackend(Backend):
 
     def provider_get_supported_services(self, domain):
         """
-        Signal a list of supported services provided by the given provider.
+        Signal and return a list of supported services provided by the given
+        provider.
 
         :param domain: the provider to get the services from.
         :type domain: str
@@ -122,11 +211,12 @@ class LeapBackend(Backend):
         Signals:
             prov_get_supported_services -> list of unicode
         """
-        self._provider.get_supported_services(domain)
+        return self._provider.get_supported_services(domain)
 
     def provider_get_all_services(self, providers):
         """
-        Signal a list of services provided by all the configured providers.
+        Signal and return a list of services provided by all the configured
+        providers.
 
         :param providers: the list of providers to get the services.
         :type providers: list
@@ -134,11 +224,11 @@ class LeapBackend(Backend):
         Signals:
             prov_get_all_services -> list of unicode
         """
-        self._provider.get_all_services(providers)
+        return self._provider.get_all_services(providers)
 
     def provider_get_details(self, domain, lang):
         """
-        Signal a dict with the current ProviderConfig settings.
+        Signal and return a dict with the current ProviderConfig settings.
 
         :param domain: the domain name of the provider.
         :type domain: str
@@ -148,16 +238,16 @@ class LeapBackend(Backend):
         Signals:
             prov_get_details -> dict
         """
-        self._provider.get_details(domain, lang)
+        return self._provider.get_details(domain, lang)
 
     def provider_get_pinned_providers(self):
         """
-        Signal the pinned providers.
+        Signal and return the pinned providers.
 
         Signals:
             prov_get_pinned_providers -> list of provider domains
         """
-        self._provider.get_pinned_providers()
+        return self._provider.get_pinned_providers()
 
     def user_register(self, provider, username, password):
         """
@@ -198,7 +288,9 @@ class LeapBackend(Backend):
         """
         Cancel the ongoing setup EIP (if any).
         """
-        self._eip.cancel_setup_eip()
+        eip = self.get_loaded_component('eip')
+        if eip is not None:
+            eip.cancel_setup_eip()
 
     def eip_start(self, restart=False):
         """
@@ -219,7 +311,7 @@ class LeapBackend(Backend):
             eip_process_restart_ping
             eip_process_restart_tls
             eip_state_changed -> str
-            eip_status_changed -> tuple of str (download, upload)
+            eip_status_changed -> dict with the upload and download traffic
             eip_vpn_launcher_exception
 
         :param restart: whether is is a restart.
@@ -237,13 +329,21 @@ class LeapBackend(Backend):
         :param restart: whether this is part of a restart.
         :type restart: bool
         """
-        self._eip.stop(shutdown, restart)
+        if shutdown:
+            eip = self.get_loaded_component('eip')
+            if eip is None:
+                return
+        else:
+            eip = self._eip
+        eip.stop(shutdown, restart)
 
     def eip_terminate(self):
         """
         Terminate the EIP service, not necessarily in a nice way.
         """
-        self._eip.terminate()
+        eip = self.get_loaded_component('eip')
+        if eip is not None:
+            eip.terminate()
 
     def eip_get_gateways_list(self, domain):
         """
@@ -259,6 +359,16 @@ class LeapBackend(Backend):
         """
         self._eip.get_gateways_list(domain)
 
+    def eip_get_traffic(self):
+        """
+        Signal and return the traffic since openvpn started: the total bytes
+        and the rates in bytes per second, of the upload and the download.
+
+        Signals:
+            eip_get_traffic -> dict, or None if openvpn is not running
+        """
+        return self._eip.get_traffic()
+
     def eip_get_gateway_country_code(self, domain):
         """
         Signal a list of gateways for the given provider.
@@ -449,13 +559,17 @@ class LeapBackend(Backend):
         """
         Cancel the ongoing soledad bootstrapping process (if any).
         """
-        self._soledad.cancel_bootstrap()
+        soledad = self.get_loaded_component('soledad')
+        if soledad is not None:
+            soledad.cancel_bootstrap()
 
     def soledad_close(self):
         """
         Close soledad database.
         """
-        self._soledad.close()
+        soledad = self.get_loaded_component('soledad')
+        if soledad is not None:
+            soledad.close()
 
     def keymanager_list_keys(self):
         """
@@ -44,6 +44,7 @@ class LeapSignaler(SignalerQt):
     eip_get_gateways_list = QtCore.Signal(object)
     eip_get_gateways_list_error = QtCore.Signal()
     eip_get_initialized_providers = QtCore.Signal(object)
+    eip_get_traffic = QtCore.Signal(object)
     eip_network_unreachable = QtCore.Signal()
     eip_no_gateway = QtCore.Signal()
     eip_no_pkexec_error = QtCore.Signal()
@@ -55,7 +56,8 @@ class LeapSignaler(SignalerQt):
     eip_process_restart_ping = QtCore.Signal()
     eip_process_restart_tls = QtCore.Signal()
     eip_state_changed = QtCore.Signal(dict)
-    eip_status_changed = QtCore.Signal(dict)
+    eip_status_changed = QtCore.Signal(object)
+    eip_stop_progress = QtCore.Signal(dict)
     eip_stopped = QtCore.Signal()
     eip_tear_fw_down = QtCore.Signal(object)
     eip_bitmask_root_vpn_down = QtCore.Signal(object)
@@ -39,6 +39,7 @@ class Settings(object):
 
     # keys
     GATEWAY_KEY = "Gateway"
+    MEASURE_GATEWAYS_KEY = "MeasureGateways"
 
     def __init__(self):
         """
@@ -122,6 +123,30 @@ class Settings(object):
         self._settings.set(provider, self.GATEWAY_KEY, gateway)
         self._save()
 
+    def get_measure_gateways(self):
+        """
+        Return whether the automatic gateway selection should measure the
+        latency to the gateways, instead of going just by timezone.
+
+        :rtype: bool
+        """
+        value = self._get_value(GENERAL_SECTION, self.MEASURE_GATEWAYS_KEY,
+                                "false")
+        return value.lower() == "true"
+
+    def set_measure_gateways(self, measure):
+        """
+        Set whether the automatic gateway selection should measure the
+        latency to the gateways.
+
+        :param measure: whether to measure it.
+        :type measure: bool
+        """
+        leap_assert_type(measure, bool)
+        self._settings.set(GENERAL_SECTION, self.MEASURE_GATEWAYS_KEY,
+                           str(measure))
+        self._save()
+
     def get_uuid(self, full_user_id):
         """
         Gets the uuid for a given username.
@@ -22,6 +22,8 @@ import Queue
 import threading
 import time
 
+from collections import OrderedDict
+
 import zmq
 
 from leap.bitmask.backend.api import SIGNALS
@@ -36,22 +38,44 @@ class Signaler(object):
     """
     Signaler client.
     Receives signals from the backend and sends to the signaling server.
+
+    The signals are queued and sent by a worker thread, that sleeps until
+    there is something to send. Everything that is queued by the time the
+    worker wakes up is sent together, as one multipart message. The
+    transport is a PUSH socket, so sending never waits for the GUI to process
+    the signals.
+
+    The signals in COALESCED_SIGNALS only report the latest value of
+    something that is polled (like the traffic counters), so they are held
+    for coalesce_window seconds, and only the latest one is sent. Any other
+    signal, like a state transition, is always sent, even if it is repeated,
+    right after the held ones.
     """
     if flags.ZMQ_HAS_CURVE:
         PORT = "5667"
         SERVER = "tcp://localhost:%s" % PORT
     else:
         SERVER = "ipc:///tmp/bitmask.socket.1"
-    POLL_TIMEOUT = 2000  # ms
-    POLL_TRIES = 500
+    SEND_TIMEOUT = 2000  # ms
+    MAX_BATCH = 100
+
+    COALESCED_SIGNALS = ('eip_status_changed',)
+    COALESCE_WINDOW = 2  # in seconds, 0 to disable
+
+    # queued to wake up the worker when stopping.
+    _STOP = object()
 
-    def __init__(self):
+    def __init__(self, coalesce_window=None):
         """
         Initialize the ZMQ socket to talk to the signaling server.
+
+        :param coalesce_window: how long to hold the coalesced signals, in
+                                seconds.
+        :type coalesce_window: float
         """
         context = zmq.Context()
         logger.debug("Connecting to signaling server...")
-        socket = context.socket(zmq.REQ)
+        socket = context.socket(zmq.PUSH)
 
         if flags.ZMQ_HAS_CURVE:
             # public, secret = zmq.curve_keypair()
@@ -64,13 +88,19 @@ class Signaler(object):
             public, _ = get_frontend_certificates()
             socket.curve_serverkey = public
 
-        socket.setsockopt(zmq.RCVTIMEO, 1000)
+        socket.setsockopt(zmq.SNDTIMEO, self.SEND_TIMEOUT)
         socket.setsockopt(zmq.LINGER, 0)  # Terminate early
         socket.connect(self.SERVER)
         self._socket = socket
 
         self._signal_queue = Queue.Queue()
 
+        if coalesce_window is None:
+            coalesce_window = self.COALESCE_WINDOW
+        self._coalesce_window = coalesce_window
+        self._held = OrderedDict()  # signal -> latest request
+        self._flush_at = None
+
         self._do_work = threading.Event()  # used to stop the worker thread.
         self._worker_signaler = threading.Thread(target=self._worker)
 
@@ -115,19 +145,51 @@ class Signaler(object):
             raise
 
         # queue the call in order to handle the request in a thread safe way.
-        self._signal_queue.put(request_json)
+        self._signal_queue.put((signal, request_json))
 
     def _worker(self):
         """
         Worker loop that processes the Queue of pending requests to do.
         """
         while self._do_work.is_set():
+            # sleep until there is something to send, or until the held
+            # signals are due.
+            timeout = None
+            if self._flush_at is not None:
+                timeout = max(0, self._flush_at - time.time())
             try:
-                request = self._signal_queue.get(block=False)
-                self._send_request(request)
+                requests = [self._signal_queue.get(timeout=timeout)]
             except Queue.Empty:
-                pass
-            time.sleep(0.01)
+                requests = []
+            while len(requests) < self.MAX_BATCH:
+                try:
+                    requests.append(self._signal_queue.get(block=False))
+                except Queue.Empty:
+                    break
+
+            batch = []
+            for request in requests:
+                if request is self._STOP:
+                    continue
+                signal, request_json = request
+                if self._should_hold(signal):
+                    self._held[signal] = request_json
+                    if self._flush_at is None:
+                        self._flush_at = time.time() + self._coalesce_window
+                else:
+                    batch.extend(self._release_held())
+                    batch.append((signal, request_json))
+
+            if self._flush_at is not None and self._flush_at <= time.time():
+                batch.extend(self._release_held())
+
+            batch = _coalesce(batch, self.COALESCED_SIGNALS)
+            if batch:
+                self._send_batch(batch)
+
+        batch = _coalesce(self._release_held(), self.COALESCED_SIGNALS)
+        if batch:
+            self._send_batch(batch)
 
         logger.debug("Signaler thread stopped.")
 
@@ -143,41 +205,56 @@ class Signaler(object):
         Stop the Signaler worker.
         """
         self._do_work.clear()
+        self._signal_queue.put(self._STOP)
+
+    def _should_hold(self, signal):
+        return self._coalesce_window > 0 and signal in self.COALESCED_SIGNALS
 
-    def _send_request(self, request):
+    def _release_held(self):
         """
-        Send the given request to the server.
-        This is used from a thread safe loop in order to avoid sending a
-        request without receiving a response from a previous one.
+        Get the held signals, in the order they were first held.
 
-        :param request: the request to send.
-        :type request: str
+        :return: the signals and their requests.
+        :rtype: list of tuple
         """
-        # logger.debug("Signaling '{0}'".format(request))
-        self._socket.send(request)
+        held = self._held.items()
+        self._held.clear()
+        self._flush_at = None
+        return held
 
-        poll = zmq.Poller()
-        poll.register(self._socket, zmq.POLLIN)
+    def _send_batch(self, batch):
+        """
+        Send the given requests to the server, as one multipart message.
 
-        reply = None
-        tries = 0
+        :param batch: the requests to send.
+        :type batch: list of str
+        """
+        try:
+            self._socket.send_multipart(batch)
+        except zmq.Again:
+            # the server has not been there for SEND_TIMEOUT, and there is
+            # no room left to queue the signals for it.
+            logger.critical(
+                "Timeout error contacting frontend, dropped "
+                "{0} signals.".format(len(batch)))
 
-        while True:
-            socks = dict(poll.poll(self.POLL_TIMEOUT))
-            if socks.get(self._socket) == zmq.POLLIN:
-                reply = self._socket.recv()
-                break
 
-            tries += 1
-            if tries < self.POLL_TRIES:
-                logger.warning('Retrying receive... {0}/{1}'.format(
-                    tries, self.POLL_TRIES))
-            else:
-                break
+def _coalesce(requests, signals):
+    """
+    Drop the requests for the given signals that are equal to the one right
+    before them. Any other signal is an event on its own, and is kept even
+    if it is repeated.
 
-        if reply is None:
-            msg = "Timeout error contacting backend."
-            logger.critical(msg)
-        # else:
-        #     msg = "Received reply for '{0}' -> '{1}'".format(request, reply)
-        #     logger.debug(msg)
+    :param requests: the signals and their requests.
+    :type requests: iterable of tuple
+    :param signals: the signals that can be coalesced.
+    :type signals: tuple of str
+    :return: the requests to send.
+    :rtype: list of str
+    """
+    batch = []
+    for signal, request in requests:
+        if signal in signals and batch and batch[-1] == request:
+            continue
+        batch.append(request)
+    return batch
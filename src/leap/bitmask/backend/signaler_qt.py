@@ -20,7 +20,6 @@ Receives signals from the signaling client and emit Qt signals for the GUI.
 """
 import os
 import threading
-import time
 
 from PySide import QtCore
 
@@ -49,6 +48,7 @@ class SignalerQt(QtCore.QObject):
     else:
         SOCKET_FILE = "/tmp/bitmask.socket.1"
         BIND_ADDR = "ipc://%s" % SOCKET_FILE
+    POLL_TIMEOUT = 1000  # ms, how often we check if we have to stop
 
     def __init__(self):
         QtCore.QObject.__init__(self)
@@ -74,7 +74,7 @@ class SignalerQt(QtCore.QObject):
         """
         logger.debug("Running SignalerQt loop")
         context = zmq.Context()
-        socket = context.socket(zmq.REP)
+        socket = context.socket(zmq.PULL)
 
         if flags.ZMQ_HAS_CURVE:
             # Start an authenticator for this context.
@@ -94,17 +94,16 @@ class SignalerQt(QtCore.QObject):
         if not flags.ZMQ_HAS_CURVE:
             os.chmod(self.SOCKET_FILE, 0600)
 
+        poll = zmq.Poller()
+        poll.register(socket, zmq.POLLIN)
+
         while self._do_work.is_set():
-            # Wait for next request from client
-            try:
-                request = socket.recv(zmq.NOBLOCK)
+            # Wait for next batch of requests from client
+            if not poll.poll(self.POLL_TIMEOUT):
+                continue
+            for request in socket.recv_multipart():
                 # logger.debug("Received request: '{0}'".format(request))
-                socket.send("OK")
                 self._process_request(request)
-            except zmq.ZMQError as e:
-                if e.errno != zmq.EAGAIN:
-                    raise
-            time.sleep(0.01)
 
         logger.debug("SignalerQt thread stopped.")
 
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# test_leapbackend.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+tests for the lazily created components of the backend
+"""
+import threading
+import unittest
+
+from mock import Mock, patch
+
+from leap.bitmask.backend import leapbackend
+
+
+class LazyComponentsTest(unittest.TestCase):
+    """Tests for the lazy creation of the LeapBackend components."""
+
+    def setUp(self):
+        self.eip = Mock()
+        self.soledad = Mock()
+        patcher = patch.dict(leapbackend.LeapBackend.COMPONENTS, {
+            'eip': lambda b: self.eip,
+            'soledad': lambda b: self.soledad})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # skip the Backend constructor, it sets up the zmq sockets
+        self.backend = leapbackend.LeapBackend.__new__(
+            leapbackend.LeapBackend)
+        self.backend._components = {}
+        self.backend._components_lock = threading.Lock()
+
+    def test_component_is_created_when_used(self):
+        self.assertIsNone(self.backend.get_loaded_component('eip'))
+        self.backend.eip_start()
+        self.eip.start.assert_called_once_with(False)
+        self.assertIs(self.backend.get_loaded_component('eip'), self.eip)
+        self.assertIsNone(self.backend.get_loaded_component('soledad'))
+
+    def test_stop_does_not_create_components(self):
+        self.backend.eip_stop(shutdown=True)
+        self.backend.eip_terminate()
+        self.backend.eip_cancel_setup()
+        self.backend.soledad_cancel_bootstrap()
+        self.backend.soledad_close()
+        self.assertEqual(self.backend._components, {})
+
+    def test_stop_reaches_a_used_component(self):
+        self.backend.soledad_load_offline('user', 'pass', 'uuid')
+        self.backend.eip_start()
+        self.backend.eip_stop(shutdown=True)
+        self.backend.soledad_close()
+        self.eip.stop.assert_called_once_with(True, False)
+        self.soledad.close.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
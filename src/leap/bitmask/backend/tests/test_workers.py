@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# test_workers.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+tests for the pool of worker threads of the backend
+"""
+import threading
+import unittest
+from functools import partial
+
+from nose.twistedtools import deferred
+from twisted.internet import defer
+
+from leap.bitmask.backend import workers
+
+
+def _trap_cancelled(failure):
+    failure.trap(defer.CancelledError)
+
+
+class WorkerPoolTest(unittest.TestCase):
+    """Tests for the WorkerPool."""
+
+    def setUp(self):
+        self.pool = workers.WorkerPool(size=1, name='test')
+        self.gate = threading.Event()
+        self.started = []
+
+    def tearDown(self):
+        self.gate.set()
+        self.pool.stop()
+
+    def _run(self, name, priority=workers.INTERACTIVE):
+        return self.pool.run(partial(self.started.append, name), priority)
+
+    @deferred(timeout=5)
+    def test_priority_order(self):
+        self.pool.run(self.gate.wait)
+        calls = [self._run('background1', workers.BACKGROUND),
+                 self._run('interactive1'),
+                 self._run('background2', workers.BACKGROUND),
+                 self._run('interactive2')]
+        self.gate.set()
+
+        def check(_):
+            self.assertEqual(self.started, ['interactive1', 'interactive2',
+                                            'background1', 'background2'])
+        d = defer.gatherResults(calls)
+        d.addCallback(check)
+        return d
+
+    @deferred(timeout=5)
+    def test_stats(self):
+        self.pool.run(self.gate.wait)
+        calls = [self._run('background', workers.BACKGROUND),
+                 self._run('interactive')]
+        stats = self.pool.stats()
+        self.assertEqual(stats['running'], 1)
+        self.assertEqual(stats['queued'], 2)
+        self.gate.set()
+
+        def check(_):
+            stats = self.pool.stats()
+            self.assertEqual(stats['size'], 1)
+            self.assertEqual(stats['running'], 0)
+            self.assertEqual(stats['queued'], 0)
+            self.assertEqual(stats['max_queued'], 2)
+            self.assertEqual(stats['wait']['interactive']['calls'], 2)
+            self.assertEqual(stats['wait']['background']['calls'], 1)
+            for wait in stats['wait'].values():
+                self.assertTrue(0 <= wait['wait_avg'] <= wait['wait_max'])
+        d = defer.gatherResults(calls)
+        d.addCallback(check)
+        return d
+
+    @deferred(timeout=5)
+    def test_wait_idle(self):
+        self.assertTrue(self.pool.wait_idle().called)
+
+        self.pool.run(self.gate.wait)
+        self._run('queued')
+        d = self.pool.wait_idle()
+        self.assertFalse(d.called)
+        self.gate.set()
+
+        def check(_):
+            self.assertEqual(self.pool.pending, 0)
+            self.assertEqual(self.started, ['queued'])
+        d.addCallback(check)
+        return d
+
+    @deferred(timeout=5)
+    def test_cancel_queued(self):
+        self.pool.run(self.gate.wait)
+        queued = self._run('queued')
+        queued.addErrback(_trap_cancelled)
+        queued.cancel()
+        self.assertEqual(self.pool.pending, 1)
+        self.gate.set()
+
+        def check(_):
+            self.assertEqual(self.started, [])
+        d = self.pool.wait_idle()
+        d.addCallback(check)
+        return d
+
+    @deferred(timeout=5)
+    def test_cancel_running_keeps_its_thread(self):
+        running = self.pool.run(self.gate.wait)
+        running.addErrback(_trap_cancelled)
+        self._run('queued')
+        running.cancel()
+        self.assertTrue(running.called)
+
+        # the cancelled call still holds the only thread
+        stats = self.pool.stats()
+        self.assertEqual(stats['running'], 1)
+        self.assertEqual(stats['queued'], 1)
+        self.assertEqual(self.started, [])
+        self.gate.set()
+
+        def check(_):
+            self.assertEqual(self.started, ['queued'])
+        d = self.pool.wait_idle()
+        d.addCallback(check)
+        return d
+
+    @deferred(timeout=5)
+    def test_cancel_all(self):
+        calls = [self.pool.run(self.gate.wait),
+                 self._run('queued1'),
+                 self._run('queued2', workers.BACKGROUND)]
+        for d in calls:
+            d.addErrback(_trap_cancelled)
+        self.pool.cancel_all()
+        self.assertTrue(all(d.called for d in calls))
+        self.assertEqual(self.pool.stats()['running'], 1)
+        self.gate.set()
+
+        def check(_):
+            self.assertEqual(self.started, [])
+            self.assertEqual(self.pool.pending, 0)
+        d = self.pool.wait_idle()
+        d.addCallback(check)
+        return d
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -80,6 +80,46 @@ def _zmq_has_curve():
     return True
 
 
+def zmq_has_heartbeats():
+    """
+    Return whether the current ZMQ supports ZMTP heartbeats and socket
+    monitoring.
+
+    :rtype: bool
+
+     Version notes:
+       ZMTP heartbeats (`zmq.HEARTBEAT_IVL`) are new in libzmq-4.2.
+       `zmq.utils.monitor` is new in pyzmq 14.4.
+    """
+    return (hasattr(zmq, 'HEARTBEAT_IVL') and
+            zmq.zmq_version_info() >= (4, 2) and
+            zmq.pyzmq_version_info() >= (14, 4))
+
+
+def set_zmq_heartbeats(socket, interval, timeout):
+    """
+    Make the socket ping its peers every interval seconds, and drop the
+    connections that do not answer in timeout seconds.
+
+    :param socket: the socket to configure.
+    :type socket: zmq.Socket
+    :param interval: seconds between heartbeats.
+    :type interval: float
+    :param timeout: seconds to wait for the answer to a heartbeat.
+    :type timeout: float
+
+    :return: whether heartbeats are supported by the current ZMQ.
+    :rtype: bool
+    """
+    if not zmq_has_heartbeats():
+        return False
+
+    socket.setsockopt(zmq.HEARTBEAT_IVL, int(interval * 1000))
+    socket.setsockopt(zmq.HEARTBEAT_TIMEOUT, int(timeout * 1000))
+    socket.setsockopt(zmq.HEARTBEAT_TTL, int(timeout * 1000))
+    return True
+
+
 def generate_zmq_certificates():
     """
     Generate client and server CURVE certificate files.
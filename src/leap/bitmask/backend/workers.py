@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# workers.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Bounded pool of worker threads for the backend API calls.
+"""
+import heapq
+import itertools
+import time
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+
+# priority classes, lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+PRIORITIES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+
+class _Job(object):
+
+    __slots__ = ('priority', 'func', 'deferred', 'running', 'queued_at',
+                 'cancelled')
+
+    def __init__(self, priority, func):
+        self.priority = priority
+        self.func = func
+        self.deferred = None
+        self.running = None  # the deferred of the thread, once started
+        self.queued_at = time.time()
+        self.cancelled = False
+
+
+class WorkerPool(object):
+    """
+    Runs blocking calls in a dedicated pool of threads, never more than
+    size at the same time.
+
+    The calls that do not fit in the pool wait in a queue, and are started
+    by priority: all the queued INTERACTIVE calls run before any BACKGROUND
+    one, and the calls of the same priority run in the order they came.
+
+    The pool must be used from the reactor thread.
+    """
+
+    def __init__(self, size=4, name='backend'):
+        """
+        :param size: the maximum number of calls running at the same time.
+        :type size: int
+        :param name: the name of the threads.
+        :type name: str
+        """
+        self.size = size
+        self._threadpool = ThreadPool(0, size, name=name)
+        self._queue = []  # heap of (priority, seq, job)
+        self._seq = itertools.count()
+        self._running = set()
+        self._queued = 0
+        self._idle_waiters = []
+        self._metrics = dict(
+            (priority, {'calls': 0, 'wait_total': 0.0, 'wait_max': 0.0})
+            for priority in PRIORITIES)
+        self._max_queued = 0
+
+    @property
+    def pending(self):
+        """
+        Number of calls that are queued or running.
+        """
+        return self._queued + len(self._running)
+
+    def run(self, func, priority=INTERACTIVE):
+        """
+        Run func in a worker thread, as soon as there is one free.
+
+        :param func: the blocking call to run.
+        :type func: callable
+        :param priority: INTERACTIVE or BACKGROUND.
+        :type priority: int
+
+        :return: a Deferred that fires with the result of func. Cancelling
+                 it takes the call out of the queue if it has not started,
+                 or stops waiting for its result if it has. A call that has
+                 started keeps its thread, and counts as running, until it
+                 returns.
+        :rtype: Deferred
+        """
+        job = _Job(priority, func)
+        job.deferred = defer.Deferred(canceller=lambda _: self._cancel(job))
+        heapq.heappush(self._queue, (priority, next(self._seq), job))
+        self._queued += 1
+        self._max_queued = max(self._max_queued, self._queued)
+        self._process_queue()
+        return job.deferred
+
+    def wait_idle(self):
+        """
+        Wait until there are no calls queued or running.
+
+        :return: a Deferred that fires when the pool is idle. It can be
+                 cancelled to stop waiting.
+        :rtype: Deferred
+        """
+        if not self.pending:
+            return defer.succeed(None)
+        d = defer.Deferred(canceller=self._idle_waiters.remove)
+        self._idle_waiters.append(d)
+        return d
+
+    def cancel_all(self):
+        """
+        Cancel every queued and running call.
+        """
+        for _, _, job in list(self._queue):
+            if not job.cancelled:
+                job.deferred.cancel()
+        for job in list(self._running):
+            job.deferred.cancel()
+
+    def stop(self):
+        if self._threadpool.started:
+            self._threadpool.stop()
+
+    def stats(self):
+        """
+        Get the queue depth and the time the calls have waited to start, by
+        priority class.
+
+        :rtype: dict
+        """
+        waits = {}
+        for priority, name in PRIORITIES.iteritems():
+            metrics = self._metrics[priority]
+            calls = metrics['calls']
+            waits[name] = {
+                'calls': calls,
+                'wait_avg': metrics['wait_total'] / calls if calls else 0,
+                'wait_max': metrics['wait_max'],
+            }
+        return {'size': self.size,
+                'running': len(self._running),
+                'queued': self._queued,
+                'max_queued': self._max_queued,
+                'wait': waits}
+
+    def _cancel(self, job):
+        # the deferred fails with CancelledError after this. A running job
+        # keeps going in its thread, and its result is ignored.
+        if job.running is None and not job.cancelled:
+            job.cancelled = True
+            self._queued -= 1
+            self._check_idle()
+
+    def _process_queue(self):
+        while self._queue and len(self._running) < self.size:
+            _, _, job = heapq.heappop(self._queue)
+            if job.cancelled:
+                continue
+            self._queued -= 1
+            self._start(job)
+
+    def _start(self, job):
+        if not self._threadpool.started:
+            self._threadpool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+        wait = time.time() - job.queued_at
+        metrics = self._metrics[job.priority]
+        metrics['calls'] += 1
+        metrics['wait_total'] += wait
+        metrics['wait_max'] = max(metrics['wait_max'], wait)
+
+        # the deferred of the thread is kept apart from the one handed to
+        # the caller, so that the job counts as running until its thread
+        # returns, even if the caller cancels it.
+        job.running = threads.deferToThreadPool(
+            reactor, self._threadpool, job.func)
+        self._running.add(job)
+        job.running.addBoth(self._finished, job)
+
+    def _finished(self, result, job):
+        self._running.discard(job)
+        if not job.deferred.called:
+            if isinstance(result, Failure):
+                job.deferred.errback(result)
+            else:
+                job.deferred.callback(result)
+        self._process_queue()
+        self._check_idle()
+
+    def _check_idle(self):
+        if self.pending:
+            return
+        waiters, self._idle_waiters = self._idle_waiters, []
+        for d in waiters:
+            d.callback(None)
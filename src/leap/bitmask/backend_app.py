@@ -30,6 +30,7 @@ from leap.bitmask.backend.utils import generate_zmq_certificates
 from leap.bitmask.config import flags
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.util import dict_to_flags
+from leap.bitmask.util import resolver
 
 
 def signal_handler(signum, frame):
@@ -87,6 +88,10 @@ def run_backend(bypass_checks=False, flags_dict=None, frontend_pid=None):
     signal.signal(signal.SIGINT, signal.SIG_IGN)
     signal.signal(signal.SIGTERM, signal_handler)
 
+    # resolve each provider host once, for the checks and the requests
+    if not resolver.install():
+        logger.warning("The requests in use can not share the DNS cache.")
+
     reactor.callWhenRunning(start_events_and_updater, logger)
 
     backend = LeapBackend(bypass_checks=bypass_checks,
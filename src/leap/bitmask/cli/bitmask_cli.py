@@ -22,20 +22,28 @@ import json
 import sys
 import getpass
 import argparse
+import threading
 
-from colorama import init as color_init
-from colorama import Fore
-from twisted.internet import reactor
-from txzmq import ZmqEndpoint, ZmqEndpointType
-from txzmq import ZmqFactory, ZmqREQConnection
-from txzmq import ZmqRequestTimeoutError
+from leap.bitmask.importprofile import profile_imports_if_requested
 
-from leap.bitmask.core import ENDPOINT
+# XXX this has to run before the rest of the imports to measure them, so
+# they can not be at the top of the file.
+profile_imports_if_requested()
+
+from colorama import init as color_init  # noqa - imported after profiling
+from colorama import Fore  # noqa - imported after profiling
+
+from leap.bitmask.core import ENDPOINT  # noqa - imported after profiling
+
+# NOTE: twisted and txzmq are imported when we are about to talk to the
+# daemon, so that parsing the arguments (and failing) stays fast.
 
 
 class BitmaskCLI(object):
 
-    def __init__(self):
+    def __init__(self, argv=None):
+        # the shell mode parses each line it reads as a command line
+        self.argv = argv if argv is not None else sys.argv
         parser = argparse.ArgumentParser(
             usage='''bitmask_cli <command> [<args>]
 
@@ -55,6 +63,13 @@ GENERAL COMMANDS:
    shutdown   shutdown Bitmask backend daemon
    status     displays general status about the running Bitmask services
    debug      show some debug info about bitmask-core
+   shell      read commands from stdin, and run them all over a single
+              connection to the daemon
+
+OPTIONS:
+
+   --json             print the replies as json, one per line
+   --profile-imports  print how long it took to import each module
 
 
 ''', epilog=("Use 'bitmask_cli <command> --help' to learn more "
@@ -63,7 +78,7 @@ GENERAL COMMANDS:
 
         # parse_args defaults to [1:] for args, but you need to
         # exclude the rest of the args too, or validation will fail
-        args = parser.parse_args(sys.argv[1:2])
+        args = parser.parse_args(self.argv[1:2])
         self.args = args
         self.subargs = None
 
@@ -92,7 +107,7 @@ GENERAL COMMANDS:
                             help='shows the active user, if any')
         # now that we're inside a subcommand, ignore the first
         # TWO argvs, ie the command (bitmask_cli) and the subcommand (user)
-        args = parser.parse_args(sys.argv[2:])
+        args = parser.parse_args(self.argv[2:])
         self.subargs = args
 
     def mail(self):
@@ -117,7 +132,7 @@ GENERAL COMMANDS:
                             help='downloads a new smtp certificate '
                             '(NOT IMPLEMENTED)')
 
-        args = parser.parse_args(sys.argv[2:])
+        args = parser.parse_args(self.argv[2:])
         self.subargs = args
 
     def eip(self):
@@ -131,7 +146,7 @@ GENERAL COMMANDS:
                             help='Display status about service')
         parser.add_argument('--enable', action='store_true')
         parser.add_argument('--disable', action='store_true')
-        args = parser.parse_args(sys.argv[2:])
+        args = parser.parse_args(self.argv[2:])
         self.subargs = args
 
     def keys(self):
@@ -144,7 +159,7 @@ GENERAL COMMANDS:
                             help='List all known keys')
         parser.add_argument('--export-key', action='store_true',
                             help='Export the given key')
-        args = parser.parse_args(sys.argv[2:])
+        args = parser.parse_args(self.argv[2:])
         self.subargs = args
 
     # Single commands
@@ -164,8 +179,23 @@ GENERAL COMMANDS:
     def debug(self):
         pass
 
+    def shell(self):
+        pass
+
+
+JSON_OPTION = '--json'
+TIMEOUT = 60  # in seconds
+PROMPT = 'bitmask> '
+
+
+class CommandError(Exception):
+    pass
+
 
 def get_zmq_connection():
+    from txzmq import ZmqEndpoint, ZmqEndpointType
+    from txzmq import ZmqFactory, ZmqREQConnection
+
     zf = ZmqFactory()
     e = ZmqEndpoint(ZmqEndpointType.connect, ENDPOINT)
     return ZmqREQConnection(zf, e)
@@ -174,6 +204,7 @@ def get_zmq_connection():
 def error(msg, stop=False):
     print Fore.RED + "[!] %s" % msg + Fore.RESET
     if stop:
+        from twisted.internet import reactor
         reactor.stop()
     else:
         sys.exit(1)
@@ -181,6 +212,8 @@ def error(msg, stop=False):
 
 def timeout_handler(failure, stop_reactor=True):
     # TODO ---- could try to launch the bitmask daemon here and retry
+    from twisted.internet import reactor
+    from txzmq import ZmqRequestTimeoutError
 
     if failure.trap(ZmqRequestTimeoutError) == ZmqRequestTimeoutError:
         print (Fore.RED + "[ERROR] Timeout contacting the bitmask daemon. "
@@ -188,75 +221,110 @@ def timeout_handler(failure, stop_reactor=True):
         reactor.stop()
 
 
-def do_print_result(stuff):
-    obj = json.loads(stuff[0])
-    if not obj['error']:
-        print Fore.GREEN + '%s' % obj['result'] + Fore.RESET
+def format_result(result, indent=''):
+    """
+    Format the result of a command as readable lines: one per key of a
+    dict, or per item of a list, with the nested ones indented.
+
+    :rtype: str
+    """
+    nested = indent + '  '
+    if isinstance(result, dict):
+        lines = []
+        for key in sorted(result):
+            value = result[key]
+            if isinstance(value, (dict, list)) and value:
+                lines.append('%s%s:' % (indent, key))
+                lines.append(format_result(value, nested))
+            else:
+                lines.append('%s%s: %s' % (indent, key, format_result(value)))
+        return '\n'.join(lines)
+    if isinstance(result, list):
+        lines = []
+        for value in result:
+            if isinstance(value, (dict, list)) and value:
+                lines.append('%s-' % (indent,))
+                lines.append(format_result(value, nested))
+            else:
+                lines.append('%s- %s' % (indent, format_result(value)))
+        return '\n'.join(lines)
+    return '%s%s' % (indent, result)
+
+
+def do_print_result(stuff, as_json=False, command=None):
+    try:
+        obj = json.loads(stuff[0])
+    except ValueError:
+        # the dispatcher failed before it could format a reply
+        obj = {'result': None, 'error': stuff[0]}
+
+    if as_json:
+        if command is not None:
+            obj['command'] = command
+        print json.dumps(obj)
+    elif not obj['error']:
+        print Fore.GREEN + format_result(obj['result']) + Fore.RESET
     else:
         print Fore.RED + 'ERROR:' + '%s' % obj['error'] + Fore.RESET
+    sys.stdout.flush()
+
 
+def get_command(cli):
+    """
+    Get the message to send to the daemon for a parsed command line.
 
-def send_command(cli):
+    :param cli: the parsed command line.
+    :type cli: BitmaskCLI
 
+    :return: the command and its arguments.
+    :rtype: list
+    :raise CommandError: if the arguments are not valid.
+    """
     args = cli.args
     subargs = cli.subargs
-    cb = do_print_result
 
     cmd = args.command
 
-    if cmd == 'launch':
-        # XXX careful! Should see if the process in PID is running,
-        # avoid launching again.
-        import commands
-        commands.getoutput('bitmaskd')
-        reactor.stop()
-        return
-
-    elif cmd == 'version':
-        do_print_result([json.dumps(
-            {'result': 'bitmask_cli: 0.0.1',
-             'error': None})])
-        data = ('version',)
+    if cmd == 'version':
+        data = ['version']
 
     elif cmd == 'status':
-        data = ('status',)
+        data = ['status']
 
     elif cmd == 'shutdown':
-        data = ('shutdown',)
+        data = ['shutdown']
 
     elif cmd == 'debug':
-        data = ('stats',)
+        data = ['stats']
 
     elif cmd == 'user':
         username = subargs.username
         if username and '@' not in username:
-            error("Username ID must be in the form <user@example.org>",
-                  stop=True)
-            return
+            raise CommandError(
+                "Username ID must be in the form <user@example.org>")
         if not username:
             username = ''
 
         # TODO check that ONLY ONE FLAG is True
         # TODO check that AT LEAST ONE FLAG is True
 
-        passwd = getpass.getpass()
         data = ['user']
 
         if subargs.active:
             data += ['active', '', '']
 
         elif subargs.create:
-            data += ['signup', username, passwd]
+            data += ['signup', username, getpass.getpass()]
 
         elif subargs.authenticate:
-            data += ['authenticate', username, passwd]
+            data += ['authenticate', username, getpass.getpass()]
 
         elif subargs.logout:
-            data += ['logout', username, passwd]
+            data += ['logout', username, getpass.getpass()]
 
         else:
-            error('Use bitmask_cli user --help to see available subcommands')
-            return
+            raise CommandError(
+                'Use bitmask_cli user --help to see available subcommands')
 
     elif cmd == 'mail':
         data = ['mail']
@@ -280,8 +348,8 @@ def send_command(cli):
             data += ['get_smtp_certificate']
 
         else:
-            error('Use bitmask_cli mail --help to see available subcommands')
-            return
+            raise CommandError(
+                'Use bitmask_cli mail --help to see available subcommands')
 
     elif cmd == 'eip':
         data = ['eip']
@@ -302,9 +370,8 @@ def send_command(cli):
             data += ['stop']
 
         else:
-            error('Use bitmask_cli eip --help to see available subcommands',
-                  stop=True)
-            return
+            raise CommandError(
+                'Use bitmask_cli eip --help to see available subcommands')
 
     elif cmd == 'keys':
         data = ['keys']
@@ -319,22 +386,161 @@ def send_command(cli):
             data += ['export_keys']
 
         else:
-            error('Use bitmask_cli keys --help to see available subcommands',
-                  stop=True)
-            return
+            raise CommandError(
+                'Use bitmask_cli keys --help to see available subcommands')
+
+    else:
+        raise CommandError("'%s' can not be sent to the daemon" % cmd)
+
+    return data
+
+
+def send_command(cli, as_json=False):
+    from twisted.internet import reactor
+
+    cmd = cli.args.command
+
+    if cmd == 'launch':
+        # XXX careful! Should see if the process in PID is running,
+        # avoid launching again.
+        import commands
+        commands.getoutput('bitmaskd')
+        reactor.stop()
+        return
+
+    elif cmd == 'shell':
+        Shell(sys.stdin, as_json=as_json).start()
+        return
+
+    elif cmd == 'version':
+        do_print_result([json.dumps(
+            {'result': 'bitmask_cli: 0.0.1',
+             'error': None})], as_json)
+
+    try:
+        data = get_command(cli)
+    except CommandError as e:
+        error(e, stop=True)
+        return
 
     s = get_zmq_connection()
 
-    d = s.sendMsg(*data, timeout=60)
-    d.addCallback(cb)
+    d = s.sendMsg(*data, timeout=TIMEOUT)
+    d.addCallback(do_print_result, as_json)
     d.addCallback(lambda x: reactor.stop())
     d.addErrback(timeout_handler)
 
 
+class Shell(object):
+    """
+    Runs the commands read from a stream, one per line, over a single
+    connection to the daemon. The lines have the same syntax as the command
+    line, without the leading bitmask_cli::
+
+        $ printf 'status\\nmail --status\\n' | bitmask_cli shell --json
+
+    When the stream is not a terminal, each command is sent as soon as it is
+    read, without waiting for the reply to the previous one, and the replies
+    are printed in the order of the commands.
+    """
+
+    def __init__(self, stream, as_json=False):
+        self._stream = stream
+        self._as_json = as_json
+        self._interactive = stream.isatty()
+        self._client = None
+        self._printed = None
+
+    def start(self):
+        from twisted.internet import defer
+        from leap.bitmask.core.client import get_pipelined_client
+
+        self._client = get_pipelined_client()
+        self._printed = defer.succeed(None)
+        self._read_line()
+
+    def _read_line(self):
+        if self._interactive:
+            sys.stdout.write(PROMPT)
+            sys.stdout.flush()
+        # reading blocks, keep it out of the reactor thread. Not in the
+        # reactor threadpool, that would wait for it at shutdown.
+        reader = threading.Thread(target=self._read_line_in_thread)
+        reader.daemon = True
+        reader.start()
+
+    def _read_line_in_thread(self):
+        from twisted.internet import reactor
+        reactor.callFromThread(self._got_line, self._stream.readline())
+
+    def _got_line(self, line):
+        from twisted.internet import reactor
+
+        if not line or line.strip() in ('exit', 'quit'):
+            # EOF, stop once every reply is printed
+            if self._interactive:
+                print
+            self._printed.addBoth(lambda _: reactor.stop())
+            return
+
+        line = line.strip()
+        if line and not line.startswith('#'):
+            self._run(line)
+
+        if self._interactive:
+            self._printed.addCallback(lambda _: self._read_line())
+        else:
+            self._read_line()
+
+    def _run(self, line):
+        from twisted.internet import defer
+
+        try:
+            cli = BitmaskCLI(['bitmask_cli'] + line.split())
+            data = get_command(cli)
+        except CommandError as e:
+            d = defer.fail(e)
+        except SystemExit:
+            # argparse already printed the usage
+            d = defer.fail(CommandError('Invalid command: %s' % line))
+        else:
+            d = self._client.send(*data, timeout=TIMEOUT)
+
+        self._printed.addCallback(lambda _: d)
+        self._printed.addCallbacks(
+            self._print_result, self._print_error,
+            callbackArgs=(line,), errbackArgs=(line,))
+
+    def _print_result(self, response, line):
+        do_print_result([response], self._as_json, line)
+
+    def _print_error(self, failure, line):
+        from txzmq import ZmqRequestTimeoutError
+
+        if failure.check(ZmqRequestTimeoutError):
+            msg = 'Timeout contacting the bitmask daemon. Is it running?'
+        elif failure.check(CommandError):
+            msg = str(failure.value)
+        else:
+            msg = failure.getErrorMessage()
+
+        if self._as_json:
+            print json.dumps({'command': line, 'result': None, 'error': msg})
+        else:
+            print Fore.RED + "[!] %s" % msg + Fore.RESET
+        sys.stdout.flush()
+
+
 def main():
+    as_json = JSON_OPTION in sys.argv
+    while JSON_OPTION in sys.argv:
+        sys.argv.remove(JSON_OPTION)
+
     color_init()
     cli = BitmaskCLI()
-    reactor.callWhenRunning(reactor.callLater, 0, send_command, cli)
+
+    from twisted.internet import reactor
+    reactor.callWhenRunning(reactor.callLater, 0, send_command, cli, as_json)
     reactor.run()
 
 if __name__ == "__main__":
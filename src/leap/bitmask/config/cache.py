@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# cache.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Process-wide cache for the provider and service config files.
+"""
+import os
+import threading
+
+
+class ConfigCache(object):
+    """
+    Keeps the parsed (and validated) config files in memory, keyed by
+    (provider, service), and loads them again only when the file on disk
+    changes.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, path, loader):
+        """
+        Return the config stored at path, loading it with loader if it is
+        not cached or if the file has changed since it was loaded.
+
+        If the loader raises or returns None, nothing is cached.
+
+        :param key: the cache key, usually (provider, service).
+        :type key: tuple
+        :param path: the absolute path to the config file.
+        :type path: str
+        :param loader: called with the path to load the config.
+        :type loader: callable
+
+        :return: whatever the loader returns.
+        """
+        version = _get_file_version(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is not None and version is not None and
+                    entry[0] == (path, version)):
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        config = loader(path)
+
+        with self._lock:
+            if config is not None and version is not None:
+                self._entries[key] = ((path, version), config)
+            else:
+                self._entries.pop(key, None)
+        return config
+
+    def invalidate(self, key=None):
+        """
+        Forget a cached config, or all of them if no key is given.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self._entries)}
+
+
+def _get_file_version(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+config_cache = ConfigCache()
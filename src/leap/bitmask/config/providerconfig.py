@@ -22,6 +22,7 @@ import os
 
 from leap.bitmask import provider
 from leap.bitmask.config import flags
+from leap.bitmask.config.cache import config_cache
 from leap.bitmask.config.provider_spec import leap_provider_spec
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.services import get_service_display_name
@@ -84,16 +85,21 @@ class ProviderConfig(BaseConfig):
         """
         Helper to return a valid Provider Config from the domain name.
 
+        The config is shared, and loaded again only if the file changes.
+
         :param domain: the domain name of the provider.
         :type domain: str
 
         :rtype: ProviderConfig or None if there is a problem loading the config
         """
-        provider_config = ProviderConfig()
-        if not provider_config.load(provider.get_provider_path(domain)):
-            provider_config = None
+        def load(path):
+            provider_config = ProviderConfig()
+            if provider_config.load(path, relative=False):
+                return provider_config
 
-        return provider_config
+        path = os.path.join(
+            get_path_prefix(), provider.get_provider_path(domain))
+        return config_cache.get((domain, 'provider'), path, load)
 
     def _get_schema(self):
         """
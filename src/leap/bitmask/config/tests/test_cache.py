@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# test_cache.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the config cache
+"""
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import json
+import os
+
+from leap.bitmask.config.cache import ConfigCache
+from leap.common.testing.basetest import BaseLeapTest
+
+from mock import Mock
+
+
+class ConfigCacheTest(BaseLeapTest):
+    """Tests for ConfigCache"""
+
+    def setUp(self):
+        self._cache = ConfigCache()
+        self._path = os.path.join(self.tempdir, 'soledad-service.json')
+        self._write({'hosts': {'a': {}}})
+        self._loader = Mock(side_effect=self._load)
+
+    def tearDown(self):
+        if os.path.isfile(self._path):
+            os.unlink(self._path)
+
+    def _write(self, data, mtime=None):
+        with open(self._path, 'w') as f:
+            f.write(json.dumps(data))
+        if mtime is not None:
+            os.utime(self._path, (mtime, mtime))
+
+    def _load(self, path):
+        with open(path) as f:
+            return json.loads(f.read())
+
+    def _get(self):
+        return self._cache.get(('example.org', 'soledad'), self._path,
+                               self._loader)
+
+    def test_loads_once(self):
+        first = self._get()
+        second = self._get()
+
+        self.assertEqual(first, {'hosts': {'a': {}}})
+        self.assertTrue(first is second)
+        self.assertEqual(self._loader.call_count, 1)
+        self.assertEqual(self._cache.stats(),
+                         {'hits': 1, 'misses': 1, 'entries': 1})
+
+    def test_reloads_when_file_changes(self):
+        self._write({'hosts': {'a': {}}}, mtime=1000)
+        self._get()
+        self._write({'hosts': {'b': {}}}, mtime=2000)
+
+        self.assertEqual(self._get(), {'hosts': {'b': {}}})
+        self.assertEqual(self._loader.call_count, 2)
+
+    def test_does_not_cache_failures(self):
+        self._loader.side_effect = lambda path: None
+        self._get()
+        self._get()
+
+        self.assertEqual(self._loader.call_count, 2)
+        self.assertEqual(self._cache.stats()['entries'], 0)
+
+    def test_missing_file_raises(self):
+        os.unlink(self._path)
+        self.assertRaises(IOError, self._get)
+
+    def test_invalidate(self):
+        self._get()
+        self._cache.invalidate()
+        self._get()
+
+        self.assertEqual(self._loader.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,2 +1,4 @@
 APPNAME = "bitmask.core"
 ENDPOINT = "ipc:///tmp/%s.sock" % APPNAME
+PIPELINED_ENDPOINT = "ipc:///tmp/%s.router.sock" % APPNAME
+EVENTS_ENDPOINT = "ipc:///tmp/%s.events.sock" % APPNAME
@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-ZMQ REQ-REP Dispatcher.
+ZMQ REQ-REP and ROUTER-DEALER Dispatchers, and PUB Events publisher.
 """
 
 from twisted.application import service
@@ -23,9 +23,11 @@ from twisted.internet import reactor
 from twisted.python import log
 
 from txzmq import ZmqEndpoint, ZmqEndpointType
-from txzmq import ZmqFactory, ZmqREPConnection
+from txzmq import ZmqFactory, ZmqREPConnection, ZmqRouterConnection
+from txzmq import ZmqPubConnection
 
-from leap.bitmask.core import ENDPOINT
+from leap.bitmask.core import ENDPOINT, PIPELINED_ENDPOINT, EVENTS_ENDPOINT
+from leap.bitmask.core import pubsub
 from leap.bitmask.core.dispatcher import CommandDispatcher
 
 
@@ -40,11 +42,35 @@ class ZMQServerService(service.Service):
 
         self._conn = _DispatcherREPConnection(zf, e, self._core)
         reactor.callWhenRunning(self._conn.do_greet)
+
+        pe = ZmqEndpoint(ZmqEndpointType.bind, PIPELINED_ENDPOINT)
+        self._router = _DispatcherROUTERConnection(zf, pe, self._core)
+        reactor.callWhenRunning(self._router.do_greet)
+
+        ee = ZmqEndpoint(ZmqEndpointType.bind, EVENTS_ENDPOINT)
+        self._pub = ZmqPubConnection(zf, ee)
+        self._events_sid = None
+        events = self._get_events_service()
+        if events:
+            self._events_sid = events.subscribe(self._publish_event)
         service.Service.startService(self)
 
     def stopService(self):
+        events = self._get_events_service()
+        if events and self._events_sid is not None:
+            events.unsubscribe(self._events_sid)
         service.Service.stopService(self)
 
+    def _get_events_service(self):
+        try:
+            return self._core.getServiceNamed('events')
+        except KeyError:
+            return None
+
+    def _publish_event(self, topic, data):
+        # subscribers filter by topic prefix, on their side of the socket
+        self._pub.publish(pubsub.encode_event(topic, data), tag=topic)
+
 
 class _DispatcherREPConnection(ZmqREPConnection):
 
@@ -66,3 +92,43 @@ class _DispatcherREPConnection(ZmqREPConnection):
 
     def do_greet(self):
         log.msg('starting ZMQ dispatcher')
+
+
+class _DispatcherROUTERConnection(ZmqRouterConnection):
+
+    """
+    A pipelined dispatcher.
+
+    Every request carries a client-chosen request id as its first frame:
+
+        [request_id, command, arg1, arg2...]
+
+    Commands are dispatched as soon as they arrive, without waiting for the
+    previous ones to finish, and each reply is sent back as soon as it is
+    ready, tagged with the id of the request it answers:
+
+        [request_id, response]
+
+    so a client can keep many requests in flight and match the replies,
+    that can arrive out of order.
+    """
+
+    def __init__(self, zf, e, core):
+        ZmqRouterConnection.__init__(self, zf, e)
+        self.dispatcher = CommandDispatcher(core)
+
+    def gotMessage(self, sender, request_id, *parts):
+        d = self.dispatcher.dispatch(parts)
+        d.addErrback(self.log_err)
+        d.addCallback(self.defer_reply, sender, request_id)
+
+    def defer_reply(self, response, sender, request_id):
+        reactor.callLater(
+            0, self.sendMultipart, sender, [request_id, str(response)])
+
+    def log_err(self, failure):
+        log.err(failure)
+        return "ERROR: %r" % failure
+
+    def do_greet(self):
+        log.msg('starting pipelined ZMQ dispatcher')
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# client.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Pipelined client for the bitmask-core ROUTER dispatcher.
+
+Usage::
+
+    client = get_pipelined_client()
+    d1 = client.send('user', 'authenticate', username, password)
+    d2 = client.send('status')
+    d3 = client.send('stats')
+
+The three requests are in flight at the same time, and each Deferred fires
+with the reply to its own request, as soon as it is available.
+
+Methods can also be invoked through the structured protocol, in which case
+the Deferred fires with the decoded result instead of a json string::
+
+    d = client.call('mail.status')
+
+To get the core events pushed as they happen, instead of polling::
+
+    def on_event(topic, data):
+        print topic, data
+
+    subscriber = get_events_subscriber(on_event, ['service', 'soledad'])
+"""
+import itertools
+import json
+
+from twisted.internet import defer, reactor
+
+from txzmq import ZmqEndpoint, ZmqEndpointType
+from txzmq import ZmqFactory, ZmqDealerConnection, ZmqSubConnection
+from txzmq import ZmqRequestTimeoutError
+
+from leap.bitmask.core import PIPELINED_ENDPOINT, EVENTS_ENDPOINT
+from leap.bitmask.core import protocol
+
+
+class PipelinedClient(ZmqDealerConnection):
+
+    """
+    A DEALER connection that tags each request with an id and keeps track of
+    all the outstanding ones.
+    """
+
+    def __init__(self, *args, **kwargs):
+        ZmqDealerConnection.__init__(self, *args, **kwargs)
+        self._counter = itertools.count()
+        self._requests = {}
+
+    @property
+    def pending(self):
+        """
+        Number of requests waiting for a reply.
+        """
+        return len(self._requests)
+
+    def send(self, *parts, **kw):
+        """
+        Send a command to the dispatcher.
+
+        :param parts: the command and its arguments.
+        :type parts: tuple of str
+        :param timeout: seconds to wait for the reply, or None to wait
+                        forever.
+        :type timeout: float
+
+        :return: a Deferred that will fire with the (json-encoded) response.
+        :rtype: Deferred
+        """
+        timeout = kw.get('timeout', None)
+        request_id = str(next(self._counter))
+
+        d = defer.Deferred(canceller=lambda _: self._cancel(request_id))
+        call = None
+        if timeout is not None:
+            call = reactor.callLater(timeout, self._timeout, request_id)
+        self._requests[request_id] = (d, call)
+
+        self.sendMultipart([request_id] + [str(p) for p in parts])
+        return d
+
+    def call(self, method, *params, **kw):
+        """
+        Invoke a method using the structured protocol.
+
+        :param method: the method name, as in 'mail.status'.
+        :type method: str
+        :param encoding: protocol.JSON or protocol.MSGPACK.
+        :type encoding: str
+        :param timeout: seconds to wait for the reply.
+        :type timeout: float
+
+        :return: a Deferred that will fire with the result, or fail with
+                 protocol.RemoteError.
+        :rtype: Deferred
+        """
+        encoding = kw.pop('encoding', protocol.JSON)
+        data = protocol.encode_request(method, params, encoding=encoding)
+        d = self.send(data, **kw)
+        d.addCallback(lambda response: protocol.decode_response(response)[1])
+        return d
+
+    def gotMessage(self, request_id, *response):
+        pending = self._requests.pop(request_id, None)
+        if pending is None:
+            # late reply to a request that timed out or was cancelled
+            return
+        d, call = pending
+        if call is not None and call.active():
+            call.cancel()
+        d.callback(response[0] if len(response) == 1 else response)
+
+    def _timeout(self, request_id):
+        pending = self._requests.pop(request_id, None)
+        if pending is not None:
+            d, _ = pending
+            d.errback(ZmqRequestTimeoutError(request_id))
+
+    def _cancel(self, request_id):
+        pending = self._requests.pop(request_id, None)
+        if pending is not None:
+            _, call = pending
+            if call is not None and call.active():
+                call.cancel()
+
+
+def get_pipelined_client(endpoint=PIPELINED_ENDPOINT):
+    zf = ZmqFactory()
+    e = ZmqEndpoint(ZmqEndpointType.connect, endpoint)
+    return PipelinedClient(zf, e)
+
+
+class EventsSubscriber(ZmqSubConnection):
+
+    """
+    A SUB connection to the core events publisher.
+    """
+
+    def __init__(self, factory, endpoint, callback):
+        ZmqSubConnection.__init__(self, factory, endpoint)
+        self._callback = callback
+
+    def gotMessage(self, message, tag):
+        event = json.loads(message)
+        self._callback(event['topic'], event['data'])
+
+
+def get_events_subscriber(callback, topics=(), endpoint=EVENTS_ENDPOINT):
+    """
+    Get a connection to the core events.
+
+    :param callback: will be called with (topic, data) for each event.
+    :type callback: callable
+    :param topics: the topic prefixes to subscribe to. All of them if empty.
+    :type topics: iterable of str
+    """
+    zf = ZmqFactory()
+    e = ZmqEndpoint(ZmqEndpointType.connect, endpoint)
+    subscriber = EventsSubscriber(zf, e, callback)
+    for topic in (topics or ('',)):
+        subscriber.subscribe(topic)
+    return subscriber
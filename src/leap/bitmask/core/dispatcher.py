@@ -22,6 +22,7 @@ import json
 from twisted.internet import defer
 from twisted.python import failure, log
 
+from . import protocol
 from .api import APICommand, register_method
 
 
@@ -154,6 +155,18 @@ class MailCmd(SubCommand):
         return d
 
 
+class KeysCmd(SubCommand):
+
+    label = 'keys'
+
+    @register_method('[(list, str)]')
+    def do_LIST_KEYS(self, keymanager, *parts, **kw):
+        bonafide = kw['bonafide']
+        d = bonafide.do_get_active_user()
+        d.addCallback(keymanager.do_list_keys)
+        return d
+
+
 class CommandDispatcher(object):
 
     __metaclass__ = APICommand
@@ -166,47 +179,92 @@ class CommandDispatcher(object):
         self.subcommand_user = UserCmd()
         self.subcommand_eip = EIPCmd()
         self.subcommand_mail = MailCmd()
+        self.subcommand_keys = KeysCmd()
 
     # XXX --------------------------------------------
     # TODO move general services to another subclass
 
     @register_method("{'mem_usage': str}")
     def do_STATS(self, *parts):
-        return _format_result(self.core.do_stats())
+        return self.core.do_stats()
 
     @register_method("{version_core': '0.0.0'}")
     def do_VERSION(self, *parts):
-        return _format_result(self.core.do_version())
+        return self.core.do_version()
 
     @register_method("{'mail': 'running'}")
     def do_STATUS(self, *parts):
-        return _format_result(self.core.do_status())
+        return self.core.do_status()
 
     @register_method("{'shutdown': 'ok'}")
     def do_SHUTDOWN(self, *parts):
-        return _format_result(self.core.do_shutdown())
+        return self.core.do_shutdown()
+
+    @register_method("{'version': int, 'methods': {str: str}}")
+    def do_SCHEMA(self, *parts):
+        return protocol.get_schema()
+
+    @register_method("[{'error': str, 'result': object}]")
+    def do_BATCH(self, *parts):
+        """
+        Run several commands in one round trip.
+
+        The only argument is a json-encoded list of commands, each of them
+        being the list of parts of a regular command::
+
+            batch [["status"], ["stats"], ["mail", "status"]]
+
+        All the commands are dispatched at once, and the reply is a json
+        array with one result/error envelope per command, in the same order.
+        A failing or malformed command does not affect the others.
+        """
+        try:
+            commands = parts[1]
+            if isinstance(commands, basestring):
+                commands = json.loads(commands)
+        except (IndexError, ValueError):
+            raise ValueError('batch expects a json list of commands')
+        if not isinstance(commands, list):
+            raise ValueError('batch expects a json list of commands')
+
+        def dispatch_one(cmd):
+            if (not isinstance(cmd, list) or not cmd or
+                    not all(isinstance(part, basestring) for part in cmd)):
+                raise ValueError(
+                    'Each command must be a non-empty list of strings')
+            if cmd[0].lower() == 'batch':
+                raise RuntimeError('Nested batches are not allowed')
+            return self._dispatch(cmd)
+
+        deferreds = []
+        for cmd in commands:
+            d = defer.maybeDeferred(dispatch_one, cmd)
+            d.addCallbacks(_result_envelope, _error_envelope)
+            deferreds.append(d)
+
+        d = defer.DeferredList(deferreds, consumeErrors=True)
+        d.addCallback(lambda results: [r for _, r in results])
+        return d
 
     # -----------------------------------------------
 
     def do_USER(self, *parts):
         bonafide = self._get_service('bonafide')
         d = self.subcommand_user.dispatch(bonafide, *parts)
-        d.addCallbacks(_format_result, _format_error)
         return d
 
     def do_EIP(self, *parts):
         eip = self._get_service(self.subcommand_eip.label)
         if not eip:
-            return _format_result('eip: disabled')
+            return 'eip: disabled'
         subcmd = parts[1]
 
-        dispatch = self._subcommand_eip.dispatch
+        dispatch = self.subcommand_eip.dispatch
         if subcmd in ('enable', 'disable'):
             d = dispatch(self.core, *parts)
         else:
             d = dispatch(eip, *parts)
 
-        d.addCallbacks(_format_result, _format_error)
         return d
 
     def do_MAIL(self, *parts):
@@ -221,33 +279,77 @@ class CommandDispatcher(object):
         kw = {'bonafide': bonafide}
 
         if not mail:
-            return _format_result('mail: disabled')
+            return 'mail: disabled'
 
         if subcmd == 'disable':
             d = dispatch(self.core)
         else:
             d = dispatch(mail, *parts, **kw)
 
-        d.addCallbacks(_format_result, _format_error)
         return d
 
     def do_KEYS(self, *parts):
-        subcmd = parts[1]
-
         keymanager_label = 'keymanager'
         km = self._get_service(keymanager_label)
         bf = self._get_service('bonafide')
 
         if not km:
-            return _format_result('keymanager: disabled')
+            return 'keymanager: disabled'
 
-        if subcmd == 'list_keys':
-            d = bf.do_get_active_user()
-            d.addCallback(km.do_list_keys)
-            d.addCallbacks(_format_result, _format_error)
-            return d
+        return self.subcommand_keys.dispatch(km, *parts, bonafide=bf)
 
     def dispatch(self, msg):
+        """
+        Dispatch a command.
+
+        :param msg: the parts of a whitespace-split command, or a single
+                    structured message (see the protocol module).
+        :type msg: list of str
+
+        :return: a Deferred that fires with the encoded response.
+        :rtype: Deferred
+        """
+        if len(msg) == 1 and protocol.is_structured(msg[0]):
+            return self.dispatch_message(msg[0])
+
+        d = self._dispatch(msg)
+        d.addCallbacks(_format_result, _format_error)
+        return d
+
+    def dispatch_message(self, data):
+        """
+        Dispatch a structured, versioned request, and encode the response
+        with the same encoding that was used for the request.
+        """
+        encoding = protocol.get_encoding(data)
+        try:
+            request = protocol.decode_request(data)
+        except protocol.ProtocolError as exc:
+            log.msg('Bad request: %s' % exc)
+            return defer.succeed(protocol.encode_response(
+                None, error=str(exc), encoding=encoding))
+
+        label, subcmd = request.method.split('.', 1)
+        if label == self.label:
+            parts = [subcmd]
+        else:
+            parts = [label, subcmd]
+        parts.extend(request.params)
+
+        def encode_result(result):
+            return protocol.encode_response(
+                request.id, result=result, encoding=encoding)
+
+        def encode_error(failure):
+            log.err(failure)
+            return protocol.encode_response(
+                request.id, error=failure.value.message, encoding=encoding)
+
+        d = self._dispatch(parts)
+        d.addCallbacks(encode_result, encode_error)
+        return d
+
+    def _dispatch(self, msg):
         cmd = msg[0]
 
         _method = getattr(self, 'do_' + cmd.upper(), None)
@@ -264,10 +366,18 @@ class CommandDispatcher(object):
             return None
 
 
+def _result_envelope(result):
+    return {'error': None, 'result': result}
+
+
+def _error_envelope(failure):
+    log.err(failure)
+    return {'error': failure.value.message, 'result': None}
+
+
 def _format_result(result):
-    return json.dumps({'error': None, 'result': result})
+    return json.dumps(_result_envelope(result))
 
 
 def _format_error(failure):
-    log.err(failure)
-    return json.dumps({'error': failure.value.message, 'result': None})
+    return json.dumps(_error_envelope(failure))
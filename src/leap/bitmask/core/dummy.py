@@ -17,8 +17,6 @@
 """
 An authoritative dummy backend for tests.
 """
-import json
-
 from leap.common.service_hooks import HookableService
 
 
@@ -32,12 +30,11 @@ class BackendCommands(object):
         self.core = core
 
     def do_status(self):
-        return json.dumps(
-            {'soledad': 'running',
-             'keymanager': 'running',
-             'mail': 'running',
-             'eip': 'stopped',
-             'backend': 'dummy'})
+        return {'soledad': 'running',
+                'keymanager': 'running',
+                'mail': 'running',
+                'eip': 'stopped',
+                'backend': 'dummy'}
 
     def do_version(self):
         return {'version_core': '0.0.1'}
@@ -57,9 +54,18 @@ class mail_services(object):
     class KeymanagerService(HookableService):
         pass
 
-    class StandardMailService(HookableService):
+    @staticmethod
+    def set_server_strategy(name, **kwargs):
         pass
 
+    class StandardMailService(HookableService):
+
+        def __init__(self, basedir, idle_timeout=0):
+            pass
+
+        def do_stats(self):
+            return {}
+
 
 class BonafideService(HookableService):
 
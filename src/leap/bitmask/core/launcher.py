@@ -20,14 +20,19 @@ Run bitmask daemon.
 from os.path import join
 from sys import argv
 
-from twisted.scripts.twistd import run
-
-from leap.bitmask.util import here
-from leap.bitmask import core
-from leap.bitmask.core import flags
+from leap.bitmask.importprofile import profile_imports_if_requested
 
 
 def run_bitmaskd():
+    # the report is written to the log file when the daemon exits.
+    profile_imports_if_requested(argv)
+
+    from twisted.scripts.twistd import run
+
+    from leap.bitmask.util import here
+    from leap.bitmask import core
+    from leap.bitmask.core import flags
+
     # TODO --- configure where to put the logs... (get --logfile, --logdir
     # from the bitmask_cli
     for (index, arg) in enumerate(argv):
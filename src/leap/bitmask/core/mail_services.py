@@ -22,11 +22,16 @@ This should be moved to the different packages when it stabilizes.
 """
 import json
 import os
+import time
+from collections import Mapping
 from collections import defaultdict
 from collections import namedtuple
 
+import psutil
+
 from twisted.application import service
 from twisted.internet import defer
+from twisted.internet.task import LoopingCall
 from twisted.python import log
 
 from leap.bonafide import config
@@ -40,8 +45,10 @@ from leap.mail.imap.service import imap
 from leap.mail.incoming.service import IncomingMail, INCOMING_CHECK_PERIOD
 from leap.mail import smtp
 
+from leap.bitmask.config.cache import config_cache
 from leap.bitmask.core.uuid_map import UserMap
 from leap.bitmask.core.configurable import DEFAULT_BASEDIR
+from leap.bitmask.util import server_selection
 
 
 class Container(object):
@@ -57,6 +64,9 @@ class Container(object):
     def add_instance(self, key, data):
         self._instances[key] = data
 
+    def remove_instance(self, key):
+        return self._instances.pop(key, None)
+
 
 class ImproperlyConfigured(Exception):
     pass
@@ -199,6 +209,13 @@ class SoledadService(HookableService):
                 container.add_instance(
                     userid, password, uuid=uuid, token=token)
 
+    def hook_on_mail_instance_stopped(self, **kw):
+        userid = kw['userid']
+        soledad = self._container.remove_instance(userid)
+        if soledad is not None:
+            log.msg("Closing Soledad Instance: %s" % userid)
+            soledad.close()
+
 
 class KeymanagerContainer(Container):
 
@@ -345,6 +362,11 @@ class KeymanagerService(HookableService):
                 log.msg('storing the keymanager token... %s ' % token)
                 self.tokens[userid] = token
 
+    def hook_on_mail_instance_stopped(self, **kw):
+        userid = kw['userid']
+        log.msg('Removing Keymanager instance for %s' % userid)
+        self._container.remove_instance(userid)
+
     # commands
 
     def do_list_keys(self, userid):
@@ -356,6 +378,211 @@ class KeymanagerService(HookableService):
         return d
 
 
+class _AccountSessions(Mapping):
+    """
+    A read-only view of one attribute of the running mail accounts, indexed
+    by userid, as the IMAP and SMTP services expect their sessions.
+
+    Every lookup counts as activity on the account.
+    """
+
+    def __init__(self, mail_service, attribute):
+        self._mail = mail_service
+        self._attribute = attribute
+
+    def __getitem__(self, userid):
+        account = self._mail._get_account(userid)
+        if account is None or not account.running:
+            raise KeyError(userid)
+        self._mail._accessed(userid)
+        return getattr(account, self._attribute)
+
+    def __iter__(self):
+        return iter([account.userid for account in self._mail._get_accounts()
+                     if account.running])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class _ConnectionTracker(object):
+    """
+    Keeps track of the open IMAP and SMTP connections, and of the accounts
+    that each of them uses.
+
+    The protocols look the sessions up when the user authenticates, and keep
+    the Soledad and Keymanager instances for as long as the connection stays
+    open. A lookup made while a connection handles its data binds the account
+    to that connection. A connection that has not looked up any account yet
+    could still use any of them.
+    """
+
+    def __init__(self, on_activity):
+        self._on_activity = on_activity
+        self._connections = {}  # protocol -> set of userids
+        self._current = None
+
+    def track(self, factory):
+        """
+        Track the connections of the protocols built by factory.
+        """
+        build = factory.buildProtocol
+
+        def buildProtocol(addr):
+            protocol = build(addr)
+            if protocol is not None:
+                self._wrap(protocol)
+            return protocol
+
+        factory.buildProtocol = buildProtocol
+
+    def accessed(self, userid):
+        userids = self._connections.get(self._current)
+        if userids is not None:
+            userids.add(userid)
+
+    def in_use(self, userid):
+        """
+        Return whether an open connection uses, or could use, the account.
+        """
+        return any(not userids or userid in userids
+                   for userids in self._connections.itervalues())
+
+    def count(self, userid):
+        return len([userids for userids in self._connections.itervalues()
+                    if userid in userids])
+
+    def _wrap(self, protocol):
+        self._connections[protocol] = set()
+        data_received = protocol.dataReceived
+        connection_lost = protocol.connectionLost
+
+        def dataReceived(data):
+            for userid in self._connections.get(protocol, ()):
+                self._on_activity(userid)
+            previous, self._current = self._current, protocol
+            try:
+                return data_received(data)
+            finally:
+                self._current = previous
+
+        def connectionLost(reason):
+            for userid in self._connections.pop(protocol, ()):
+                self._on_activity(userid)
+            return connection_lost(reason)
+
+        protocol.dataReceived = dataReceived
+        protocol.connectionLost = connectionLost
+
+
+class MailAccount(service.Service):
+    """
+    The mail session for a single user.
+
+    It owns the per-user state: the Soledad and Keymanager instances, the
+    sendmail options and the service tokens. Starting it starts the incoming
+    mail for the user and gets the tokens, stopping it stops the incoming
+    mail. It also keeps some accounting about the resources that it holds,
+    so that idle accounts can be evicted.
+    """
+
+    def __init__(self, userid, soledad, keymanager, sendmail_opts):
+        self.setName(userid)
+        self.userid = userid
+        self.soledad = soledad
+        self.keymanager = keymanager
+        self.sendmail_opts = sendmail_opts
+        self.imap_token = None
+        self.smtp_token = None
+        self.ready = defer.succeed(None)
+        self.started = self.last_activity = time.time()
+
+    def startService(self):
+        service.Service.startService(self)
+        self.started = self.last_activity = time.time()
+        incoming = self.parent.getServiceNamed('incoming_mail')
+        incoming.startInstance(self.userid)
+        self.ready = self._get_tokens()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        self.imap_token = self.smtp_token = None
+        incoming = self.parent.getServiceNamed('incoming_mail')
+        incoming.stopInstance(self.userid)
+
+    def refresh(self, soledad, keymanager):
+        """
+        Use new Soledad and Keymanager instances, when the user logs in again
+        without logging out.
+
+        :return: a Deferred that fires when the account is ready again.
+        :rtype: Deferred
+        """
+        if soledad is self.soledad and keymanager is self.keymanager:
+            return self.ready
+
+        running = self.running
+        if running:
+            self.stopService()
+        self.soledad = soledad
+        self.keymanager = keymanager
+        if running:
+            self.startService()
+        return self.ready
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    @property
+    def idle_time(self):
+        return time.time() - self.last_activity
+
+    def get_stats(self):
+        """
+        Return the accounting for this account.
+
+        Memory can not be told apart between accounts that live in the same
+        process, so we account for what each of them keeps open instead: the
+        file descriptors for its Soledad databases, and their size on disk.
+        """
+        uuid = getattr(self.soledad, 'uuid', None)
+        open_files = []
+        if uuid:
+            process = psutil.Process(os.getpid())
+            try:
+                files = process.open_files()
+            except AttributeError:
+                # psutil < 2.0.0
+                files = process.get_open_files()
+            open_files = [f.path for f in files if uuid in f.path]
+        storage = sum(
+            os.path.getsize(path) for path in set(open_files)
+            if os.path.isfile(path))
+        now = time.time()
+        return {'uptime': int(now - self.started),
+                'idle': int(now - self.last_activity),
+                'open_files': len(open_files),
+                'storage': storage}
+
+    def _get_tokens(self):
+        soledad = self.soledad
+
+        def registerIMAPToken(token):
+            self.imap_token = token
+            return token
+
+        def registerSMTPToken(token):
+            self.smtp_token = token
+            return token
+
+        d = soledad.get_or_create_service_token('imap')
+        d.addCallback(registerIMAPToken)
+        d.addCallback(
+            lambda _: soledad.get_or_create_service_token('smtp'))
+        d.addCallback(registerSMTPToken)
+        return d
+
+
 class StandardMailService(service.MultiService, HookableService):
     """
     A collection of Services.
@@ -368,6 +595,17 @@ class StandardMailService(service.MultiService, HookableService):
         - The IncomingMail Service, which doesn't listen on any port, but
           watches and processes the Incoming Queue and saves the processed mail
           into the matching INBOX.
+
+    Each user is modelled as a MailAccount child service, that can be started
+    and stopped independently. When idle_timeout is set, the accounts that
+    have not been used for that many seconds, and that no open IMAP or SMTP
+    connection uses, are stopped, and their Soledad and Keymanager instances
+    are released.
+
+    An evicted account is not started again when a mail client tries to use
+    it: its Soledad instance can not be unlocked without the user passphrase,
+    so the IMAP and SMTP logins fail until the user logs in again, which
+    starts a new account.
     """
 
     name = 'mail'
@@ -376,22 +614,26 @@ class StandardMailService(service.MultiService, HookableService):
 
     subscribed_to_hooks = ('on_new_keymanager_instance',)
 
-    def __init__(self, basedir):
+    EVICTION_CHECK_PERIOD = 60  # in seconds
+
+    def __init__(self, basedir, idle_timeout=0):
         self._basedir = basedir
-        self._soledad_sessions = {}
-        self._keymanager_sessions = {}
-        self._sendmail_opts = {}
-        self._imap_tokens = {}
-        self._smtp_tokens = {}
+        self._idle_timeout = idle_timeout
+        self._soledad_sessions = _AccountSessions(self, 'soledad')
+        self._keymanager_sessions = _AccountSessions(self, 'keymanager')
+        self._sendmail_opts = _AccountSessions(self, 'sendmail_opts')
+        self._connections = _ConnectionTracker(self._touch)
         self._active_user = None
+        self._eviction_loop = LoopingCall(self._evict_idle_accounts)
         super(StandardMailService, self).__init__()
         self.initializeChildrenServices()
 
     def initializeChildrenServices(self):
-        self.addService(IMAPService(self._soledad_sessions))
+        self.addService(IMAPService(
+            self._soledad_sessions, self._connections))
         self.addService(SMTPService(
             self._soledad_sessions, self._keymanager_sessions,
-            self._sendmail_opts))
+            self._sendmail_opts, connections=self._connections))
         # TODO adapt the service to receive soledad/keymanager sessions object.
         # See also the TODO before IncomingMailService.startInstance
         self.addService(IncomingMailService(self))
@@ -399,40 +641,83 @@ class StandardMailService(service.MultiService, HookableService):
     def startService(self):
         log.msg('Starting Mail Service...')
         super(StandardMailService, self).startService()
+        if self._idle_timeout:
+            self._eviction_loop.start(
+                self.EVICTION_CHECK_PERIOD, now=False)
 
     def stopService(self):
+        if self._eviction_loop.running:
+            self._eviction_loop.stop()
         super(StandardMailService, self).stopService()
 
     def startInstance(self, userid, soledad, keymanager):
-        username, provider = userid.split('@')
+        """
+        Start the mail account for this user, or make the running one use
+        the new Soledad and Keymanager instances.
 
-        self._soledad_sessions[userid] = soledad
-        self._keymanager_sessions[userid] = keymanager
+        :return: a Deferred that fires when the service tokens are ready.
+        :rtype: Deferred
+        """
+        self._active_user = userid
 
-        sendmail_opts = _get_sendmail_opts(self._basedir, provider, username)
-        self._sendmail_opts[userid] = sendmail_opts
+        account = self._get_account(userid)
+        if account is not None:
+            log.msg('Refreshing Mail instance for %s' % userid)
+            return account.refresh(soledad, keymanager)
 
-        incoming = self.getServiceNamed('incoming_mail')
-        incoming.startInstance(userid)
-
-        def registerIMAPToken(token):
-            self._imap_tokens[userid] = token
-            self._active_user = userid
-            return token
-
-        def registerSMTPToken(token):
-            self._smtp_tokens[userid] = token
-            return token
+        username, provider = userid.split('@')
+        sendmail_opts = _get_sendmail_opts(self._basedir, provider, username)
+        account = MailAccount(userid, soledad, keymanager, sendmail_opts)
+        account.setServiceParent(self)
+        return account.ready
 
-        d = soledad.get_or_create_service_token('imap')
-        d.addCallback(registerIMAPToken)
+    def stopInstance(self, userid):
+        """
+        Stop the mail account for this user, and release its resources.
+        """
+        account = self._get_account(userid)
+        if account is None:
+            return defer.succeed(None)
+
+        log.msg('Stopping Mail instance for %s' % userid)
+        if self._active_user == userid:
+            self._active_user = None
+
+        d = defer.maybeDeferred(account.disownServiceParent)
         d.addCallback(
-            lambda _: soledad.get_or_create_service_token('smtp'))
-        d.addCallback(registerSMTPToken)
+            lambda _: self.trigger_hook(
+                'on_mail_instance_stopped', userid=userid))
         return d
 
-    def stopInstance(self):
-        pass
+    def _get_account(self, userid):
+        try:
+            account = self.getServiceNamed(userid)
+        except KeyError:
+            return None
+        if isinstance(account, MailAccount):
+            return account
+
+    def _get_accounts(self):
+        return [s for s in self if isinstance(s, MailAccount)]
+
+    def _touch(self, userid):
+        account = self._get_account(userid)
+        if account is not None:
+            account.touch()
+
+    def _accessed(self, userid):
+        self._touch(userid)
+        self._connections.accessed(userid)
+
+    def _evict_idle_accounts(self):
+        for account in self._get_accounts():
+            if account.idle_time <= self._idle_timeout:
+                continue
+            if self._connections.in_use(account.userid):
+                continue
+            log.msg('Evicting idle Mail instance for %s' % account.userid)
+            d = self.stopInstance(account.userid)
+            d.addErrback(log.err)
 
     # hooks
 
@@ -444,18 +729,29 @@ class StandardMailService(service.MultiService, HookableService):
         keymanager = kw['keymanager']
 
         # TODO --- only start instance if "autostart" is True.
-        self.startInstance(userid, soledad, keymanager)
+        d = self.startInstance(userid, soledad, keymanager)
+        d.addErrback(log.err)
 
     # commands
 
     def do_status(self):
         return 'mail: %s' % 'running' if self.running else 'disabled'
 
+    def do_stats(self):
+        stats = {}
+        for account in self._get_accounts():
+            stats[account.userid] = account.get_stats()
+            stats[account.userid]['connections'] = self._connections.count(
+                account.userid)
+        return stats
+
     def get_imap_token(self):
         active_user = self._active_user
         if not active_user:
             return defer.succeed('NO ACTIVE USER')
-        token = self._imap_tokens.get(active_user)
+        self._touch(active_user)
+        account = self._get_account(active_user)
+        token = account.imap_token if account is not None else None
         # TODO return just the tuple, no format.
         return defer.succeed("IMAP TOKEN (%s): %s" % (active_user, token))
 
@@ -463,7 +759,9 @@ class StandardMailService(service.MultiService, HookableService):
         active_user = self._active_user
         if not active_user:
             return defer.succeed('NO ACTIVE USER')
-        token = self._smtp_tokens.get(active_user)
+        self._touch(active_user)
+        account = self._get_account(active_user)
+        token = account.smtp_token if account is not None else None
         # TODO return just the tuple, no format.
         return defer.succeed("SMTP TOKEN (%s): %s" % (active_user, token))
 
@@ -484,8 +782,10 @@ class IMAPService(service.Service):
 
     name = 'imap'
 
-    def __init__(self, soledad_sessions):
+    def __init__(self, soledad_sessions, connections=None):
         port, factory = imap.run_service(soledad_sessions)
+        if connections is not None:
+            connections.track(factory)
 
         self._port = port
         self._factory = factory
@@ -507,11 +807,13 @@ class SMTPService(service.Service):
     name = 'smtp'
 
     def __init__(self, soledad_sessions, keymanager_sessions, sendmail_opts,
-                 basedir=DEFAULT_BASEDIR):
+                 basedir=DEFAULT_BASEDIR, connections=None):
 
         self._basedir = os.path.expanduser(basedir)
         port, factory = smtp.run_service(
             soledad_sessions, keymanager_sessions, sendmail_opts)
+        if connections is not None:
+            connections.track(factory)
         self._port = port
         self._factory = factory
         self._soledad_sessions = soledad_sessions
@@ -562,8 +864,9 @@ class IncomingMailService(service.Service):
             keymanager, soledad, userid)
 
     def stopInstance(self, userid):
-        # TODO toggle offline!
-        pass
+        incoming_instance = self._instances.pop(userid, None)
+        if incoming_instance is not None and incoming_instance.running:
+            incoming_instance.stopService()
 
     def _start_incoming_mail_instance(self, keymanager, soledad,
                                       userid, start_sync=True):
@@ -576,6 +879,10 @@ class IncomingMailService(service.Service):
             return incoming_mail
 
         def registerInstance(incoming_instance):
+            if self._mail.get_soledad_session(userid) is not soledad:
+                # the account was stopped, or got a new soledad instance,
+                # while we were setting up
+                return
             self._instances[userid] = incoming_instance
             if start_sync:
                 incoming_instance.startService()
@@ -633,28 +940,48 @@ def _get_config_for_service(service, basedir, provider):
     config_path = os.path.join(
         basedir, 'providers', provider, '%s-service.json' % service)
     try:
-        with open(config_path) as config:
-            config = json.loads(config.read())
+        return config_cache.get((provider, service), config_path, _load_json)
     except IOError:
         # FIXME might be that the provider DOES NOT offer this service!
         raise ImproperlyConfigured(
             'could not open config file %s' % config_path)
-    else:
-        return config
 
 
-def first(xs):
-    return xs[0]
+def _load_json(path):
+    with open(path) as config:
+        return json.loads(config.read())
+
+
+# probes never block the reactor: until they finish, the closest server by
+# timezone is used.
+_server_strategy = server_selection.get_strategy('rtt', background=True)
 
 
-def _pick_server(config, strategy=first):
+def set_server_strategy(name, **kwargs):
+    """
+    Set the strategy used to choose the soledad and smtp servers.
+
+    :param name: one of the names in server_selection.STRATEGIES
+    :type name: str
+    """
+    global _server_strategy
+    if name == 'rtt':
+        kwargs.setdefault('background', True)
+    _server_strategy = server_selection.get_strategy(name, **kwargs)
+
+
+def _pick_server(config, strategy=None):
     """
     Picks a server from a list of possible choices.
-    The service files have a  <describe>.
-    This implementation just picks the FIRST available server.
+
+    The service files have a 'hosts' dict, and may have a 'locations' one
+    (see server_selection). The server is chosen with the given strategy,
+    or with the one that has been set for the whole service.
     """
-    servers = config['hosts'].keys()
-    choice = config['hosts'][strategy(servers)]
+    if strategy is None:
+        strategy = _server_strategy
+    hosts = config['hosts']
+    choice = hosts[strategy.pick(hosts, config.get('locations'))]
     return choice
 
 
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# protocol.py
+# Copyright (C) 2016 LEAP Encryption Acess Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Structured wire protocol for the Bitmask Core API.
+
+A request is a map with the protocol version, an optional id chosen by the
+client, the name of the method and a list of positional parameters::
+
+    {'v': 1, 'id': 42, 'method': 'mail.status', 'params': []}
+
+and the response is a map with the same version and id, and either a result
+or an error::
+
+    {'v': 1, 'id': 42, 'error': None, 'result': {...}}
+
+The valid method names are taken from the API registry (see api.py): a
+method registered as 'mail.do_STATUS' is called as 'mail.status'.
+
+Messages are encoded either as json or, if msgpack is installed, as msgpack.
+The encoding of a request is guessed from its first byte, and the response
+is encoded the same way. Plain whitespace-separated commands can never be
+mistaken for one of these.
+"""
+import json
+from collections import namedtuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from leap.bitmask.core.api import registry
+
+
+PROTOCOL_VERSION = 1
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+
+class ProtocolError(Exception):
+    """
+    The message does not follow the protocol.
+    """
+
+
+class RemoteError(Exception):
+    """
+    The remote end replied with an error.
+    """
+
+
+Request = namedtuple('Request', ['id', 'method', 'params', 'encoding'])
+
+
+def get_encoding(data):
+    """
+    Guess the encoding of a structured message.
+
+    :return: JSON, MSGPACK or None if this is not a structured message.
+    :rtype: str
+    """
+    if not data:
+        return None
+    first = ord(data[0])
+    if first == ord('{'):
+        return JSON
+    # fixmap, map16 and map32
+    is_map = 0x80 <= first <= 0x8f or first in (0xde, 0xdf)
+    if msgpack is not None and is_map:
+        return MSGPACK
+    return None
+
+
+def is_structured(data):
+    return get_encoding(data) is not None
+
+
+def dumps(obj, encoding=JSON):
+    if encoding == MSGPACK:
+        if msgpack is None:
+            raise ProtocolError('msgpack is not available')
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj)
+
+
+def loads(data, encoding=JSON):
+    if encoding == MSGPACK:
+        if msgpack is None:
+            raise ProtocolError('msgpack is not available')
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except TypeError:
+            # msgpack < 0.5.2 has no raw, and decodes with encoding
+            return msgpack.unpackb(data, encoding='utf-8')
+    return json.loads(data)
+
+
+# the registry only grows, as the classes of the API are defined, so the
+# methods are mapped again only when its size changes.
+_methods = (0, {})
+
+
+def get_methods():
+    """
+    Map the public method names to their type annotations.
+
+    The mapping is shared, it must not be modified.
+
+    :rtype: dict
+    """
+    global _methods
+    size, methods = _methods
+    if size == len(registry):
+        return methods
+
+    methods = {}
+    for key, annotation in registry.items():
+        label, method = key.split('.', 1)
+        if not method.startswith('do_'):
+            continue
+        name = '%s.%s' % (label, method[3:].lower())
+        methods[name] = annotation[0] if len(annotation) == 1 else annotation
+    _methods = (len(registry), methods)
+    return methods
+
+
+def get_schema():
+    return {'version': PROTOCOL_VERSION, 'methods': get_methods()}
+
+
+def encode_request(method, params=(), request_id=None, encoding=JSON):
+    return dumps({'v': PROTOCOL_VERSION, 'id': request_id,
+                  'method': method, 'params': list(params)}, encoding)
+
+
+def decode_request(data):
+    """
+    Decode and validate a request.
+
+    :rtype: Request
+    :raise ProtocolError: if the request is not valid.
+    """
+    encoding = get_encoding(data)
+    if encoding is None:
+        raise ProtocolError('Unknown encoding')
+    try:
+        msg = loads(data, encoding)
+    except (ValueError, TypeError) as exc:
+        raise ProtocolError('Malformed message: %s' % exc)
+    if not isinstance(msg, dict):
+        raise ProtocolError('Malformed message')
+
+    version = msg.get('v')
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError('Unsupported protocol version: %r' % (version,))
+
+    method = msg.get('method')
+    if method not in get_methods():
+        raise ProtocolError('No such method: %s' % (method,))
+
+    params = msg.get('params', [])
+    if not isinstance(params, list):
+        raise ProtocolError('params must be a list')
+
+    return Request(msg.get('id'), method, params, encoding)
+
+
+def encode_response(request_id, result=None, error=None, encoding=JSON):
+    return dumps({'v': PROTOCOL_VERSION, 'id': request_id,
+                  'error': error, 'result': result}, encoding or JSON)
+
+
+def decode_response(data):
+    """
+    Decode a response.
+
+    :return: the id of the request, and its result.
+    :rtype: tuple
+    :raise RemoteError: if the response carries an error.
+    """
+    encoding = get_encoding(data)
+    if encoding is None:
+        raise ProtocolError('Unknown encoding')
+    msg = loads(data, encoding)
+    if msg.get('error') is not None:
+        raise RemoteError(msg['error'])
+    return msg.get('id'), msg.get('result')
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# pubsub.py
+# Copyright (C) 2016 LEAP Encryption Acess Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Events Service: pushes state changes in the core to the subscribed clients.
+
+Events are published under dotted topics, whose first component is the name
+of the service that originated them:
+
+    - service.<name>              a core service changed its state
+    - soledad.new_instance        the soledad hooks...
+    - keymanager.new_instance     ... and the keymanager ones
+    - bonafide.auth               a user has authenticated
+    - soledad.done_data_sync      any event in leap.common.events.catalog,
+    - mail.unread_messages        with its label lowercased.
+    - ...
+
+Subscribers choose the topics they are interested in by prefix: subscribing
+to 'soledad' gets all the events of the soledad service, and subscribing to
+nothing gets everything.
+"""
+import itertools
+import json
+
+from twisted.application import service
+from twisted.internet import reactor
+from twisted.python import log
+
+from leap.common.events import catalog
+from leap.common.events import register as leap_register
+from leap.common.events import unregister as leap_unregister
+
+
+class EventsService(service.Service):
+
+    """
+    Collects the events originated in the core and dispatches them to the
+    subscribers.
+
+    The service is registered as a hook listener (see service.py), so the
+    hooks fired by the sibling services end up here too.
+    """
+
+    name = 'events'
+
+    def __init__(self):
+        self._subscribers = {}
+        self._ids = itertools.count()
+        self._registered = []  # (event, uid) of our leap event callbacks
+
+    def startService(self):
+        log.msg('Starting Events Service')
+        for label in catalog.EVENTS:
+            event = getattr(catalog, label)
+            uid = leap_register(event, self._on_leap_event)
+            if uid is not None:
+                self._registered.append((event, uid))
+        service.Service.startService(self)
+
+    def stopService(self):
+        log.msg('Stopping Events Service')
+        registered, self._registered = self._registered, []
+        for event, uid in registered:
+            leap_unregister(event, uid=uid)
+        service.Service.stopService(self)
+
+    def subscribe(self, callback, topics=()):
+        """
+        Subscribe a callback to a set of topics.
+
+        :param callback: will be called with (topic, data) for each event.
+        :type callback: callable
+        :param topics: the topic prefixes to get events for. Subscribe to
+                       all of them if empty.
+        :type topics: iterable of str
+
+        :return: a subscription id, to be passed to unsubscribe.
+        :rtype: int
+        """
+        sid = next(self._ids)
+        self._subscribers[sid] = (callback, tuple(topics))
+        return sid
+
+    def unsubscribe(self, sid):
+        self._subscribers.pop(sid, None)
+
+    def publish(self, topic, data=None):
+        for callback, topics in self._subscribers.values():
+            if topics and not topic.startswith(topics):
+                continue
+            try:
+                callback(topic, data)
+            except Exception:
+                log.err()
+
+    # leap.common.events
+
+    def _on_leap_event(self, event, *content):
+        # the events client calls us from its own thread
+        service, _, what = str(event).lower().partition('_')
+        topic = '%s.%s' % (service, what)
+        reactor.callFromThread(self.publish, topic, list(content))
+
+    # hooks
+
+    def hook_on_new_soledad_instance(self, **kw):
+        self.publish('soledad.new_instance',
+                     {'user': kw['user'], 'uuid': kw['uuid']})
+
+    def hook_on_new_keymanager_instance(self, **kw):
+        self.publish('keymanager.new_instance', {'user': kw['userid']})
+
+    def hook_on_bonafide_auth(self, **kw):
+        self.publish('bonafide.auth', {'user': kw['username']})
+
+    def hook_on_passphrase_entry(self, **kw):
+        self.publish('bonafide.passphrase_entry', {'user': kw['username']})
+
+
+def encode_event(topic, data):
+    return json.dumps({'topic': topic, 'data': data}, default=str)
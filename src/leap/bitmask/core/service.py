@@ -17,16 +17,19 @@
 """
 Bitmask-core Service.
 """
-import json
 import resource
+import time
 
-from twisted.internet import reactor
+from twisted.internet import defer, reactor, task
 from twisted.python import log
+from twisted.python.failure import Failure
 
 from leap.bitmask import __version__
+from leap.bitmask.config.cache import config_cache
 from leap.bitmask.core import configurable
 from leap.bitmask.core import _zmq
 from leap.bitmask.core import flags
+from leap.bitmask.core import pubsub
 from leap.common.events import server as event_server
 # from leap.vpn import EIPService
 
@@ -43,37 +46,127 @@ else:
     raise RuntimeError('Backend not supported')
 
 
+def _observe(d):
+    """
+    Return a new Deferred that fires with the result of d, leaving the
+    result of d untouched for its other callbacks.
+
+    :rtype: Deferred
+    """
+    observer = defer.Deferred()
+
+    def fire(result):
+        if isinstance(result, Failure):
+            observer.errback(result)
+        else:
+            observer.callback(result)
+        return result
+
+    d.addBoth(fire)
+    return observer
+
+
 class BitmaskBackend(configurable.ConfigurableService):
 
+    # the services that each service needs to be up before it can start.
+    # Anything not related can be started at the same time.
+    service_dependencies = {
+        'events': (),
+        'bonafide': ('events',),
+        'soledad': ('bonafide',),
+        'keymanager': ('soledad',),
+        'mail': ('keymanager',),
+        'eip': ('events',),
+        'zmq': ('events',),
+        'web': ('events',),
+    }
+
     def __init__(self, basedir=configurable.DEFAULT_BASEDIR):
 
         configurable.ConfigurableService.__init__(self, basedir)
         self.core_commands = BackendCommands(self)
+        self._created = time.time()
+        self._startup = {}
+        self.startup_times = {}
+        self.time_to_ready = None
 
         def enabled(service):
             return self.get_config('services', service, False, boolean=True)
 
-        on_start = reactor.callWhenRunning
-
-        on_start(self.init_events)
-        on_start(self.init_bonafide)
+        services = ['events', 'bonafide']
 
         if enabled('mail'):
-            on_start(self.init_soledad)
-            on_start(self.init_keymanager)
-            on_start(self.init_mail)
+            services += ['soledad', 'keymanager', 'mail']
 
         if enabled('eip'):
-            on_start(self.init_eip)
+            services.append('eip')
 
         if enabled('zmq'):
-            on_start(self.init_zmq)
+            services.append('zmq')
 
         if enabled('web'):
-            on_start(self.init_web)
+            services.append('web')
+
+        reactor.callWhenRunning(self.init_services, services)
+
+    def init_services(self, services):
+        """
+        Start the given services, each one as soon as the ones it depends on
+        are up, and record how long each of them takes to start.
+
+        :return: a Deferred that fires when all of them are up.
+        :rtype: Deferred
+        """
+        def on_ready(_):
+            self.time_to_ready = time.time() - self._created
+            log.msg('All services started in %.3f seconds'
+                    % self.time_to_ready)
+
+        d = defer.DeferredList(
+            [self._init_service(name, services) for name in services],
+            consumeErrors=True)
+        d.addCallback(on_ready)
+        return d
+
+    def _init_service(self, name, services):
+        if name in self._startup:
+            return self._startup[name]
+
+        # the startup of a service is shared by all the ones that depend on
+        # it, so each of them waits on its own copy of the result.
+        deps = [_observe(self._init_service(dep, services))
+                for dep in self.service_dependencies.get(name, ())
+                if dep in services]
+
+        def init(_):
+            # every service gets a reactor turn of its own
+            return task.deferLater(reactor, 0, self._timed_init, name)
+
+        def log_failure(failure):
+            log.err(failure, 'Could not start service %s' % name)
+            return failure
+
+        d = defer.gatherResults(deps, consumeErrors=True)
+        d.addCallback(init)
+        d.addErrback(log_failure)
+        self._startup[name] = d
+        return d
+
+    def _timed_init(self, name):
+        start = time.time()
+
+        def record(result):
+            self.startup_times[name] = time.time() - start
+            return result
+
+        d = defer.maybeDeferred(getattr(self, 'init_' + name))
+        d.addCallback(record)
+        return d
 
     def init_events(self):
         event_server.ensure_server()
+        events = pubsub.EventsService()
+        events.setServiceParent(self)
 
     def init_bonafide(self):
         bf = BonafideService(self.basedir)
@@ -85,6 +178,8 @@ class BitmaskBackend(configurable.ConfigurableService):
         bf.register_hook('on_passphrase_entry', listener='soledad')
         bf.register_hook('on_bonafide_auth', listener='soledad')
         bf.register_hook('on_bonafide_auth', listener='keymanager')
+        bf.register_hook('on_passphrase_entry', listener='events')
+        bf.register_hook('on_bonafide_auth', listener='events')
 
     def init_soledad(self):
         service = mail_services.SoledadService
@@ -93,6 +188,8 @@ class BitmaskBackend(configurable.ConfigurableService):
         if sol:
             sol.register_hook(
                 'on_new_soledad_instance', listener='keymanager')
+            sol.register_hook(
+                'on_new_soledad_instance', listener='events')
 
     def init_keymanager(self):
         service = mail_services.KeymanagerService
@@ -100,10 +197,23 @@ class BitmaskBackend(configurable.ConfigurableService):
             'keymanager', service, self.basedir)
         if km:
             km.register_hook('on_new_keymanager_instance', listener='mail')
+            km.register_hook('on_new_keymanager_instance', listener='events')
 
     def init_mail(self):
+        strategy = self.get_config('mail', 'server_strategy', '')
+        if strategy:
+            mail_services.set_server_strategy(strategy)
+
         service = mail_services.StandardMailService
-        self._maybe_start_service('mail', service, self.basedir)
+        # the accounts that are evicted after idle_timeout seconds are only
+        # started again when the user logs in again.
+        idle_timeout = int(self.get_config('mail', 'idle_timeout', 0))
+        mail = self._maybe_start_service(
+            'mail', service, self.basedir, idle_timeout=idle_timeout)
+        if mail:
+            mail.register_hook('on_mail_instance_stopped', listener='soledad')
+            mail.register_hook(
+                'on_mail_instance_stopped', listener='keymanager')
 
     def init_eip(self):
         # FIXME -- land EIP into leap.vpn
@@ -126,8 +236,16 @@ class BitmaskBackend(configurable.ConfigurableService):
             service = klass(*args, **kw)
             service.setName(label)
             service.setServiceParent(self)
+            self.publish_event('service.%s' % label, {'status': 'running'})
             return service
 
+    def publish_event(self, topic, data=None):
+        try:
+            events = self.getServiceNamed('events')
+        except KeyError:
+            return
+        events.publish(topic, data)
+
     def do_stats(self):
         return self.core_commands.do_stats()
 
@@ -160,12 +278,14 @@ class BitmaskBackend(configurable.ConfigurableService):
         elif service == 'web':
             self.init_web()
 
+        self.publish_event('service.%s' % service, {'status': 'enabled'})
         return 'ok'
 
     def do_disable_service(self, service):
         assert service in self.service_names
         # TODO -- should stop also?
         self.set_config('services', service, 'False')
+        self.publish_event('service.%s' % service, {'status': 'disabled'})
         return 'ok'
 
 
@@ -193,7 +313,7 @@ class BackendCommands(object):
             status[name] = _status
         status['backend'] = flags.BACKEND
 
-        return json.dumps(status)
+        return status
 
     def do_version(self):
         return {'version_core': __version__}
@@ -201,7 +321,16 @@ class BackendCommands(object):
     def do_stats(self):
         log.msg('BitmaskCore Service STATS')
         mem = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
-        return {'mem_usage': '%s KB' % (mem / 1024)}
+        stats = {'mem_usage': '%s KB' % (mem / 1024),
+                 'config_cache': config_cache.stats(),
+                 'startup': {'services': self.core.startup_times,
+                             'time_to_ready': self.core.time_to_ready}}
+        try:
+            stats['mail_accounts'] = self.core.getServiceNamed(
+                'mail').do_stats()
+        except KeyError:
+            pass
+        return stats
 
     def do_shutdown(self):
         self.core.stopService()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# test_pubsub.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+tests for the events service
+"""
+import itertools
+import unittest
+
+from mock import patch
+
+from leap.bitmask.core import pubsub
+
+
+class EventsServiceTest(unittest.TestCase):
+    """Tests for the EventsService."""
+
+    def setUp(self):
+        self.callbacks = {}
+        uids = itertools.count()
+
+        def register(event, callback):
+            uid = next(uids)
+            self.callbacks[(event, uid)] = callback
+            return uid
+
+        def unregister(event, uid=None):
+            del self.callbacks[(event, uid)]
+
+        for name, fake in (('leap_register', register),
+                           ('leap_unregister', unregister)):
+            patcher = patch.object(pubsub, name, side_effect=fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_restart_does_not_duplicate_callbacks(self):
+        events = pubsub.EventsService()
+        events.startService()
+        registered = len(self.callbacks)
+        self.assertEqual(registered, len(pubsub.catalog.EVENTS))
+
+        events.stopService()
+        self.assertEqual(self.callbacks, {})
+
+        events.startService()
+        self.assertEqual(len(self.callbacks), registered)
+        events.stopService()
+
+    def test_publish_by_prefix(self):
+        events = pubsub.EventsService()
+        received = []
+        events.subscribe(lambda *event: received.append(event), ['soledad'])
+        events.publish('soledad.new_instance', {'user': 'me'})
+        events.publish('bonafide.auth', {'user': 'me'})
+        self.assertEqual(received,
+                         [('soledad.new_instance', {'user': 'me'})])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
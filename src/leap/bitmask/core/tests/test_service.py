@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# test_service.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+tests for the startup of the core services
+"""
+import time
+import unittest
+
+from nose.twistedtools import deferred
+
+from leap.bitmask.core.service import BitmaskBackend
+
+
+SERVICES = ['events', 'bonafide', 'soledad', 'keymanager', 'mail',
+            'eip', 'zmq', 'web']
+
+
+class ServiceStartupTest(unittest.TestCase):
+    """Tests for the startup of the services, following their dependencies.
+    """
+
+    def setUp(self):
+        # skip the constructor, that reads the config and starts everything
+        self.backend = BitmaskBackend.__new__(BitmaskBackend)
+        self.backend._created = time.time()
+        self.backend._startup = {}
+        self.backend.startup_times = {}
+        self.backend.time_to_ready = None
+
+        self.started = []
+        for name in SERVICES:
+            setattr(self.backend, 'init_' + name, self._init(name))
+
+    def _init(self, name):
+        def init():
+            self.started.append(name)
+        return init
+
+    @deferred(timeout=5)
+    def test_follows_dependencies(self):
+        d = self.backend.init_services(SERVICES)
+
+        def check(_):
+            self.assertEqual(sorted(self.started), sorted(SERVICES))
+            started = self.started.index
+            for name, deps in self.backend.service_dependencies.items():
+                for dep in deps:
+                    self.assertLess(started(dep), started(name))
+            self.assertIsNotNone(self.backend.time_to_ready)
+        d.addCallback(check)
+        return d
+
+    @deferred(timeout=5)
+    def test_failed_dependency_stops_all_dependents(self):
+        def fail():
+            raise RuntimeError('events are down')
+        self.backend.init_events = fail
+
+        d = self.backend.init_services(SERVICES)
+
+        def check(_):
+            self.assertEqual(self.started, [])
+        d.addCallback(check)
+        return d
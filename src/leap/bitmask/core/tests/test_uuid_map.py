@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# test_uuid_map.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+tests for the persistent map between user-ids and uuids
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from leap.bitmask.core import uuid_map
+
+
+class UserMapTest(unittest.TestCase):
+    """Tests for the UserMap."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'leap', 'uuids')
+        patcher = patch.object(uuid_map, 'MAP_PATH', self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _read_lines(self):
+        with open(self.path) as infile:
+            return infile.read().split('\n')
+
+    def test_add_and_lookup(self):
+        usermap = uuid_map.UserMap()
+        usermap.add('user@example.org', 'uuid1', 'secret')
+
+        other = uuid_map.UserMap()
+        self.assertEqual(
+            other.lookup_uuid('user@example.org', 'secret'), 'uuid1')
+        self.assertEqual(other.lookup_uuid('user@example.org', 'wrong'), None)
+        self.assertEqual(other.lookup_userid('uuid1'), 'user@example.org')
+
+    def test_maps_share_the_index_key(self):
+        # both created before there is any file
+        first = uuid_map.UserMap()
+        second = uuid_map.UserMap()
+        first.add('user@example.org', 'uuid1', 'secret')
+        second.add('other@example.org', 'uuid2', 'secret2')
+
+        reader = uuid_map.UserMap()
+        self.assertEqual(
+            reader.lookup_uuid('user@example.org', 'secret'), 'uuid1')
+        self.assertEqual(
+            reader.lookup_uuid('other@example.org', 'secret2'), 'uuid2')
+
+    def test_migrates_old_format(self):
+        os.makedirs(os.path.dirname(self.path))
+        records = [uuid_map._encode_uuid_map('user@example.org', 'uuid1',
+                                             'secret'),
+                   uuid_map._encode_uuid_map('other@example.org', 'uuid2',
+                                             'secret2')]
+        with open(self.path, 'w') as out:
+            # the old format has no header, and no final newline
+            out.write('\n'.join(records))
+
+        usermap = uuid_map.UserMap()
+        lines = self._read_lines()
+        self.assertTrue(lines[0].startswith(uuid_map.FORMAT_HEADER))
+        self.assertEqual(lines[-1], '')
+        self.assertEqual(sorted(lines[1:-1]), sorted(records))
+
+        self.assertEqual(
+            usermap.lookup_uuid('user@example.org', 'secret'), 'uuid1')
+        # the record got indexed
+        self.assertEqual(len(self._read_lines()), len(lines) + 1)
+        self.assertEqual(
+            uuid_map.UserMap().lookup_uuid('user@example.org', 'secret'),
+            'uuid1')
+        self.assertEqual(
+            uuid_map.UserMap().lookup_uuid('other@example.org', 'secret2'),
+            'uuid2')
+
+    def test_truncated_last_line(self):
+        usermap = uuid_map.UserMap()
+        usermap.add('user@example.org', 'uuid1', 'secret')
+        with open(self.path, 'a') as out:
+            # an interrupted append
+            out.write('0123abcd c2NyeXB0AAwAAAAIAAAAAZ')
+
+        usermap = uuid_map.UserMap()
+        self.assertEqual(
+            usermap.lookup_uuid('user@example.org', 'secret'), 'uuid1')
+        # the map was written again, without the broken record
+        lines = self._read_lines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[-1], '')
+        self.assertFalse(any('0123abcd' in line for line in lines))
+
+    def test_compaction(self):
+        with patch.object(uuid_map, 'COMPACTION_MIN_LINES', 4):
+            usermap = uuid_map.UserMap()
+            for i in range(10):
+                usermap.add('user@example.org', 'uuid%d' % i, 'secret')
+                # header, at most MIN_LINES + 1 records and the final newline
+                self.assertTrue(len(self._read_lines()) <= 7)
+
+        lines = self._read_lines()
+        self.assertTrue(len(lines) < 10)
+        self.assertEqual(
+            uuid_map.UserMap().lookup_uuid('user@example.org', 'secret'),
+            'uuid9')
+
+    def test_reads_back_after_replace(self):
+        usermap = uuid_map.UserMap()
+        usermap.add('user@example.org', 'uuid1', 'secret')
+        usermap.add('other@example.org', 'uuid2', 'secret2')
+        before = sorted(self._read_lines())
+
+        usermap.dump()
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        self.assertEqual(sorted(self._read_lines()), before)
+
+        reader = uuid_map.UserMap()
+        self.assertEqual(
+            reader.lookup_uuid('user@example.org', 'secret'), 'uuid1')
+        self.assertEqual(
+            reader.lookup_uuid('other@example.org', 'secret2'), 'uuid2')
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -19,30 +19,69 @@ UUID Map: a persistent mapping between user-ids and uuids.
 """
 
 import base64
+import binascii
+import errno
+import hashlib
+import hmac
 import os
 import re
 
 import scrypt
 
 from leap.common.config import get_path_prefix
+from leap.common.files import mkdir_p
 
 
 MAP_PATH = os.path.join(get_path_prefix(), 'leap', 'uuids')
 
+FORMAT_HEADER = 'uuidmap-v2'
+
+# compact the journal when it has more than this many times the live records
+COMPACTION_RATIO = 2
+COMPACTION_MIN_LINES = 32
+
 
 class UserMap(object):
 
     """
     A persistent mapping between user-ids and uuids.
+
+    Each record is encrypted with the user password, and stored next to a
+    blind index of the userid: a keyed hash, with a random key that is
+    generated once and kept in the header of the file. A lookup only has to
+    decrypt the record under the index for that userid, instead of trying
+    all of them.
+
+    The index only tells whether a given userid is known to someone that can
+    read the file, but nothing about its uuid or password.
+
+    Records written in the old format (with no index) are still understood,
+    and they get indexed the first time their user is looked up.
+
+    The file is an append-only journal: a new record is appended (and synced
+    to disk), and the last record for an index wins. When the journal has
+    grown too much it is compacted, writing a new file and renaming it over
+    the old one, so a crash can never leave a truncated map behind.
+
+    The file is created, with its index key, as soon as a map is
+    instantiated, so that all the maps share the same key.
     """
 
     # TODO Add padding to the encrypted string
 
     def __init__(self):
         self._d = {}
-        self._lines = set([])
-        if os.path.isfile(MAP_PATH):
-            self.load()
+        self._index_key = None
+        self._records = {}
+        self._legacy = set([])
+        self._journal_size = 0
+        if not os.path.isfile(MAP_PATH):
+            self._create()
+        needs_compaction = not self.load()
+        if self._index_key is None:
+            self._index_key = os.urandom(32)
+        if needs_compaction:
+            self.dump()
 
     def add(self, userid, uuid, passwd):
         """
@@ -50,43 +89,151 @@ class UserMap(object):
         password.
         """
         self._add_to_cache(userid, uuid)
-        self._lines.add(_encode_uuid_map(userid, uuid, passwd))
-        self.dump()
+        index = self._blind_index(userid)
+        record = _encode_uuid_map(userid, uuid, passwd)
+        self._records[index] = record
+        self._append(index, record)
 
     def _add_to_cache(self, userid, uuid):
         self._d[userid] = uuid
 
+    def _blind_index(self, userid):
+        if isinstance(userid, unicode):
+            userid = userid.encode('utf-8')
+        return hmac.new(self._index_key, userid, hashlib.sha256).hexdigest()
+
     def load(self):
         """
         Load a mapping from a default file.
+
+        :return: whether the file was clean. It is not if it is still in the
+                 old format, or if the last write was interrupted.
+        :rtype: bool
         """
         with open(MAP_PATH, 'r') as infile:
-            lines = infile.readlines()
-            self._lines = set(lines)
+            lines = infile.read().split('\n')
+
+        # everything we write ends in a newline, so the last piece is empty
+        # unless the last append was interrupted.
+        tail = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+
+        # an empty file is one that another map is creating right now
+        is_legacy = self._index_key is None and bool(lines or tail)
+        if tail and is_legacy:
+            # the old format has no final newline
+            self._parse_line(tail)
+
+        # a record that was indexed is still in the journal in the old form
+        self._legacy.difference_update(self._records.values())
+        return not (tail or is_legacy)
+
+    def _parse_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        if line.startswith(FORMAT_HEADER):
+            self._index_key = binascii.unhexlify(line.split()[1])
+            return
+        self._journal_size += 1
+        if ' ' in line:
+            index, record = line.split(' ', 1)
+            self._records[index] = record
+        else:
+            # old format: base64 has no spaces
+            self._legacy.add(line)
+
+    def _create(self):
+        """
+        Create the file, with a new index key.
+
+        If another map creates it first, its file is left alone, and loaded
+        next with the key in there.
+        """
+        mkdir_p(os.path.dirname(MAP_PATH))
+        header = '%s %s\n' % (FORMAT_HEADER,
+                              binascii.hexlify(os.urandom(32)))
+        try:
+            fd = os.open(MAP_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return
+        try:
+            os.write(fd, header)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
     def dump(self):
         """
-        Dump the mapping to a default file.
+        Dump the mapping to a default file, replacing it atomically.
         """
-        with open(MAP_PATH, 'w') as out:
-            out.write('\n'.join(self._lines))
+        lines = ['%s %s' % (FORMAT_HEADER, binascii.hexlify(self._index_key))]
+        lines.extend('%s %s' % item for item in self._records.iteritems())
+        lines.extend(self._legacy)
+
+        tmp_path = MAP_PATH + '.tmp'
+        with open(tmp_path, 'w') as out:
+            out.write('\n'.join(lines) + '\n')
+            out.flush()
+            os.fsync(out.fileno())
+        _replace(tmp_path, MAP_PATH)
+        self._journal_size = len(lines) - 1
+
+    def _append(self, index, record):
+        if not os.path.isfile(MAP_PATH):
+            self.dump()
+            return
+
+        with open(MAP_PATH, 'a') as out:
+            out.write('%s %s\n' % (index, record))
+            out.flush()
+            os.fsync(out.fileno())
+        self._journal_size += 1
+
+        live = len(self._records) + len(self._legacy)
+        if (self._journal_size > COMPACTION_MIN_LINES and
+                self._journal_size > COMPACTION_RATIO * live):
+            self.dump()
 
     def lookup_uuid(self, userid, passwd=None):
         """
         Lookup the uuid for a given userid.
 
         If no password is given, try to lookup on cache.
-        Else, try to decrypt all the records that we know about with the
-        passed password.
+        Else, decrypt the record indexed for that userid with the passed
+        password.
         """
         if not passwd:
             return self._d.get(userid)
 
-        for line in self._lines:
+        record = self._records.get(self._blind_index(userid))
+        if record is None:
+            return self._lookup_legacy(userid, passwd)
+
+        guess = _decode_uuid_line(record, passwd)
+        if guess:
+            record_userid, uuid = guess
+            if record_userid == userid:
+                self._add_to_cache(userid, uuid)
+                return uuid
+
+    def _lookup_legacy(self, userid, passwd):
+        """
+        Try to decrypt all the records in the old format with the passed
+        password. If one of them matches, index it.
+        """
+        for line in self._legacy:
             guess = _decode_uuid_line(line, passwd)
             if guess:
                 record_userid, uuid = guess
                 if record_userid == userid:
+                    index = self._blind_index(userid)
+                    self._legacy.discard(line)
+                    self._records[index] = line
+                    self._append(index, line)
                     self._add_to_cache(userid, uuid)
                     return uuid
 
@@ -98,6 +245,13 @@ class UserMap(object):
         return rev_d.get(uuid)
 
 
+def _replace(src, dst):
+    if os.name == 'nt' and os.path.exists(dst):
+        # rename does not overwrite an existing file on windows
+        os.remove(dst)
+    os.rename(src, dst)
+
+
 def _encode_uuid_map(userid, uuid, passwd):
     data = 'userid:%s:uuid:%s' % (userid, uuid)
     encrypted = scrypt.encrypt(data, passwd, maxtime=0.05)
@@ -32,6 +32,8 @@ from autobahn.twisted.resource import WebSocketResource
 from autobahn.twisted.websocket import WebSocketServerFactory
 from autobahn.twisted.websocket import WebSocketServerProtocol
 
+from leap.bitmask.core import protocol
+from leap.bitmask.core import pubsub
 from leap.bitmask.core.dispatcher import CommandDispatcher
 
 
@@ -52,6 +54,7 @@ class WebSocketsDispatcherService(service.Service):
                                          debug=self.debug)
         factory.protocol = DispatcherProtocol
         factory.protocol.dispatcher = CommandDispatcher(self._core)
+        factory.protocol.core = self._core
 
         # FIXME: Site.start/stopFactory should start/stop factories wrapped as
         # Resources
@@ -83,16 +86,58 @@ class WebSocketsDispatcherService(service.Service):
 
 class DispatcherProtocol(WebSocketServerProtocol):
 
+    """
+    Dispatches the commands received over the WebSocket.
+
+    Besides the regular commands, a client can send::
+
+        subscribe [topic1 topic2 ...]
+        unsubscribe
+
+    to start (or stop) getting the core events pushed over this same
+    connection. See the pubsub module for the available topics.
+    """
+
+    _events_sid = None
+
     def onMessage(self, msg, binary):
-        parts = msg.split()
+        if protocol.is_structured(msg):
+            parts = [msg]
+        else:
+            parts = msg.split()
+
+        if parts and parts[0] == 'subscribe':
+            self._subscribe(parts[1:])
+            return
+        if parts and parts[0] == 'unsubscribe':
+            self._unsubscribe()
+            return
+
         r = self.dispatcher.dispatch(parts)
         r.addCallback(self.defer_reply, binary)
 
+    def onClose(self, wasClean, code, reason):
+        self._unsubscribe()
+        WebSocketServerProtocol.onClose(self, wasClean, code, reason)
+
     def reply(self, response, binary):
         self.sendMessage(response, binary)
 
     def defer_reply(self, response, binary):
         reactor.callLater(0, self.reply, response, binary)
 
+    def push_event(self, topic, data):
+        self.sendMessage(pubsub.encode_event(topic, data), False)
+
+    def _subscribe(self, topics):
+        self._unsubscribe()
+        events = self._get_service('events')
+        self._events_sid = events.subscribe(self.push_event, topics)
+
+    def _unsubscribe(self):
+        if self._events_sid is not None:
+            self._get_service('events').unsubscribe(self._events_sid)
+            self._events_sid = None
+
     def _get_service(self, name):
         return self.core.getServiceNamed(name)
@@ -17,7 +17,6 @@
 """
 EIP Status Panel widget implementation
 """
-from datetime import datetime
 from functools import partial
 
 from PySide import QtCore, QtGui
@@ -25,7 +24,6 @@ from PySide import QtCore, QtGui
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.services import get_service_display_name, EIP_SERVICE
 from leap.bitmask.platform_init import IS_LINUX
-from leap.bitmask.util.averages import RateMovingAverage
 from leap.common.check import leap_assert_type
 
 from ui_eip_status import Ui_EIPStatus
@@ -153,8 +151,7 @@ class EIPStatusWidget(QtGui.QWidget):
         """
         Initializes up and download rates.
         """
-        self._up_rate = RateMovingAverage()
-        self._down_rate = RateMovingAverage()
+        self._traffic = None
 
         self.ui.btnUpload.setText(self.RATE_STR % (0,))
         self.ui.btnDownload.setText(self.RATE_STR % (0,))
@@ -163,23 +160,9 @@ class EIPStatusWidget(QtGui.QWidget):
         """
         Resets up and download rates, and cleans up the labels.
         """
-        self._up_rate.reset()
-        self._down_rate.reset()
+        self._traffic = None
         self.update_vpn_status()
 
-    def _update_traffic_rates(self, up, down):
-        """
-        Updates up and download rates.
-
-        :param up: upload total.
-        :type up: int
-        :param down: download total.
-        :type down: int
-        """
-        ts = datetime.now()
-        self._up_rate.append((ts, up))
-        self._down_rate.append((ts, down))
-
     def _get_traffic_rates(self):
         """
         Gets the traffic rates (in KB/s).
@@ -187,10 +170,7 @@ class EIPStatusWidget(QtGui.QWidget):
         :returns: a tuple with the (up, down) rates
         :rtype: tuple
         """
-        up = self._up_rate
-        down = self._down_rate
-
-        return (up.get_average(), down.get_average())
+        return self._get_traffic('rate')
 
     def _get_traffic_totals(self):
         """
@@ -199,10 +179,21 @@ class EIPStatusWidget(QtGui.QWidget):
         :returns: a tuple with the (up, down) totals
         :rtype: tuple
         """
-        up = self._up_rate
-        down = self._down_rate
+        return self._get_traffic('total')
 
-        return (up.get_total(), down.get_total())
+    def _get_traffic(self, key):
+        """
+        Gets a figure of the last traffic received, in KB.
+
+        :param key: either 'rate' or 'total'.
+        :type key: str
+        :returns: a tuple with the (up, down) figures
+        :rtype: tuple
+        """
+        if self._traffic is None:
+            return (0, 0)
+        return (self._traffic['upload'][key] / 1024.,
+                self._traffic['download'][key] / 1024.)
 
     def _set_eip_icons(self):
         """
@@ -506,16 +497,12 @@ class EIPStatusWidget(QtGui.QWidget):
         If data is None, we just will refresh the display based on the previous
         data.
 
-        :param data: a tuple with download/upload totals (download, upload).
-        :type data: tuple
+        :param data: the upload and download traffic, as returned by
+                     VPNManager.get_traffic.
+        :type data: dict
         """
         if data is not None:
-            try:
-                upload, download = map(float, data)
-                self._update_traffic_rates(upload, download)
-            except Exception:
-                # discard invalid data
-                return
+            self._traffic = data
 
         if self.DISPLAY_TRAFFIC_RATES:
             uprate, downrate = self._get_traffic_rates()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# importprofile.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measure how long it takes to import each module.
+
+The entry points (bitmask, bitmaskd and bitmask_cli) accept a
+--profile-imports option that enables this before their first import, and
+prints a report when the process exits::
+
+    cumulative       self  module
+      412.3 ms     3.1 ms  leap.bitmask.backend.leapbackend
+      ...
+
+The cumulative time includes the imports that a module triggers, the self
+time does not.
+
+This module must not import anything outside of the standard library, so
+that it does not get in the way of what it measures.
+"""
+import __builtin__
+import atexit
+import sys
+import time
+
+
+OPTION = '--profile-imports'
+
+
+class ImportProfiler(object):
+    """
+    Wraps __import__ to time the first import of every module.
+    """
+
+    def __init__(self):
+        self._original_import = None
+        self._stack = []
+        self.timings = {}  # module -> [cumulative, self]
+
+    @property
+    def enabled(self):
+        return self._original_import is not None
+
+    def enable(self):
+        if self.enabled:
+            return
+        self._original_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def disable(self):
+        if not self.enabled:
+            return
+        __builtin__.__import__ = self._original_import
+        self._original_import = None
+
+    def _import(self, name, *args, **kwargs):
+        if name in sys.modules:
+            # already loaded, nothing to measure
+            return self._original_import(name, *args, **kwargs)
+
+        # the time spent in the nested imports is subtracted from ours
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._original_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if name not in self.timings:
+                self.timings[name] = [elapsed, elapsed - nested]
+
+    def report(self, stream=None, limit=30):
+        """
+        Write the modules that took the longest to import.
+
+        :param stream: where to write, stderr by default.
+        :type stream: file
+        :param limit: how many modules to list, or None for all of them.
+        :type limit: int
+        """
+        stream = stream or sys.stderr
+        timings = sorted(self.timings.iteritems(),
+                         key=lambda item: item[1][0], reverse=True)
+        total = sum(own for _, (_, own) in timings)
+
+        stream.write('%10s %10s  %s\n' % ('cumulative', 'self', 'module'))
+        for name, (cumulative, own) in timings[:limit]:
+            stream.write('%7.1f ms %7.1f ms  %s\n'
+                         % (cumulative * 1000, own * 1000, name))
+        stream.write('%d modules imported in %.1f ms\n'
+                     % (len(timings), total * 1000))
+
+
+profiler = ImportProfiler()
+
+
+def profile_imports_if_requested(argv=None):
+    """
+    Enable the import profiler if OPTION is in argv, and report at exit.
+
+    The option is removed from argv, so that the argument parsers do not
+    need to know about it.
+
+    :param argv: the command line arguments, sys.argv by default.
+    :type argv: list
+    :return: whether the profiler was enabled.
+    :rtype: bool
+    """
+    if argv is None:
+        argv = sys.argv
+    if OPTION not in argv:
+        return False
+
+    while OPTION in argv:
+        argv.remove(OPTION)
+    profiler.enable()
+    atexit.register(profiler.report)
+    return True
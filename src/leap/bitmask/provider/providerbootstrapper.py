@@ -17,7 +17,6 @@
 """
 Provider bootstrapping
 """
-import socket
 import os
 import sys
 
@@ -33,6 +32,7 @@ from leap.bitmask.provider.pinned import PinnedProviders
 from leap.bitmask.services.abstractbootstrapper import AbstractBootstrapper
 from leap.bitmask.util.constants import REQUEST_TIMEOUT
 from leap.bitmask.util.request_helpers import get_content
+from leap.bitmask.util.resolver import dns_cache
 from leap.common import ca_bundle
 from leap.common.certs import get_digest
 from leap.common.check import leap_assert, leap_assert_type, leap_check
@@ -123,7 +123,8 @@ class ProviderBootstrapper(AbstractBootstrapper):
         # system to work
         # err --- but we can do it after a failure, to diagnose what went
         # wrong. Right now we're just adding connection overhead. -- kali
-        socket.gethostbyname(self._domain.encode('idna'))
+        # The answer is cached, and reused when _check_https connects.
+        dns_cache.resolve(self._domain)
 
     def _check_https(self, *args):
         """
@@ -18,6 +18,7 @@
 EIP bootstrapping
 """
 import os
+import time
 
 from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.crypto.certs import download_client_cert
@@ -39,6 +40,10 @@ class EIPBootstrapper(AbstractBootstrapper):
     If a check fails, the subsequent checks are not executed
     """
 
+    # when the config and the client certificate of each provider were last
+    # checked against the provider, shared by all the bootstrappers
+    _verified = {}
+
     def __init__(self, signaler=None):
         """
         Constructor for the EIP bootstrapper object
@@ -93,12 +98,52 @@ class EIPBootstrapper(AbstractBootstrapper):
         if self._download_if_needed and \
                 os.path.isfile(client_cert_path):
             check_and_fix_urw_only(client_cert_path)
-            return
+        else:
+            download_client_cert(
+                self._provider_config,
+                client_cert_path,
+                self._session)
 
-        download_client_cert(
-            self._provider_config,
-            client_cert_path,
-            self._session)
+        self._verified[self._provider_config.get_domain()] = time.time()
+
+    @classmethod
+    def forget(cls, domain):
+        """
+        Make the next setup for a provider check its EIP config and client
+        certificate against the provider again.
+
+        :param domain: the domain of the provider.
+        :type domain: str
+        """
+        cls._verified.pop(domain, None)
+
+    def is_fresh(self, provider_config, max_age):
+        """
+        Return whether the EIP config and the client certificate for a
+        provider can be used without checking them against the provider
+        again: they were checked less than max_age seconds ago, the config
+        loads, and the certificate is still valid.
+
+        :param provider_config: Provider configuration
+        :type provider_config: ProviderConfig
+        :param max_age: how old the last check can be, in seconds.
+        :type max_age: float
+
+        :rtype: bool
+        """
+        domain = provider_config.get_domain()
+        verified = self._verified.get(domain)
+        if verified is None or time.time() - verified > max_age:
+            return False
+
+        eip_config = EIPConfig.get_eip_config(
+            domain, provider_config.get_api_version())
+        if eip_config is None:
+            return False
+
+        client_cert_path = eip_config.get_client_cert_path(
+            provider_config, about_to_download=True)
+        return not leap_certs.should_redownload(client_cert_path)
 
     def run_eip_setup_checks(self,
                              provider_config,
@@ -20,16 +20,22 @@ Provider configuration
 import logging
 import os
 import re
-import time
+
+from itertools import chain
 
 import ipaddr
 
 from leap.bitmask.config import flags
+from leap.bitmask.config.cache import config_cache
 from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.services import ServiceConfig
 from leap.bitmask.services.eip.eipspec import get_schema
 from leap.bitmask.util import get_path_prefix
+from leap.bitmask.util import server_selection
+from leap.bitmask.util.server_selection import EQUIVALENT_TIMEZONES
+from leap.bitmask.util.server_selection import get_local_offset
+from leap.bitmask.util.server_selection import timezone_distance
 from leap.common.check import leap_assert, leap_assert_type
 
 logger = get_logger()
@@ -82,14 +88,61 @@ def load_eipconfig_if_needed(provider_config, eip_config, domain):
     return loaded
 
 
+class GatewayRecord(object):
+    """
+    What the gateway selection needs to know about a gateway, read once from
+    the eip config. See EIPConfig.get_gateway_index.
+    """
+    __slots__ = ('index', 'ip', 'ports', 'location', 'label', 'country',
+                 'timezone')
+
+    def __init__(self, index, ip, ports, location, label, country, timezone):
+        """
+        :param index: the position of the gateway in the eip config.
+        :type index: int
+        :param ip: the ip of the gateway, None if it is not valid.
+        :type ip: str
+        :param ports: the ports it listens on.
+        :type ports: list of str
+        :param location: the name of its location, if any.
+        :type location: str
+        :param label: the name to show for the gateway.
+        :type label: str
+        :param country: the country code, 'XX' if it is not known.
+        :type country: str
+        :param timezone: the distance of its timezone to GMT, if known.
+        :type timezone: int
+        """
+        self.index = index
+        self.ip = ip
+        self.ports = ports
+        self.location = location
+        self.label = label
+        self.country = country
+        self.timezone = timezone
+
+
 class VPNGatewaySelector(object):
     """
     VPN Gateway selector.
+
+    The gateways are sorted by timezone proximity. In the measured mode, the
+    time it takes to connect to each gateway counts too: all of them are
+    probed at once, and the results are kept for RTT_TTL seconds for the
+    network we are on.
     """
-    # http://www.timeanddate.com/time/map/
-    equivalent_timezones = {13: -11, 14: -10}
+    equivalent_timezones = EQUIVALENT_TIMEZONES
+
+    # how many seconds of rtt an hour of timezone distance is worth
+    TIMEZONE_WEIGHT = 0.01
+    # the distance given to the gateways with unknown timezone, when ranking
+    # them with their rtt
+    MAX_DISTANCE = 12
+
+    RTT_TTL = server_selection.RTT_TTL
+    PROBE_TIMEOUT = server_selection.PROBE_TIMEOUT
 
-    def __init__(self, eipconfig, tz_offset=None):
+    def __init__(self, eipconfig, tz_offset=None, measured=False, probe=True):
         '''
         Constructor for VPNGatewaySelector.
 
@@ -97,6 +150,12 @@ class VPNGatewaySelector(object):
         :type eipconfig: EIPConfig
         :param tz_offset: use this offset as a local distance to GMT.
         :type tz_offset: int
+        :param measured: whether to rank the gateways by rtt too.
+        :type measured: bool
+        :param probe: whether to probe the gateways if there are no fresh
+                      rtts, or just use the cached ones. Probing blocks for up
+                      to PROBE_TIMEOUT seconds.
+        :type probe: bool
         '''
         leap_assert_type(eipconfig, EIPConfig)
 
@@ -109,49 +168,36 @@ class VPNGatewaySelector(object):
 
         self._local_offset = tz_offset
         self._eipconfig = eipconfig
+        self._measured = measured
+        self._probe = probe
 
     def get_gateways_list(self):
         """
-        Return the existing gateways, sorted by timezone proximity.
+        Return the existing gateways, sorted by timezone proximity, or by
+        a blend of rtt and timezone proximity in the measured mode.
 
         :rtype: list of tuples (label, ip, country_code)
                 (str, IPv4Address or IPv6Address object, str)
         """
-        gateways_timezones = []
-        locations = self._eipconfig.get_locations()
-        if not locations:
-            locations = {}
-        gateways = self._eipconfig.get_gateways()
-
-        for idx, gateway in enumerate(gateways):
-            distance = 99  # if hasn't location -> should go last
-            location = locations.get(gateway.get('location'))
-            label = gateway.get('location', 'Unknown')
-            country = 'XX'
-            if location is not None:
-                country = location.get('country_code', 'XX')
-                label = location.get('name', label)
-                timezone = location.get('timezone')
-                if timezone is not None:
-                    offset = int(timezone)
-                    if offset in self.equivalent_timezones:
-                        offset = self.equivalent_timezones[offset]
-                    distance = self._get_timezone_distance(offset)
-
-            ip = self._eipconfig.get_gateway_ip(idx)
-            gateways_timezones.append((ip, distance, label, country))
-
-        gateways_timezones = sorted(gateways_timezones, key=lambda gw: gw[1])
-
-        result = []
-        for ip, distance, label, country in gateways_timezones:
-            result.append((label, ip, country))
-
-        return result
+        gateways = self._eipconfig.get_gateway_index()
+
+        rtts = None
+        if self._measured and gateways:
+            rtts = self._get_rtts(gateways)
+
+        if rtts:
+            gateways = sorted(
+                gateways,
+                key=lambda gw: self._get_score(
+                    rtts.get(gw.ip), self._get_distance(gw)))
+        else:
+            gateways = sorted(gateways, key=self._get_distance)
+
+        return [(gw.label, gw.ip, gw.country) for gw in gateways]
 
     def get_gateways(self):
         """
-        Return the 4 best gateways, sorted by timezone proximity.
+        Return the 4 best gateways, in the order of get_gateways_list.
 
         :rtype: list of IPv4Address or IPv6Address object.
         """
@@ -165,23 +211,80 @@ class VPNGatewaySelector(object):
 
         :rtype: dict or None
         """
-        country_codes = {}
+        if not self._eipconfig.get_locations():
+            return
 
-        locations = self._eipconfig.get_locations()
+        return dict((gw.ip, gw.country)
+                    for gw in self._eipconfig.get_gateway_index()
+                    if gw.location is not None)
 
-        if not locations:
-            return
+    def _get_distance(self, gateway):
+        """
+        Return the timezone distance to a gateway, 99 if its timezone is not
+        known so it goes last.
 
-        gateways = self._eipconfig.get_gateways()
+        :param gateway: the gateway.
+        :type gateway: GatewayRecord
+        :rtype: int
+        """
+        if gateway.timezone is None:
+            return 99
+        return self._get_timezone_distance(gateway.timezone)
+
+    def _get_rtts(self, gateways):
+        """
+        Return the rtt to each gateway, the best one among its ports.
 
-        for idx, gateway in enumerate(gateways):
-            gateway_location = gateway.get('location')
+        :param gateways: the gateways.
+        :type gateways: list of GatewayRecord
 
-            ip = self._eipconfig.get_gateway_ip(idx)
-            if gateway_location is not None:
-                ccode = locations[gateway['location']]['country_code']
-                country_codes[ip] = ccode
-        return country_codes
+        :return: the rtt in seconds, or None if it could not be reached, by
+                 gateway ip. None if there are no rtts for this network and
+                 we should not probe.
+        :rtype: dict or None
+        """
+        addresses = {}
+        for gateway in gateways:
+            if gateway.ip is not None:
+                addresses[gateway.ip] = [
+                    (gateway.ip, int(port)) for port in gateway.ports]
+
+        all_addresses = set(chain.from_iterable(addresses.values()))
+        network = server_selection.get_network_id()
+        results = server_selection.rtt_cache.get(
+            all_addresses, self.RTT_TTL, network)
+
+        if results is None:
+            if not self._probe:
+                return None
+            results = server_selection.probe(
+                all_addresses, self.PROBE_TIMEOUT)
+            server_selection.rtt_cache.update(results, network)
+            logger.debug("Gateways rtts: %r" % (results,))
+
+        rtts = {}
+        for ip, ip_addresses in addresses.iteritems():
+            measured = [results[address] for address in ip_addresses
+                        if results.get(address) is not None]
+            rtts[ip] = min(measured) if measured else None
+        return rtts
+
+    def _get_score(self, rtt, distance):
+        """
+        Return the sort key of a gateway in the measured mode. The reachable
+        gateways go first, by rtt plus a penalty for the timezone distance,
+        and then the others, by timezone distance.
+
+        :param rtt: the rtt to the gateway, or None if it was not reached.
+        :type rtt: float
+        :param distance: the timezone distance to the gateway.
+        :type distance: int
+        :rtype: tuple
+        """
+        if rtt is None:
+            return (1, distance)
+        distance = min(distance, self.MAX_DISTANCE)
+        return (0, rtt + distance * self.TIMEZONE_WEIGHT)
 
     def _get_timezone_distance(self, offset):
         '''
@@ -193,17 +296,7 @@ class VPNGatewaySelector(object):
         :returns: distance between local offset and param offset.
         :rtype: int
         '''
-        timezones = range(-11, 13)
-        tz1 = offset
-        tz2 = self._local_offset
-        distance = abs(timezones.index(tz1) - timezones.index(tz2))
-        if distance > 12:
-            if tz1 < 0:
-                distance = timezones.index(tz1) + timezones[::-1].index(tz2)
-            else:
-                distance = timezones[::-1].index(tz1) + timezones.index(tz2)
-
-        return distance
+        return timezone_distance(offset, self._local_offset)
 
     def _get_local_offset(self):
         '''
@@ -211,11 +304,7 @@ class VPNGatewaySelector(object):
 
         :rtype: int
         '''
-        local_offset = time.timezone
-        if time.daylight:
-            local_offset = time.altzone
-
-        return -local_offset / 3600
+        return get_local_offset()
 
 
 class EIPConfig(ServiceConfig):
@@ -231,6 +320,32 @@ class EIPConfig(ServiceConfig):
         self.standalone = flags.STANDALONE
         ServiceConfig.__init__(self)
         self._api_version = None
+        # (serial, gateways, locations, records) of the last index built
+        self._gateway_index = None
+
+    @classmethod
+    def get_eip_config(cls, domain, api_version):
+        """
+        Helper to return a loaded EIP Config for a provider.
+
+        The config is shared, and loaded again only if the file changes, so
+        its gateway index is built once per version of the file too.
+
+        :param domain: the domain name of the provider.
+        :type domain: str
+        :param api_version: the api version of the provider.
+        :type api_version: str
+
+        :rtype: EIPConfig or None if there is a problem loading the config
+        """
+        def load(path):
+            eip_config = cls()
+            eip_config.set_api_version(api_version)
+            if eip_config.load(path, relative=False):
+                return eip_config
+
+        path = get_eipconfig_path(domain, relative=False)
+        return config_cache.get((domain, 'eip', api_version), path, load)
 
     def _get_schema(self):
         """
@@ -287,26 +402,77 @@ class EIPConfig(ServiceConfig):
     def get_version(self):
         return self._safe_get_value("version")
 
-    def get_gateway_ip(self, index=0):
+    def get_gateway_index(self):
         """
-        Returns the ip of the gateway.
+        Return what the gateway selection needs to know about each gateway.
 
-        :rtype: An IPv4Address or IPv6Address object.
+        The records are built once per version of the config (its serial,
+        and the data loaded), so that the gateways and locations are not
+        walked again, nor the ips parsed again, on every call.
+
+        :rtype: list of GatewayRecord
         """
-        gateways = self.get_gateways()
-        leap_assert(len(gateways) > 0, "We don't have any gateway!")
-        if index > len(gateways):
-            index = 0
-            logger.warning("Provided an unknown gateway index %s, " +
-                           "defaulting to 0")
-        ip_addr_str = gateways[index]["ip_address"]
+        gateways = self.get_gateways() or []
+        locations = self.get_locations() or {}
+        serial = self.get_serial()
+
+        index = self._gateway_index
+        if (index is not None and index[0] == serial and
+                index[1] is gateways and index[2] is locations):
+            return index[3]
 
+        records = [self._get_gateway_record(idx, gateway, locations)
+                   for idx, gateway in enumerate(gateways)]
+        self._gateway_index = (serial, gateways, locations, records)
+        return records
+
+    def _get_gateway_record(self, index, gateway, locations):
+        """
+        Return the GatewayRecord for a gateway of the config.
+        """
+        ip = gateway["ip_address"]
         try:
-            ipaddr.IPAddress(ip_addr_str)
-            return ip_addr_str
+            ipaddr.IPAddress(ip)
         except ValueError:
-            logger.error("Invalid ip address in config: %s" % (ip_addr_str,))
-            return None
+            logger.error("Invalid ip address in config: %s" % (ip,))
+            ip = None
+
+        location_name = gateway.get('location')
+        location = locations.get(location_name)
+        label = gateway.get('location', 'Unknown')
+        country = 'XX'
+        timezone = None
+        if location is not None:
+            country = location.get('country_code', 'XX')
+            label = location.get('name', label)
+            if location.get('timezone') is not None:
+                timezone = int(location['timezone'])
+                timezone = EQUIVALENT_TIMEZONES.get(timezone, timezone)
+
+        ports = gateway.get('capabilities', {}).get('ports', [])
+        return GatewayRecord(index, ip, ports, location_name, label, country,
+                             timezone)
+
+    def _get_gateway(self, index):
+        """
+        Return the record of the gateway at index, or of the first one if
+        there is no such gateway.
+        """
+        gateways = self.get_gateway_index()
+        leap_assert(len(gateways) > 0, "We don't have any gateway!")
+        if index >= len(gateways):
+            logger.warning("Provided an unknown gateway index %s, "
+                           "defaulting to 0" % (index,))
+            index = 0
+        return gateways[index]
+
+    def get_gateway_ip(self, index=0):
+        """
+        Returns the ip of the gateway.
+
+        :rtype: An IPv4Address or IPv6Address object.
+        """
+        return self._get_gateway(index).ip
 
     def get_gateway_ports(self, index=0):
         """
@@ -317,14 +483,7 @@ class EIPConfig(ServiceConfig):
 
         :rtype: list of int
         """
-        gateways = self.get_gateways()
-        leap_assert(len(gateways) > 0, "We don't have any gateway!")
-        if index > len(gateways):
-            index = 0
-            logger.warning("Provided an unknown gateway index %s, " +
-                           "defaulting to 0")
-
-        return gateways[index]["capabilities"]["ports"]
+        return self._get_gateway(index).ports
 
     def get_client_cert_path(self,
                              providerconfig=None,
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# management.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Non-blocking client for the OpenVPN management interface.
+
+The commands are answered in the order they are sent, either with a single
+line::
+
+    SUCCESS: real-time state notification set to ON
+    ERROR: unknown command, enter 'help' for more options
+
+or with several lines, terminated by END. OpenVPN can also send real-time
+notifications, prefixed with '>', at any moment::
+
+    >STATE:1466165393,CONNECTED,SUCCESS,10.42.0.8,199.254.238.20
+    >BYTECOUNT:2942,3020
+    >LOG:1466165393,I,Initialization Sequence Completed
+
+The notifications are passed to a listener, that can implement any of::
+
+    management_connected(protocol)
+    management_disconnected(reason)
+    management_state(state, fields)
+    management_bytecount(bytes_in, bytes_out)
+    management_log(message)
+
+For more info about the management interface::
+
+  zcat `dpkg -L openvpn | grep management`
+"""
+from collections import deque
+
+from twisted.internet import defer, reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint, UNIXClientEndpoint
+from twisted.internet.protocol import ClientFactory
+from twisted.protocols.basic import LineOnlyReceiver
+
+from leap.bitmask.logs.utils import get_logger
+
+logger = get_logger()
+
+
+COMMAND_TIMEOUT = 5  # secs
+
+
+class ManagementError(Exception):
+    """
+    Raised when OpenVPN answers a command with an ERROR.
+    """
+    pass
+
+
+class ManagementProtocol(LineOnlyReceiver):
+    """
+    Sends commands to the management interface, and dispatches the real-time
+    notifications to the listener.
+    """
+
+    delimiter = '\n'
+
+    def __init__(self, listener=None, timeout=COMMAND_TIMEOUT):
+        """
+        :param listener: the object that gets the notifications.
+        :type listener: object
+        :param timeout: seconds to wait for the answer to a command before
+                        giving up on the connection, or None to wait forever.
+        :type timeout: float
+        """
+        self._listener = listener
+        self._timeout = timeout
+        self._pending = deque()  # of (deferred, lines, timeout call)
+
+    def send_command(self, command):
+        """
+        Send a command to OpenVPN.
+
+        :param command: the command, as in 'state on' or 'signal SIGTERM'.
+        :type command: str
+
+        :return: a Deferred that fires with the lines of the answer, or
+                 fails with ManagementError.
+        :rtype: Deferred
+        """
+        d = defer.Deferred()
+        call = None
+        if self._timeout is not None:
+            call = reactor.callLater(self._timeout, self._timed_out, command)
+        self._pending.append((d, [], call))
+        self.sendLine(command)
+        return d
+
+    def close(self):
+        """
+        Ask OpenVPN to close the connection.
+        """
+        self.sendLine('quit')
+        self.transport.loseConnection()
+
+    # protocol
+
+    def connectionMade(self):
+        self._notify('connected', self)
+
+    def connectionLost(self, reason):
+        pending, self._pending = self._pending, deque()
+        for d, _, call in pending:
+            if call is not None and call.active():
+                call.cancel()
+            d.errback(reason)
+        self._notify('disconnected', reason)
+
+    def lineReceived(self, line):
+        line = line.rstrip('\r')
+        if line.startswith('>'):
+            self._notification(line[1:])
+            return
+
+        if not self._pending:
+            logger.debug("Unexpected line from management: %r" % (line,))
+            return
+
+        d, lines, call = self._pending[0]
+        if not lines and line.startswith('SUCCESS:'):
+            self._answer([line[len('SUCCESS:'):].strip()])
+        elif not lines and line.startswith('ERROR:'):
+            self._answer(ManagementError(line[len('ERROR:'):].strip()))
+        elif line == 'END':
+            self._answer(lines)
+        else:
+            lines.append(line)
+
+    def lineLengthExceeded(self, line):
+        logger.warning("Too long line from management, closing.")
+        self.transport.loseConnection()
+
+    def _answer(self, result):
+        d, _, call = self._pending.popleft()
+        if call is not None and call.active():
+            call.cancel()
+        if isinstance(result, Exception):
+            d.errback(result)
+        else:
+            d.callback(result)
+
+    def _timed_out(self, command):
+        # the answers come in order, so the one we waited for longer is the
+        # first one. Without it, the next answers can not be matched, so
+        # the connection is closed.
+        logger.warning("No answer from management to %r" % (command,))
+        d, _, _ = self._pending.popleft()
+        d.errback(defer.TimeoutError(command))
+        self.transport.loseConnection()
+
+    def _notification(self, line):
+        kind, _, data = line.partition(':')
+
+        if kind == 'STATE':
+            fields = data.split(',')
+            if len(fields) > 1:
+                self._notify('state', fields[1], fields)
+        elif kind == 'BYTECOUNT':
+            try:
+                bytes_in, bytes_out = map(int, data.split(','))
+            except ValueError:
+                logger.debug("Bad bytecount notification: %r" % (data,))
+                return
+            self._notify('bytecount', bytes_in, bytes_out)
+        elif kind == 'LOG':
+            # timestamp, flags, message
+            fields = data.split(',', 2)
+            self._notify('log', fields[-1])
+        elif kind == 'FATAL':
+            logger.error("OpenVPN fatal error: %s" % (data,))
+        else:
+            logger.debug("Management notification: %s" % (line,))
+
+    def _notify(self, event, *args):
+        handler = getattr(self._listener, 'management_' + event, None)
+        if handler is not None:
+            handler(*args)
+
+
+class ManagementFactory(ClientFactory):
+
+    def __init__(self, listener=None, timeout=COMMAND_TIMEOUT):
+        self._listener = listener
+        self._timeout = timeout
+
+    def buildProtocol(self, addr):
+        protocol = ManagementProtocol(self._listener, self._timeout)
+        protocol.factory = self
+        return protocol
+
+
+def connect(host, port, listener=None, timeout=COMMAND_TIMEOUT):
+    """
+    Connect to a management interface.
+
+    :param host: either the socket path (unix) or the socket IP.
+    :type host: str
+    :param port: either 'unix' for a unix socket, or the TCP port.
+    :type port: str
+    :param listener: the object that gets the notifications.
+    :type listener: object
+    :param timeout: seconds to wait for the answer to a command.
+    :type timeout: float
+
+    :return: a Deferred that fires with the connected ManagementProtocol.
+    :rtype: Deferred
+    """
+    if port == 'unix':
+        endpoint = UNIXClientEndpoint(reactor, host)
+    else:
+        endpoint = TCP4ClientEndpoint(reactor, host, int(port))
+    return endpoint.connect(ManagementFactory(listener, timeout))
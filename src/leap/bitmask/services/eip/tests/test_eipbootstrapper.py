@@ -334,6 +334,40 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
 
         return d
 
+    def _fresh_test_template(self, verified_ago, should_redownload=False):
+        pc = ProviderConfig()
+        pc.get_domain = mock.MagicMock(return_value="fresh.example.org")
+        pc.get_api_version = mock.MagicMock(return_value="1")
+
+        EIPBootstrapper._verified.pop("fresh.example.org", None)
+        if verified_ago is not None:
+            EIPBootstrapper._verified["fresh.example.org"] = \
+                time.time() - verified_ago
+
+        eip_config = mock.MagicMock()
+        with mock.patch.object(EIPConfig, 'get_eip_config',
+                               return_value=eip_config):
+            with mock.patch('leap.common.certs.should_redownload',
+                            return_value=should_redownload):
+                return self.eb.is_fresh(pc, 60)
+
+    def test_is_fresh(self):
+        self.assertTrue(self._fresh_test_template(10))
+
+    def test_is_fresh_never_verified(self):
+        self.assertFalse(self._fresh_test_template(None))
+
+    def test_is_fresh_verified_long_ago(self):
+        self.assertFalse(self._fresh_test_template(120))
+
+    def test_is_fresh_cert_not_valid(self):
+        self.assertFalse(self._fresh_test_template(10, True))
+
+    def test_forget(self):
+        self.assertTrue(self._fresh_test_template(10))
+        EIPBootstrapper.forget("fresh.example.org")
+        self.assertNotIn("fresh.example.org", EIPBootstrapper._verified)
+
     @deferred()
     def test_run_eip_setup_checks(self):
         self.eb._download_config = mock.MagicMock()
@@ -346,3 +380,21 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
             self.eb._download_client_certificates.assert_called_once_with(None)
         d.addCallback(check)
         return d
+
+    @deferred()
+    def test_run_eip_setup_checks_without_signaler(self):
+        self.eb._download_config = mock.MagicMock(
+            side_effect=ValueError("no config"))
+
+        patcher = mock.patch(
+            'leap.bitmask.services.abstractbootstrapper.logger')
+        logger = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        d = self.eb.run_eip_setup_checks(ProviderConfig())
+
+        def check(failure):
+            failure.trap(ValueError)
+            self.assertFalse(logger.warning.called)
+        d.addCallbacks(lambda _: self.fail("the failure was trapped"), check)
+        return d
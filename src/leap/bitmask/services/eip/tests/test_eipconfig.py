@@ -260,6 +260,29 @@ class EIPConfigTest(BaseLeapTest):
         self.assertEqual(config.get_gateway_ip(0), sample_ip_0)
         self.assertEqual(config.get_gateway_ip(1), sample_ip_1)
 
+    def test_gateway_index(self):
+        config = self._get_eipconfig()
+        gateways = config.get_gateway_index()
+        self.assertEqual(len(gateways), len(sample_config["gateways"]))
+        self.assertEqual(gateways[0].ip,
+                         sample_config["gateways"][0]["ip_address"])
+        self.assertEqual(gateways[1].index, 1)
+
+        # built once
+        self.assertIs(config.get_gateway_index(), gateways)
+
+    def test_gateway_index_rebuilt_on_load(self):
+        config = self._get_eipconfig()
+        gateways = config.get_gateway_index()
+
+        data = copy.deepcopy(sample_config)
+        data['serial'] = 2
+        data['gateways'][0]["ip_address"] = "11.22.33.44"
+        config.load(data=json.dumps(data))
+
+        self.assertIsNot(config.get_gateway_index(), gateways)
+        self.assertEqual(config.get_gateway_ip(), "11.22.33.44")
+
     def test_get_client_cert_path_as_expected(self):
         config = self._get_eipconfig()
         provider_config = ProviderConfig()
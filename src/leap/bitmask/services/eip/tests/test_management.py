@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# test_management.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+tests for the openvpn management protocol
+"""
+import unittest
+
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+
+from leap.bitmask.services.eip.management import ManagementProtocol
+from leap.bitmask.services.eip.management import ManagementError
+from leap.common.testing.basetest import BaseLeapTest
+
+from mock import Mock
+
+
+class ManagementProtocolTest(BaseLeapTest):
+    """Tests for the openvpn management protocol."""
+
+    def setUp(self):
+        self.listener = Mock()
+        self.protocol = ManagementProtocol(self.listener, timeout=None)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def tearDown(self):
+        pass
+
+    def _receive(self, *lines):
+        self.protocol.dataReceived(''.join(l + '\r\n' for l in lines))
+
+    def _results(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results
+
+    def test_connected(self):
+        self.listener.management_connected.assert_called_once_with(
+            self.protocol)
+
+    def test_single_line_answer(self):
+        results = self._results(self.protocol.send_command('state on'))
+        self.assertEqual(self.transport.value(), 'state on\n')
+        self._receive('SUCCESS: real-time state notification set to ON')
+        self.assertEqual(
+            results, [['real-time state notification set to ON']])
+
+    def test_multi_line_answer(self):
+        results = self._results(self.protocol.send_command('state'))
+        self._receive('1466165393,CONNECTED,SUCCESS,10.42.0.8,1.2.3.4',
+                      'END')
+        self.assertEqual(
+            results, [['1466165393,CONNECTED,SUCCESS,10.42.0.8,1.2.3.4']])
+
+    def test_error(self):
+        results = self._results(self.protocol.send_command('nope'))
+        self._receive('ERROR: unknown command')
+        results[0].trap(ManagementError)
+
+    def test_answers_in_order(self):
+        first = self._results(self.protocol.send_command('state on'))
+        second = self._results(self.protocol.send_command('status'))
+        self._receive('SUCCESS: ok',
+                      '>BYTECOUNT:10,20',
+                      'TUN/TAP read bytes,5',
+                      'END')
+        self.assertEqual(first, [['ok']])
+        self.assertEqual(second, [['TUN/TAP read bytes,5']])
+        self.listener.management_bytecount.assert_called_once_with(10, 20)
+
+    def test_notifications(self):
+        self._receive('>STATE:1466165393,CONNECTED,SUCCESS,10.42.0.8,1.2.3.4',
+                      '>LOG:1466165393,I,Initialization Sequence Completed')
+        self.listener.management_state.assert_called_once_with(
+            'CONNECTED',
+            ['1466165393', 'CONNECTED', 'SUCCESS', '10.42.0.8', '1.2.3.4'])
+        self.listener.management_log.assert_called_once_with(
+            'Initialization Sequence Completed')
+
+    def test_connection_lost_fails_pending(self):
+        results = self._results(self.protocol.send_command('state'))
+        self.protocol.connectionLost(Failure(ConnectionDone()))
+        results[0].trap(ConnectionDone)
+        self.assertTrue(self.listener.management_disconnected.called)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -22,9 +22,10 @@ import unittest
 import time
 
 from leap.bitmask.services.eip.eipconfig import EIPConfig, VPNGatewaySelector
+from leap.bitmask.util import server_selection
 from leap.common.testing.basetest import BaseLeapTest
 
-from mock import Mock
+from mock import Mock, patch
 
 
 sample_gateways = [
@@ -129,6 +130,76 @@ class VPNGatewaySelectorTest(BaseLeapTest):
         self.assertEqual(gateways, [ips[4], ips[2], ips[3], ips[1]])
 
 
+class VPNGatewaySelectorMeasuredTest(BaseLeapTest):
+    """
+    VPNGatewaySelector's tests, ranking the gateways by rtt too.
+    """
+    def setUp(self):
+        gateways = []
+        for gateway in sample_gateways:
+            gateway = dict(gateway)
+            gateway[u'capabilities'] = {u'ports': [u'443', u'80']}
+            gateways.append(gateway)
+
+        self.eipconfig = EIPConfig()
+        self.eipconfig.get_gateways = Mock(return_value=gateways)
+        self.eipconfig.get_locations = Mock(return_value=sample_locations)
+        server_selection.rtt_cache.clear()
+
+        patcher = patch.object(server_selection, 'get_network_id',
+                               return_value='10.0.0.2')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        server_selection.rtt_cache.clear()
+
+    def _rtts(self, rtts):
+        results = {}
+        for idx, rtt in rtts.iteritems():
+            results[(ips[idx], 443)] = rtt
+            results[(ips[idx], 80)] = None
+        return results
+
+    def test_fastest_first(self):
+        rtts = self._rtts({1: 0.300, 2: 0.020, 3: 0.150, 4: None})
+        with patch.object(server_selection, 'probe',
+                          return_value=rtts) as probe:
+            gateway_selector = VPNGatewaySelector(
+                self.eipconfig, 0, measured=True)
+            gateways = gateway_selector.get_gateways()
+            self.assertEqual(gateways, [ips[2], ips[3], ips[1], ips[4]])
+
+            # cached for this network
+            gateway_selector.get_gateways()
+            self.assertEqual(probe.call_count, 1)
+
+    def test_timezone_breaks_close_rtts(self):
+        # gw1 is in GMT+2 and gw2 in GMT-7, 9 hours away
+        rtts = self._rtts({1: 0.100, 2: 0.060, 3: None, 4: None})
+        with patch.object(server_selection, 'probe', return_value=rtts):
+            gateway_selector = VPNGatewaySelector(
+                self.eipconfig, 0, measured=True)
+            gateways = gateway_selector.get_gateways()
+            self.assertEqual(gateways, [ips[1], ips[2], ips[3], ips[4]])
+
+    def test_unreachable_falls_back_to_timezone(self):
+        rtts = self._rtts({1: None, 2: None, 3: None, 4: None})
+        with patch.object(server_selection, 'probe', return_value=rtts):
+            gateway_selector = VPNGatewaySelector(
+                self.eipconfig, 0, measured=True)
+            gateways = gateway_selector.get_gateways()
+            self.assertEqual(gateways, [ips[1], ips[3], ips[2], ips[4]])
+
+    def test_no_probe_without_cache(self):
+        with patch.object(server_selection, 'probe') as probe:
+            gateway_selector = VPNGatewaySelector(
+                self.eipconfig, 0, measured=True, probe=False)
+            gateways = gateway_selector.get_gateways()
+            self.assertEqual(gateways, [ips[1], ips[3], ips[2], ips[4]])
+            self.assertFalse(probe.called)
+
+
 class VPNGatewaySelectorDSTTest(VPNGatewaySelectorTest):
     """
     VPNGatewaySelector's tests.
@@ -129,7 +129,8 @@ class VPNLauncher(object):
         settings = Settings()
         domain = providerconfig.get_domain()
         gateway_conf = settings.get_selected_gateway(domain)
-        gateway_selector = VPNGatewaySelector(eipconfig)
+        gateway_selector = VPNGatewaySelector(
+            eipconfig, measured=settings.get_measure_gateways())
 
         if gateway_conf == GATEWAY_AUTOMATIC:
             gws = gateway_selector.get_gateways()
@@ -140,8 +141,14 @@ class VPNLauncher(object):
             logger.error('No gateway was found!')
             raise VPNLauncherException('No gateway was found!')
 
-        for idx, gw in enumerate(gws):
-            ports = eipconfig.get_gateway_ports(idx)
+        # the gateways are sorted, look their ports up by ip
+        ports_by_ip = dict((record.ip, record.ports)
+                           for record in eipconfig.get_gateway_index())
+
+        for gw in gws:
+            ports = ports_by_ip.get(gw)
+            if ports is None:
+                ports = eipconfig.get_gateway_ports(0)
 
             the_port = "1194"  # default port
 
@@ -20,9 +20,9 @@ VPN Manager, spawned in a custom processProtocol.
 import commands
 import os
 import shutil
-import socket
 import subprocess
 import sys
+import threading
 
 from itertools import chain, repeat
 
@@ -42,15 +42,16 @@ from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.services.eip import get_vpn_launcher
 from leap.bitmask.services.eip import linuxvpnlauncher
 from leap.bitmask.services.eip import darwinvpnlauncher
+from leap.bitmask.services.eip import management
 from leap.bitmask.services.eip.eipconfig import EIPConfig
-from leap.bitmask.services.eip.udstelnet import UDSTelnet
 from leap.bitmask.util import first, force_eval
+from leap.bitmask.util.averages import TrafficMeter
 from leap.bitmask.platform_init import IS_MAC, IS_LINUX
 from leap.common.check import leap_assert, leap_assert_type
 
-from twisted.internet import defer, protocol, reactor
+from twisted.internet import defer, protocol, reactor, threads
 from twisted.internet import error as internet_error
-from twisted.internet.task import LoopingCall
+from twisted.python.threadable import isInIOThread
 
 logger = get_logger()
 
@@ -157,7 +158,6 @@ class VPN(object):
         to the VPNManager.
         """
         self._vpnproc = None
-        self._pollers = []
 
         self._signaler = kwargs['signaler']
         self._openvpn_verb = flags.OPENVPN_VERBOSITY
@@ -177,7 +177,6 @@ class VPN(object):
         logger.debug(
             'VPN: start ---------------------------------------------------')
         self._user_stopped = False
-        self._stop_pollers()
         kwargs['openvpn_verb'] = self._openvpn_verb
         kwargs['signaler'] = self._signaler
 
@@ -246,14 +245,17 @@ class VPN(object):
         vpnproc.pid = running_proc.pid
         self._vpnproc = vpnproc
 
-        # add pollers for status and state
-        # this could be extended to a collection of
-        # generic watchers
+    def get_traffic(self):
+        """
+        Get the traffic of the running openvpn.
 
-        poll_list = [LoopingCall(vpnproc.pollStatus),
-                     LoopingCall(vpnproc.pollState)]
-        self._pollers.extend(poll_list)
-        self._start_pollers()
+        :return: the traffic, as in VPNManager.get_traffic, or None if
+                 openvpn is not running.
+        :rtype: dict
+        """
+        if self._vpnproc is None:
+            return None
+        return self._vpnproc.get_traffic()
 
     def _launch_firewall_linux(self, gateways, restart=False):
         """
@@ -375,7 +377,6 @@ class VPN(object):
         """
         Sends a kill signal to the process.
         """
-        self._stop_pollers()
         if self._vpnproc is None:
             logger.debug("There's no vpn process running to kill.")
         else:
@@ -393,9 +394,12 @@ class VPN(object):
         :type shutdown: bool
         :param restart: whether this stop is part of a hard restart.
         :type restart: bool
-        """
-        self._stop_pollers()
 
+        :return: a Deferred that fires, in the reactor thread, once the
+                 SIGTERM has been sent.
+        :rtype: Deferred
+        """
+        d = defer.succeed(None)
         # First we try to be polite and send a SIGTERM...
         if self._vpnproc is not None:
             # We assume that the only valid stops are initiated
@@ -404,7 +408,7 @@ class VPN(object):
             self._vpnproc.is_restart = restart
 
             self._sentterm = True
-            self._vpnproc.terminate_openvpn(shutdown=shutdown)
+            d = self._vpnproc.terminate_openvpn(shutdown=shutdown)
 
             # ...but we also trigger a countdown to be unpolite
             # if strictly needed.
@@ -419,24 +423,7 @@ class VPN(object):
                     logger.warning("Could not tear firewall down")
         else:
             logger.debug("VPN is not running.")
-
-    def _start_pollers(self):
-        """
-        Iterate through the registered observers
-        and start the looping call for them.
-        """
-        for poller in self._pollers:
-            poller.start(VPNManager.POLL_TIME)
-
-    def _stop_pollers(self):
-        """
-        Iterate through the registered observers
-        and stop the looping calls if they are running.
-        """
-        for poller in self._pollers:
-            if poller.running:
-                poller.stop()
-        self._pollers = []
+        return d
 
 
 class VPNManager(object):
@@ -454,12 +441,16 @@ class VPNManager(object):
     """
 
     # Timers, in secs
-    # NOTE: We need to set a bigger poll time in OSX because it seems
+    # NOTE: We need to set a bigger interval in OSX because it seems
     # openvpn malfunctions when you ask it a lot of things in a short
     # amount of time.
-    POLL_TIME = 2.5 if IS_MAC else 1.0
+    BYTECOUNT_INTERVAL = 3 if IS_MAC else 1
     CONNECTION_RETRY_TIME = 1
 
+    # Whether to get the openvpn log through the management interface,
+    # for when we can not read it from its output.
+    MANAGEMENT_LOG = False
+
     def __init__(self, signaler=None):
         """
         Initializes the VPNManager.
@@ -468,10 +459,15 @@ class VPNManager(object):
                          backend
         :type signaler: backend.Signaler
         """
-        self._tn = None
+        self._management = None
         self._signaler = signaler
         self._aborted = False
 
+        # fed by the bytecount notifications, read by the backend API too
+        self._traffic_lock = threading.Lock()
+        self._upload = TrafficMeter()
+        self._download = TrafficMeter()
+
     @property
     def aborted(self):
         return self._aborted
@@ -480,68 +476,79 @@ class VPNManager(object):
     def aborted(self, value):
         self._aborted = value
 
-    def _seek_to_eof(self):
-        """
-        Read as much as available. Position seek pointer to end of stream
+    def _send_command(self, command):
         """
-        try:
-            self._tn.read_eager()
-        except EOFError:
-            logger.debug("Could not read from socket. Assuming it died.")
-            return
+        Sends a command to the management interface.
 
-    def _send_command(self, command, until=b"END"):
-        """
-        Sends a command to the telnet connection and reads until END
-        is reached.
+        It must be called from the reactor thread.
 
         :param command: command to send
         :type command: str
 
-        :param until: byte delimiter string for reading command output
-        :type until: byte str
-
-        :return: response read
-        :rtype: list
+        :return: a Deferred that fires with the lines of the response, or
+                 with an empty list if the command could not be sent.
+        :rtype: Deferred
         """
-        leap_assert(self._tn, "We need a tn connection!")
+        if not self.is_connected():
+            return defer.succeed([])
 
-        try:
-            self._tn.write("%s\n" % (command,))
-            buf = self._tn.read_until(until, 2)
-            self._seek_to_eof()
-            blist = buf.split('\r\n')
-            if blist[-1].startswith(until):
-                del blist[-1]
-                return blist
-            else:
-                return []
-
-        except socket.error:
-            # XXX should get a counter and repeat only
-            # after mod X times.
-            logger.warning('socket error (command was: "%s")' % (command,))
-            self._close_management_socket(announce=False)
-            logger.debug('trying to connect to management again')
-            self.try_to_connect_to_management(max_retries=5)
+        def _error(failure):
+            logger.warning("Error sending command %s: %r" %
+                           (command, failure.value))
             return []
 
-        # XXX should move this to a errBack!
-        except Exception as e:
-            logger.warning("Error sending command %s: %r" %
-                           (command, e))
-        return []
+        d = self._management.send_command(command)
+        d.addErrback(_error)
+        return d
 
     def _close_management_socket(self, announce=True):
         """
         Close connection to openvpn management interface.
         """
         logger.debug('closing socket')
+        if self._management is None:
+            return
         if announce:
-            self._tn.write("quit\n")
-            self._tn.read_all()
-        self._tn.get_socket().close()
-        self._tn = None
+            self._management.close()
+        else:
+            self._management.transport.loseConnection()
+        self._management = None
+
+    # management notifications
+
+    def management_connected(self, management):
+        logger.info('Connected to management')
+        self._management = management
+
+        # instead of polling, openvpn tells us about the changes
+        self._send_command("state on")
+        self._send_command("bytecount %d" % (self.BYTECOUNT_INTERVAL,))
+        if self.MANAGEMENT_LOG:
+            self._send_command("log on")
+        self.get_state()
+
+    def management_disconnected(self, reason):
+        if self._management is None:
+            # we closed it
+            return
+        logger.warning("Lost the connection to management: %s"
+                       % (reason.getErrorMessage(),))
+        self._management = None
+        logger.debug('trying to connect to management again')
+        self.try_to_connect_to_management(max_retries=5)
+
+    def management_state(self, state, fields):
+        self._notify_state(state)
+
+    def management_bytecount(self, bytes_in, bytes_out):
+        with self._traffic_lock:
+            self._upload.update(bytes_out)
+            self._download.update(bytes_in)
+        self._notify_status(self.get_traffic())
+
+    def management_log(self, message):
+        logger.info(message)
+        self._vpn_observer.watch(message)
 
     def _connect_management(self, socket_host, socket_port):
         """
@@ -554,28 +561,17 @@ class VPNManager(object):
         :param socket_port: either string "unix" if it's a unix
                             socket, or port otherwise
         :type socket_port: str
+
+        :returns: a deferred that fires with the management protocol.
         """
         if self.is_connected():
             self._close_management_socket()
 
-        try:
-            self._tn = UDSTelnet(socket_host, socket_port)
-
-            # XXX make password optional
-            # specially for win. we should generate
-            # the pass on the fly when invoking manager
-            # from conductor
-
-            # self.tn.read_until('ENTER PASSWORD:', 2)
-            # self.tn.write(self.password + '\n')
-            # self.tn.read_until('SUCCESS:', 2)
-            if self._tn:
-                self._tn.read_eager()
-
-        # XXX move this to the Errback
-        except Exception as e:
-            logger.warning("Could not connect to OpenVPN yet: %r" % (e,))
-            self._tn = None
+        # XXX make password optional
+        # specially for win. we should generate
+        # the pass on the fly when invoking manager
+        # from conductor
+        return management.connect(socket_host, socket_port, listener=self)
 
     def _connectCb(self, *args):
         """
@@ -583,9 +579,7 @@ class VPNManager(object):
 
         :param args: not used
         """
-        if self._tn:
-            logger.info('Connected to management')
-        else:
+        if not self.is_connected():
             logger.debug('Cannot connect to management...')
 
     def _connectErr(self, failure):
@@ -594,7 +588,8 @@ class VPNManager(object):
 
         :param failure: Failure
         """
-        logger.warning(failure)
+        logger.warning("Could not connect to OpenVPN yet: %r"
+                       % (failure.value,))
 
     def connect_to_management(self, host, port):
         """
@@ -620,7 +615,7 @@ class VPNManager(object):
         :returns: True if connected, False otherwise
         :rtype: bool
         """
-        return True if self._tn else False
+        return self._management is not None
 
     def try_to_connect_to_management(self, retry=0, max_retries=None):
         """
@@ -643,10 +638,25 @@ class VPNManager(object):
             return
         logger.debug('trying to connect to management')
         if not self.aborted and not self.is_connected():
-            self.connect_to_management(self._socket_host, self._socket_port)
+            d = self.connect_to_management(
+                self._socket_host, self._socket_port)
+            d.addCallback(self._retry_connection, retry, max_retries)
+
+    def _retry_connection(self, _, retry, max_retries):
+        if not self.is_connected():
             reactor.callLater(
                 self.CONNECTION_RETRY_TIME,
-                self.try_to_connect_to_management, retry + 1)
+                self.try_to_connect_to_management, retry + 1, max_retries)
+
+    def _notify_state(self, state):
+        if state != self._last_state:
+            self._signaler.signal(self._signaler.eip_state_changed, state)
+            self._last_state = state
+
+    def _notify_status(self, status):
+        if status != self._last_status:
+            self._signaler.signal(self._signaler.eip_status_changed, status)
+            self._last_status = status
 
     def _parse_state_and_notify(self, output):
         """
@@ -664,66 +674,30 @@ class VPNManager(object):
             parts = stripped.split(",")
             if len(parts) < 5:
                 continue
-            ts, status_step, ok, ip, remote = parts
-
-            state = status_step
-            if state != self._last_state:
-                self._signaler.signal(self._signaler.eip_state_changed, state)
-                self._last_state = state
-
-    def _parse_status_and_notify(self, output):
-        """
-        Parses the output of the status command and emits
-        status_changed signal when the status changes.
-
-        :param output: list of lines that the status command printed
-                       as its output
-        :type output: list
-        """
-        tun_tap_read = ""
-        tun_tap_write = ""
-
-        for line in output:
-            stripped = line.strip()
-            if stripped.endswith("STATISTICS") or stripped == "END":
-                continue
-            parts = stripped.split(",")
-            if len(parts) < 2:
-                continue
-
-            text, value = parts
-            # text can be:
-            #   "TUN/TAP read bytes"
-            #   "TUN/TAP write bytes"
-            #   "TCP/UDP read bytes"
-            #   "TCP/UDP write bytes"
-            #   "Auth read bytes"
-
-            if text == "TUN/TAP read bytes":
-                tun_tap_read = value  # download
-            elif text == "TUN/TAP write bytes":
-                tun_tap_write = value  # upload
-
-        status = (tun_tap_read, tun_tap_write)
-        if status != self._last_status:
-            self._signaler.signal(self._signaler.eip_status_changed, status)
-            self._last_status = status
+            self._notify_state(parts[1])
 
     def get_state(self):
         """
         Notifies the gui of the output of the state command over
         the openvpn management interface.
+
+        :rtype: Deferred
         """
-        if self.is_connected():
-            return self._parse_state_and_notify(self._send_command("state"))
+        d = self._send_command("state")
+        d.addCallback(self._parse_state_and_notify)
+        return d
 
-    def get_status(self):
+    def get_traffic(self):
         """
-        Notifies the gui of the output of the status command over
-        the openvpn management interface.
+        Get the traffic since openvpn started.
+
+        :return: the total bytes, and the rates in bytes per second, of the
+                 upload and the download.
+        :rtype: dict
         """
-        if self.is_connected():
-            return self._parse_status_and_notify(self._send_command("status"))
+        with self._traffic_lock:
+            return {'upload': self._upload.stats(),
+                    'download': self._download.stats()}
 
     @property
     def vpn_env(self):
@@ -735,11 +709,28 @@ class VPNManager(object):
     def terminate_openvpn(self, shutdown=False):
         """
         Attempts to terminate openvpn by sending a SIGTERM.
+
+        It can be called from any thread. On shutdown, the temporal files
+        are removed once the signal has been sent.
+
+        :return: a Deferred that fires, in the reactor thread, once the
+                 SIGTERM has been sent.
+        :rtype: Deferred
         """
-        if self.is_connected():
-            self._send_command("signal SIGTERM")
-        if shutdown:
-            self._cleanup_tempfiles()
+        d = defer.Deferred()
+
+        def _terminate():
+            sent = self._send_command("signal SIGTERM")
+            if shutdown:
+                sent.addBoth(lambda result: self._cleanup_tempfiles())
+            sent.chainDeferred(d)
+
+        # this is called from the backend worker threads too
+        if isInIOThread():
+            _terminate()
+        else:
+            reactor.callFromThread(_terminate)
+        return d
 
     def _cleanup_tempfiles(self):
         """
@@ -789,15 +780,36 @@ class VPNManager(object):
                 pass
         return openvpn_process
 
+    def _terminate_running(self, host, port):
+        """
+        Send a SIGTERM through the management interface at host, port.
+
+        :rtype: Deferred
+        """
+        def _terminate(management):
+            d = management.send_command("signal SIGTERM")
+            d.addBoth(lambda _: management.close())
+            return d
+
+        d = management.connect(host, port)
+        d.addCallback(_terminate)
+        return d
+
     def stop_if_already_running(self):
         """
         Checks if VPN is already running and tries to stop it.
 
+        It blocks until the running instance has been asked to terminate, so
+        it must be called from a worker thread, not from the reactor one.
+
         Might raise OpenVPNAlreadyRunning.
 
         :return: True if stopped, False otherwise
 
         """
+        leap_assert(not isInIOThread(),
+                    "stop_if_already_running blocks the reactor")
+
         process = self.get_openvpn_process()
         if not process:
             logger.debug('Could not find openvpn process while '
@@ -826,8 +838,6 @@ class VPNManager(object):
                 port = cmdline[index + 2]
                 logger.debug("Trying to connect to %s:%s"
                              % (host, port))
-                self.connect_to_management(host, port)
-
                 # XXX this has a problem with connections to different
                 # remotes. So the reconnection will only work when we are
                 # terminating instances left running for the same provider.
@@ -835,8 +845,8 @@ class VPNManager(object):
                 # provider, we will get:
                 # TLS Error: local/remote TLS keys are out of sync
                 # However, that should be a rare case right now.
-                self._send_command("signal SIGTERM")
-                self._close_management_socket(announce=True)
+                threads.blockingCallFromThread(
+                    reactor, self._terminate_running, host, port)
             except (Exception, AssertionError) as e:
                 logger.warning("Problem trying to terminate OpenVPN: %r"
                                % (e,))
@@ -950,6 +960,7 @@ class VPNProcess(protocol.ProcessProtocol, VPNManager):
         self._signaler.signal(
             self._signaler.eip_process_finished, exit_code)
         self._alive = False
+        self._close_management_socket(announce=False)
 
     def processEnded(self, reason):
         """
@@ -962,22 +973,6 @@ class VPNProcess(protocol.ProcessProtocol, VPNManager):
         if isinstance(exit_code, int):
             logger.debug("processEnded, status %d" % (exit_code,))
 
-    # polling
-
-    def pollStatus(self):
-        """
-        Polls connection status.
-        """
-        if self._alive:
-            self.get_status()
-
-    def pollState(self):
-        """
-        Polls connection state.
-        """
-        if self._alive:
-            self.get_state()
-
     # launcher
 
     def getCommand(self):
@@ -1055,6 +1050,9 @@ class VPNCanary(VPNProcess):
         cmd = 'openvpn_force_stop'
         result = helper.send(cmd)
 
+    # the openvpn output is not ours to read, the helper runs it
+    MANAGEMENT_LOG = True
+
     def getVPNCommand(self):
         return VPNProcess.getCommand(self)
 
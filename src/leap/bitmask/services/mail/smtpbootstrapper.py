@@ -29,6 +29,7 @@ from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.services import download_service_config
 from leap.bitmask.services.abstractbootstrapper import AbstractBootstrapper
 from leap.bitmask.services.mail.smtpconfig import SMTPConfig
+from leap.bitmask.util import server_selection
 
 from leap.common import certs as leap_certs
 from leap.common.check import leap_assert
@@ -63,6 +64,12 @@ class SMTPBootstrapper(AbstractBootstrapper):
 
         self._smtp_service = None
         self._smtp_port = None
+        self._hostname = None
+
+        # the probes do not hold up the bootstrap: until they finish, the
+        # closest server by timezone is used.
+        self._server_strategy = server_selection.get_strategy(
+            'rtt', background=True)
 
     def _download_config_and_cert(self):
         """
@@ -80,13 +87,7 @@ class SMTPBootstrapper(AbstractBootstrapper):
             self._session,
             self._download_if_needed)
 
-        hosts = self._smtp_config.get_hosts()
-
-        if len(hosts) == 0:
-            raise NoSMTPHosts()
-
-        # TODO handle more than one host and define how to choose
-        hostname = hosts.keys()[0]
+        hostname = self._pick_hostname()
         logger.debug("Using hostname %s for SMTP" % (hostname,))
 
         client_cert_path = self._smtp_config.get_client_cert_path(
@@ -124,14 +125,30 @@ class SMTPBootstrapper(AbstractBootstrapper):
                 else:
                     raise
 
+    def _pick_hostname(self):
+        """
+        Chooses the SMTP host, the same way the soledad server is chosen.
+
+        :rtype: str
+        """
+        hosts = self._smtp_config.get_hosts()
+
+        if not hosts:
+            raise NoSMTPHosts()
+
+        locations = self._smtp_config.get_locations()
+        self._hostname = self._server_strategy.pick(hosts, locations)
+        return self._hostname
+
     def _start_smtp_service(self):
         """
         Start the smtp service using the downloaded configurations.
         """
         # TODO Make the encrypted_only configurable
-        # TODO handle more than one host and define how to choose
         hosts = self._smtp_config.get_hosts()
-        hostname = hosts.keys()[0]
+        hostname = self._hostname
+        if hostname not in hosts:
+            hostname = self._pick_hostname()
         host = hosts[hostname][self.IP_KEY].encode("utf-8")
         port = hosts[hostname][self.PORT_KEY]
         client_cert_path = self._smtp_config.get_client_cert_path(
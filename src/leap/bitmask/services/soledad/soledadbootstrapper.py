@@ -35,7 +35,8 @@ from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.services import download_service_config
 from leap.bitmask.services.abstractbootstrapper import AbstractBootstrapper
 from leap.bitmask.services.soledad.soledadconfig import SoledadConfig
-from leap.bitmask.util import first, is_file, is_empty_file, make_address
+from leap.bitmask.util import is_file, is_empty_file, make_address
+from leap.bitmask.util import server_selection
 from leap.bitmask.util import get_path_prefix
 from leap.bitmask.util import here
 from leap.bitmask.platform_init import IS_WIN, IS_MAC
@@ -125,6 +126,11 @@ class SoledadBootstrapper(AbstractBootstrapper):
         self._soledad = None
         self._keymanager = None
 
+        # the probes do not hold up the bootstrap: until they finish, the
+        # closest server by timezone is used.
+        self._server_strategy = server_selection.get_strategy(
+            'rtt', background=True)
+
     @property
     def srpauth(self):
         if flags.OFFLINE is True:
@@ -334,14 +340,15 @@ class SoledadBootstrapper(AbstractBootstrapper):
         if not self._soledad_config:
             self._soledad_config = SoledadConfig()
 
-        # TODO: Select server based on timezone (issue #3308)
         server_dict = self._soledad_config.get_hosts()
 
         if not server_dict.keys():
             # XXX raise more specific exception, and catch it properly!
             raise Exception("No soledad server found")
 
-        selected_server = server_dict[first(server_dict.keys())]
+        locations = self._soledad_config.get_locations()
+        selected = self._server_strategy.pick(server_dict, locations)
+        selected_server = server_dict[selected]
         server_url = "https://%s:%s/user-%s" % (
             selected_server["hostname"],
             selected_server["port"],
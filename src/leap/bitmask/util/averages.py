@@ -15,78 +15,108 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-Utility class for moving averages.
+Utility class for traffic rates.
 
-It is used in the status panel widget for displaying up and down
-download rates.
+It is used by the EIP backend to compute the up and download rates from
+the openvpn byte counters, that the status panel widget then displays.
 """
-from leap.bitmask.util import first
+import time
 
+from collections import deque
 
-class RateMovingAverage(object):
+
+class TrafficMeter(object):
     """
-    Moving window average for calculating
-    upload and download rates.
+    Rates and totals of a byte counter that only grows, like the ones in
+    the openvpn bytecount notifications.
+
+    The samples are kept in a ring buffer, to get the rate over the last
+    WINDOW seconds, and an exponentially weighted moving average (EWMA)
+    gives a smoothed rate, where a sample HALF_LIFE seconds old weighs half
+    as much as a new one. Times are floats, so sub-second intervals between
+    samples count.
     """
-    SAMPLE_SIZE = 5
+    SAMPLES = 64
+    WINDOW = 5.0  # in seconds
+    HALF_LIFE = 2.0  # in seconds
 
-    def __init__(self):
-        """
-        Initializes an empty array of fixed size
-        """
+    def __init__(self, window=WINDOW, half_life=HALF_LIFE, samples=SAMPLES):
+        self._window = window
+        self._half_life = half_life
+        self._samples = deque(maxlen=samples)  # of (time, total)
         self.reset()
 
     def reset(self):
-        self._data = [None for i in xrange(self.SAMPLE_SIZE)]
+        """
+        Start a new session, with no traffic.
+        """
+        self._samples.clear()
+        self._offset = 0  # what was counted before the counter started over
+        self._last = None  # the last value of the counter
+        self.ewma = 0.0
+        self.started = None
 
-    def append(self, x):
+    def update(self, counter, now=None):
         """
-        Appends a new data point to the collection.
+        Add a new sample of the counter.
 
-        :param x: A tuple containing timestamp and traffic points
-                  in the form (timestamp, traffic)
-        :type x: tuple
+        :param counter: the bytes counted so far.
+        :type counter: int
+        :param now: the time of the sample, time.time() by default.
+        :type now: float
         """
-        self._data.pop(0)
-        self._data.append(x)
+        if now is None:
+            now = time.time()
+        if self._last is not None and counter < self._last:
+            # the counter started over, keep counting from where it was
+            self._offset += self._last
+        self._last = counter
+        total = self._offset + counter
+
+        if self._samples:
+            then, previous = self._samples[-1]
+            elapsed = now - then
+            if elapsed > 0:
+                rate = (total - previous) / elapsed
+                alpha = 1 - 0.5 ** (elapsed / self._half_life)
+                self.ewma += alpha * (rate - self.ewma)
+        else:
+            self.started = now
+        self._samples.append((now, total))
 
-    def get(self):
+    @property
+    def total(self):
         """
-        Gets the collection.
+        The bytes counted since the session started.
         """
-        return self._data
+        if not self._samples:
+            return 0
+        return self._samples[-1][1]
 
-    def get_average(self):
+    @property
+    def rate(self):
         """
-        Gets the moving average.
+        The rate, in bytes per second, over the last window seconds before
+        the latest sample.
         """
-        data = filter(None, self.get())
-        traff = [traffic for (ts, traffic) in data]
-        times = [ts for (ts, traffic) in data]
-
-        try:
-            deltatraffic = traff[-1] - first(traff)
-            deltat = (times[-1] - first(times)).seconds
-        except IndexError:
-            deltatraffic = 0
-            deltat = 0
-
-        try:
-            rate = float(deltatraffic) / float(deltat) / 1024
-        except ZeroDivisionError:
-            rate = 0
+        if len(self._samples) < 2:
+            return 0.0
+        newest_time, newest = self._samples[-1]
+        oldest_time, oldest = newest_time, newest
+        for then, total in reversed(self._samples):
+            if newest_time - then > self._window:
+                break
+            oldest_time, oldest = then, total
+        if oldest_time == newest_time:
+            return 0.0
+        return (newest - oldest) / (newest_time - oldest_time)
 
-        # In some cases we get negative rates
-        if rate < 0:
-            rate = 0
-
-        return rate
-
-    def get_total(self):
+    def stats(self):
         """
-        Gets the total accumulated throughput.
+        :return: the total bytes, and the windowed and smoothed rates in
+                 bytes per second.
+        :rtype: dict
         """
-        try:
-            return self._data[-1][1] / 1024
-        except TypeError:
-            return 0
+        return {'total': self.total,
+                'rate': round(self.rate, 1),
+                'ewma': round(self.ewma, 1)}
@@ -61,6 +61,10 @@ def build_parser():
                         action="store_true", dest="skip_wizard_checks",
                         help='Skips the provider checks in the wizard (use '
                              'for testing purposes only).')
+    # handled before parsing (see importprofile.py), only for --help
+    parser.add_argument('--profile-imports', action="store_true",
+                        help='Prints how long it took to import each module '
+                             'when Bitmask exits.')
 
     # openvpn options
     parser.add_argument('--openvpn-verbosity', nargs='?',
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# resolver.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Process-wide cache for the name resolution.
+
+The provider bootstrapping first checks that the provider domain resolves,
+and then connects to it with requests, that resolves it again. Both go
+through dns_cache::
+
+    dns_cache.resolve(domain)
+
+and, after install(), the connections opened by requests resolve the host
+names through the same cache, so each host is resolved once per DNS_TTL
+seconds. The patch that install() applies is process-wide, see its
+docstring.
+
+The failures are cached too, for a shorter time, so that a provider that
+does not resolve fails right away while the network is down.
+"""
+import socket
+import threading
+import time
+
+
+DNS_TTL = 300  # in seconds
+NEGATIVE_TTL = 10  # in seconds
+
+
+class CachingResolver(object):
+    """
+    Resolves host names with getaddrinfo, and keeps the addresses (or the
+    error) for ttl seconds.
+
+    resolve() is blocking and can be called from any thread; the backend
+    calls it from its worker threads, never from the reactor.
+    """
+
+    def __init__(self, ttl=DNS_TTL, negative_ttl=NEGATIVE_TTL):
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._entries = {}  # host -> (expires, addresses, error)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_cached(self, host):
+        """
+        Return the cached (addresses, error) for a host, or None if there
+        is no fresh entry for it.
+        """
+        host = _normalize(host)
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is None or entry[0] < time.time():
+                return None
+            self.hits += 1
+            return entry[1:]
+
+    def resolve(self, host):
+        """
+        Resolve a host name, blocking if it is not cached.
+
+        :param host: the name to resolve.
+        :type host: str or unicode
+
+        :return: the IP addresses of the host.
+        :rtype: list of str
+        :raise socket.error: if the name does not resolve.
+        """
+        host = _normalize(host)
+        if _is_address(host):
+            return [host]
+
+        cached = self.get_cached(host)
+        if cached is not None:
+            addresses, error = cached
+            if error is not None:
+                raise error
+            return addresses
+
+        with self._lock:
+            self.misses += 1
+        try:
+            infos = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+        except socket.error as e:
+            self._store(host, None, e, self._negative_ttl)
+            raise
+
+        addresses = []
+        for info in infos:
+            address = info[4][0]
+            if address not in addresses:
+                addresses.append(address)
+        self._store(host, addresses, None, self._ttl)
+        return addresses
+
+    def resolve_many(self, hosts, timeout):
+        """
+        Resolve several host names at the same time, blocking at most
+        timeout seconds.
+
+        The names that are not cached are resolved each in a thread of its
+        own. The ones that take longer than timeout are left out, and cached
+        when their lookup finishes.
+
+        :param hosts: the names to resolve.
+        :type hosts: iterable of str
+        :param timeout: how long to wait for the lookups, in seconds.
+        :type timeout: float
+
+        :return: the IP addresses of each host that resolved in time.
+        :rtype: dict
+        """
+        results = {}
+        lock = threading.Lock()
+
+        def lookup(host):
+            try:
+                addresses = self.resolve(host)
+            except socket.error:
+                return
+            with lock:
+                results[host] = addresses
+
+        lookups = []
+        for host in set(hosts):
+            name = _normalize(host)
+            if _is_address(name):
+                results[host] = [name]
+                continue
+            cached = self.get_cached(name)
+            if cached is not None:
+                addresses, error = cached
+                if error is None:
+                    results[host] = addresses
+                continue
+            thread = threading.Thread(target=lookup, args=(host,))
+            thread.daemon = True
+            thread.start()
+            lookups.append(thread)
+
+        deadline = time.time() + timeout
+        for thread in lookups:
+            thread.join(max(0, deadline - time.time()))
+        with lock:
+            return dict(results)
+
+    def invalidate(self, host=None):
+        """
+        Forget a host, or all of them if no host is given.
+        """
+        with self._lock:
+            if host is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(_normalize(host), None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self._entries)}
+
+    def _store(self, host, addresses, error, ttl):
+        with self._lock:
+            self._entries[host] = (time.time() + ttl, addresses, error)
+
+
+def _normalize(host):
+    if isinstance(host, unicode):
+        host = host.encode('idna')
+    return host.lower()
+
+
+def _is_address(host):
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return True
+        except (socket.error, ValueError, AttributeError):
+            # no inet_pton on windows, getaddrinfo will deal with it
+            pass
+    return False
+
+
+dns_cache = CachingResolver()
+
+
+def create_connection(address, *args, **kwargs):
+    """
+    A drop-in for urllib3's create_connection that resolves the host name
+    through the cache, and tries each of its addresses in turn.
+    """
+    host, port = address
+    error = None
+    for ip in dns_cache.resolve(host):
+        try:
+            return _original_create_connection((ip, port), *args, **kwargs)
+        except socket.error as e:
+            error = e
+    raise error
+
+
+_original_create_connection = None
+
+
+def install():
+    """
+    Make the requests sessions resolve the host names through the cache.
+
+    This replaces urllib3.util.connection.create_connection, so it is
+    process-wide: every requests session opened afterwards uses the cache,
+    and sees an address change up to DNS_TTL seconds late whatever the TTL
+    of the DNS record. Only the backend process installs it, where the
+    requests sessions are the ones of the bootstrappers and the components;
+    call dns_cache.invalidate() to drop the cached addresses sooner.
+
+    This needs a requests that bundles urllib3 1.8 or later, where the
+    connections are opened by urllib3.util.connection.create_connection.
+
+    :return: whether the cache could be installed.
+    :rtype: bool
+    """
+    global _original_create_connection
+
+    try:
+        from requests.packages.urllib3.util import connection
+    except ImportError:
+        return False
+
+    if _original_create_connection is None:
+        _original_create_connection = connection.create_connection
+        connection.create_connection = create_connection
+    return True
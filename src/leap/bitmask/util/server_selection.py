@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+# server_selection.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Strategies to choose one server among the ones that a provider offers for a
+service.
+
+The service configs (soledad-service.json, smtp-service.json) describe the
+servers as a dict of hosts, and optionally a dict of locations::
+
+    {'hosts': {'name': {'hostname': ..., 'ip_address': ..., 'port': ...,
+                        'location': 'location-name'}},
+     'locations': {'location-name': {'timezone': '-3', ...}}}
+
+A strategy picks the name of one of those hosts.
+"""
+import errno
+import itertools
+import random
+import select
+import socket
+import threading
+import time
+
+from leap.bitmask.util.resolver import dns_cache
+
+
+# http://www.timeanddate.com/time/map/
+EQUIVALENT_TIMEZONES = {13: -11, 14: -10}
+
+PROBE_TIMEOUT = 2  # in seconds
+RTT_TTL = 300  # in seconds
+
+
+# timezones
+
+def get_local_offset():
+    """
+    Return the distance between GMT and the local timezone.
+
+    :rtype: int
+    """
+    local_offset = time.timezone
+    if time.daylight:
+        local_offset = time.altzone
+
+    return -local_offset / 3600
+
+
+def normalize_offset(offset):
+    offset = int(offset)
+    return EQUIVALENT_TIMEZONES.get(offset, offset)
+
+
+def timezone_distance(tz1, tz2):
+    """
+    Return the distance, in hours, between two timezones.
+
+    :param tz1: the distance of a timezone to GMT.
+    :type tz1: int
+    :param tz2: the distance of another timezone to GMT.
+    :type tz2: int
+    :rtype: int
+    """
+    timezones = range(-11, 13)
+    distance = abs(timezones.index(tz1) - timezones.index(tz2))
+    if distance > 12:
+        if tz1 < 0:
+            distance = timezones.index(tz1) + timezones[::-1].index(tz2)
+        else:
+            distance = timezones[::-1].index(tz1) + timezones.index(tz2)
+
+    return distance
+
+
+# latency probes
+
+def probe(addresses, timeout=PROBE_TIMEOUT):
+    """
+    Measure the time that it takes to open a TCP connection to each address.
+
+    All the host names are resolved, and then all the connections are
+    attempted, at the same time, so this takes at most timeout seconds, no
+    matter how many addresses are probed. The hosts that do not resolve in
+    time count as unreachable.
+
+    :param addresses: the addresses to probe.
+    :type addresses: iterable of (host, port) tuples
+    :param timeout: give up on the connections that take longer than this.
+    :type timeout: float
+
+    :return: the round trip time, in seconds, for each address, or None if
+             it could not be reached.
+    :rtype: dict
+    """
+    results = dict((address, None) for address in addresses)
+    pending = {}
+
+    deadline = time.time() + timeout
+    resolved = dns_cache.resolve_many(
+        [host for host, _ in results], timeout)
+
+    for address in results:
+        host, port = address
+        if not resolved.get(host):
+            continue
+        try:
+            # an address, so this does not block
+            family, socktype, proto, _, sockaddr = socket.getaddrinfo(
+                resolved[host][0], port, 0, socket.SOCK_STREAM, 0,
+                socket.AI_NUMERICHOST)[0]
+            sock = socket.socket(family, socktype, proto)
+        except socket.error:
+            continue
+        sock.setblocking(0)
+        start = time.time()
+        err = sock.connect_ex(sockaddr)
+        # 10035 is WSAEWOULDBLOCK
+        if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, 10035):
+            pending[sock] = (address, start)
+        else:
+            sock.close()
+
+    while pending:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        socks = pending.keys()
+        _, writable, failed = select.select([], socks, socks, remaining)
+        now = time.time()
+        for sock in set(writable) | set(failed):
+            address, start = pending.pop(sock)
+            if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                results[address] = now - start
+            sock.close()
+
+    for sock in pending:
+        sock.close()
+    return results
+
+
+def get_network_id(address=('198.51.100.1', 443)):
+    """
+    Return something that tells the network we are on apart from the
+    others: the local address that the traffic to the internet goes out
+    from. Nothing is sent to find it out.
+
+    The address is a documentation one (RFC 5737), only the route to it
+    matters.
+
+    :return: the local address, or None if there is no route out.
+    :rtype: str
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect(address)
+        return sock.getsockname()[0]
+    except socket.error:
+        return None
+    finally:
+        sock.close()
+
+
+class _RTTCache(object):
+    """
+    The results of the latest probes, shared by all the strategies.
+
+    The results can be kept per network, since the rtts measured on one
+    network say nothing about the ones on another.
+    """
+
+    def __init__(self):
+        self._rtts = {}
+        self._lock = threading.Lock()
+
+    def update(self, results, network=None):
+        now = time.time()
+        with self._lock:
+            for address, rtt in results.iteritems():
+                self._rtts[(network, address)] = (now, rtt)
+
+    def get(self, addresses, ttl, network=None):
+        """
+        Return the cached rtts for the addresses, or None if any of them is
+        missing or older than ttl seconds.
+        """
+        now = time.time()
+        results = {}
+        with self._lock:
+            for address in addresses:
+                entry = self._rtts.get((network, address))
+                if entry is None or now - entry[0] > ttl:
+                    return None
+                results[address] = entry[1]
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._rtts.clear()
+
+
+rtt_cache = _RTTCache()
+
+
+def get_address(host):
+    """
+    Return the (host, port) address to probe for a host description.
+    """
+    return (host.get('ip_address') or host['hostname'], int(host['port']))
+
+
+# strategies
+
+class ServerSelectionStrategy(object):
+    """
+    Base class for the server selection strategies.
+    """
+
+    name = None
+
+    def pick(self, hosts, locations=None):
+        """
+        Pick a host.
+
+        :param hosts: the hosts to choose from, by name.
+        :type hosts: dict
+        :param locations: the locations of the hosts, by name.
+        :type locations: dict
+
+        :return: the name of the chosen host.
+        :rtype: str
+        """
+        raise NotImplementedError()
+
+
+class FirstStrategy(ServerSelectionStrategy):
+    """
+    Always pick the first host, by name.
+    """
+
+    name = 'first'
+
+    def pick(self, hosts, locations=None):
+        return sorted(hosts)[0]
+
+
+class RoundRobinStrategy(ServerSelectionStrategy):
+    """
+    Pick each host in turn.
+    """
+
+    name = 'round_robin'
+
+    def __init__(self):
+        self._counter = itertools.count()
+
+    def pick(self, hosts, locations=None):
+        names = sorted(hosts)
+        return names[next(self._counter) % len(names)]
+
+
+class WeightedStrategy(ServerSelectionStrategy):
+    """
+    Pick a random host, with a probability proportional to its 'weight'
+    (1 for the hosts that do not have one).
+    """
+
+    name = 'weighted'
+
+    def pick(self, hosts, locations=None):
+        names = sorted(hosts)
+        weights = [float(hosts[name].get('weight', 1)) for name in names]
+        choice = random.uniform(0, sum(weights))
+        for name, weight in zip(names, weights):
+            if choice <= weight:
+                return name
+            choice -= weight
+        return names[-1]
+
+
+class TimezoneStrategy(ServerSelectionStrategy):
+    """
+    Pick the host closest to our timezone. Hosts with no known timezone go
+    last.
+    """
+
+    name = 'timezone'
+
+    def __init__(self, tz_offset=None):
+        if tz_offset is None:
+            tz_offset = get_local_offset()
+        self._local_offset = normalize_offset(tz_offset)
+
+    def get_distance(self, host, locations):
+        location = (locations or {}).get(host.get('location'))
+        if location is None or location.get('timezone') is None:
+            return 99
+        offset = normalize_offset(location['timezone'])
+        return timezone_distance(offset, self._local_offset)
+
+    def pick(self, hosts, locations=None):
+        return min(
+            sorted(hosts),
+            key=lambda name: self.get_distance(hosts[name], locations))
+
+
+class MeasuredRTTStrategy(ServerSelectionStrategy):
+    """
+    Pick the host that accepts a TCP connection the fastest.
+
+    The probes are cached for ttl seconds. When background is True the
+    probes never block the caller: while there are no fresh results the
+    fallback strategy is used, and the probes run in a thread. This needs a
+    running reactor, and pick() can then be called from any thread.
+    """
+
+    name = 'rtt'
+
+    def __init__(self, ttl=RTT_TTL, timeout=PROBE_TIMEOUT, fallback=None,
+                 background=False):
+        self._ttl = ttl
+        self._timeout = timeout
+        self._fallback = fallback or TimezoneStrategy()
+        self._background = background
+        self._probing = set([])
+        self._probing_lock = threading.Lock()
+
+    def measure(self, addresses):
+        results = probe(addresses, self._timeout)
+        rtt_cache.update(results)
+        return results
+
+    def pick(self, hosts, locations=None):
+        addresses = dict(
+            (name, get_address(host)) for name, host in hosts.iteritems())
+        rtts = rtt_cache.get(addresses.values(), self._ttl)
+
+        if rtts is None:
+            if self._background:
+                self._measure_in_background(addresses.values())
+                return self._fallback.pick(hosts, locations)
+            rtts = self.measure(addresses.values())
+
+        reachable = [(rtts[address], name)
+                     for name, address in sorted(addresses.iteritems())
+                     if rtts.get(address) is not None]
+        if not reachable:
+            return self._fallback.pick(hosts, locations)
+        return min(reachable)[1]
+
+    def _measure_in_background(self, addresses):
+        from twisted.internet import reactor, threads
+        from twisted.python.threadable import isInIOThread
+
+        addresses = frozenset(addresses)
+        with self._probing_lock:
+            if addresses in self._probing:
+                return
+            self._probing.add(addresses)
+
+        def done(_):
+            with self._probing_lock:
+                self._probing.discard(addresses)
+
+        def measure():
+            d = threads.deferToThread(self.measure, addresses)
+            d.addBoth(done)
+
+        if isInIOThread():
+            measure()
+        else:
+            reactor.callFromThread(measure)
+
+
+STRATEGIES = dict(
+    (strategy.name, strategy) for strategy in (
+        FirstStrategy, RoundRobinStrategy, WeightedStrategy,
+        TimezoneStrategy, MeasuredRTTStrategy))
+
+
+def get_strategy(name, **kwargs):
+    """
+    Get a strategy by name.
+
+    :raise ValueError: if there is no such strategy.
+    """
+    try:
+        strategy = STRATEGIES[name]
+    except KeyError:
+        raise ValueError('Unknown server selection strategy: %s' % name)
+    return strategy(**kwargs)
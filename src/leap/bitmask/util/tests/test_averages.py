@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# test_averages.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+tests for the traffic meter
+"""
+import unittest
+
+from leap.bitmask.util.averages import TrafficMeter
+from leap.common.testing.basetest import BaseLeapTest
+
+
+class TrafficMeterTest(BaseLeapTest):
+    """Tests for the traffic meter."""
+
+    def setUp(self):
+        self.meter = TrafficMeter(window=5, half_life=2)
+
+    def tearDown(self):
+        pass
+
+    def test_empty(self):
+        self.assertEqual(self.meter.stats(),
+                         {'total': 0, 'rate': 0.0, 'ewma': 0.0})
+
+    def test_sub_second_rate(self):
+        self.meter.update(1000, now=10.0)
+        self.meter.update(1500, now=10.5)
+        self.assertEqual(self.meter.rate, 1000.0)
+        self.assertEqual(self.meter.total, 1500)
+
+    def test_window(self):
+        for i in range(10):
+            # 100 B/s for the first 5 seconds, 1000 B/s after
+            counter = i * 100 if i <= 5 else 500 + (i - 5) * 1000
+            self.meter.update(counter, now=float(i))
+        # from the sample at 4 seconds to the one at 9
+        self.assertEqual(self.meter.rate, (4500 - 400) / 5.0)
+
+    def test_ewma_follows_the_rate(self):
+        for i in range(30):
+            self.meter.update(i * 100, now=float(i))
+        self.assertAlmostEqual(self.meter.ewma, 100, places=0)
+
+    def test_counter_starts_over(self):
+        self.meter.update(1000, now=1.0)
+        self.meter.update(200, now=2.0)
+        self.assertEqual(self.meter.total, 1200)
+
+    def test_reset(self):
+        self.meter.update(1000, now=1.0)
+        self.meter.update(2000, now=2.0)
+        self.meter.reset()
+        self.assertEqual(self.meter.total, 0)
+        self.assertEqual(self.meter.rate, 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# test_resolver.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+tests for the caching resolver
+"""
+import socket
+import time
+import unittest
+
+from leap.bitmask.util import resolver
+from leap.common.testing.basetest import BaseLeapTest
+
+from mock import patch
+
+
+def _addrinfo(*addresses):
+    return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, 0))
+            for address in addresses]
+
+
+class CachingResolverTest(BaseLeapTest):
+    """Tests for the caching resolver."""
+
+    def setUp(self):
+        self.resolver = resolver.CachingResolver(ttl=60, negative_ttl=5)
+
+    def tearDown(self):
+        pass
+
+    @patch('socket.getaddrinfo')
+    def test_resolves_once(self, getaddrinfo):
+        getaddrinfo.return_value = _addrinfo('1.2.3.4', '1.2.3.4', '2.3.4.5')
+        self.assertEqual(self.resolver.resolve(u'Example.ORG'),
+                         ['1.2.3.4', '2.3.4.5'])
+        self.assertEqual(self.resolver.resolve('example.org'),
+                         ['1.2.3.4', '2.3.4.5'])
+        self.assertEqual(getaddrinfo.call_count, 1)
+        self.assertEqual(self.resolver.stats(),
+                         {'hits': 1, 'misses': 1, 'entries': 1})
+
+    @patch('socket.getaddrinfo')
+    def test_caches_failures(self, getaddrinfo):
+        getaddrinfo.side_effect = socket.gaierror(-2, 'Name not known')
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                self.resolver.resolve('nowhere.example.org')
+        self.assertEqual(getaddrinfo.call_count, 1)
+
+    @patch('time.time')
+    @patch('socket.getaddrinfo')
+    def test_expires(self, getaddrinfo, now):
+        getaddrinfo.return_value = _addrinfo('1.2.3.4')
+        now.return_value = 1000
+        self.resolver.resolve('example.org')
+        now.return_value = 1061
+        self.resolver.resolve('example.org')
+        self.assertEqual(getaddrinfo.call_count, 2)
+
+    @patch('socket.getaddrinfo')
+    def test_addresses_are_not_resolved(self, getaddrinfo):
+        self.assertEqual(self.resolver.resolve('10.0.0.1'), ['10.0.0.1'])
+        self.assertFalse(getaddrinfo.called)
+
+    @patch('socket.getaddrinfo')
+    def test_invalidate(self, getaddrinfo):
+        getaddrinfo.return_value = _addrinfo('1.2.3.4')
+        self.resolver.resolve('example.org')
+        self.resolver.invalidate('example.org')
+        self.resolver.resolve('example.org')
+        self.assertEqual(getaddrinfo.call_count, 2)
+
+    @patch('socket.getaddrinfo')
+    def test_resolve_many(self, getaddrinfo):
+        def lookup(host, *args):
+            if host == 'slow.example.org':
+                time.sleep(1)
+            if host == 'nowhere.example.org':
+                raise socket.gaierror(-2, 'Name not known')
+            return _addrinfo('1.2.3.4')
+        getaddrinfo.side_effect = lookup
+
+        start = time.time()
+        results = self.resolver.resolve_many(
+            ['example.org', 'slow.example.org', 'nowhere.example.org',
+             '10.0.0.1'], timeout=0.2)
+        self.assertLess(time.time() - start, 0.9)
+        self.assertEqual(results, {'example.org': ['1.2.3.4'],
+                                   '10.0.0.1': ['10.0.0.1']})
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
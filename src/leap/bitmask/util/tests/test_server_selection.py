@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# test_server_selection.py
+# Copyright (C) 2016 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+tests for the server selection strategies
+"""
+import socket
+import time
+import unittest
+
+from leap.bitmask.util import server_selection
+from leap.common.testing.basetest import BaseLeapTest
+
+from mock import patch
+
+
+sample_hosts = {
+    'host1': {'hostname': 'host1.example.org', 'ip_address': '1.2.3.4',
+              'port': 2323, 'location': 'location1'},
+    'host2': {'hostname': 'host2.example.org', 'ip_address': '2.3.4.5',
+              'port': 2323, 'location': 'location2'},
+    'host3': {'hostname': 'host3.example.org', 'ip_address': '3.4.5.6',
+              'port': 2323},
+}
+
+sample_locations = {
+    'location1': {'timezone': '2'},
+    'location2': {'timezone': '-7'},
+}
+
+
+class ServerSelectionTest(BaseLeapTest):
+    """Tests for the server selection strategies."""
+
+    def setUp(self):
+        server_selection.rtt_cache.clear()
+
+    def tearDown(self):
+        server_selection.rtt_cache.clear()
+
+    def test_first(self):
+        strategy = server_selection.get_strategy('first')
+        self.assertEqual(strategy.pick(sample_hosts), 'host1')
+
+    def test_round_robin(self):
+        strategy = server_selection.get_strategy('round_robin')
+        picks = [strategy.pick(sample_hosts) for _ in range(4)]
+        self.assertEqual(picks, ['host1', 'host2', 'host3', 'host1'])
+
+    def test_weighted_skips_zero_weight(self):
+        hosts = {'a': {'weight': 0}, 'b': {'weight': 1}}
+        strategy = server_selection.get_strategy('weighted')
+        for _ in range(20):
+            self.assertEqual(strategy.pick(hosts), 'b')
+
+    def test_timezone(self):
+        strategy = server_selection.get_strategy('timezone', tz_offset=-5)
+        self.assertEqual(
+            strategy.pick(sample_hosts, sample_locations), 'host2')
+
+        strategy = server_selection.get_strategy('timezone', tz_offset=3)
+        self.assertEqual(
+            strategy.pick(sample_hosts, sample_locations), 'host1')
+
+    def test_timezone_distance_wraps(self):
+        self.assertEqual(server_selection.timezone_distance(-10, 12), 1)
+        self.assertEqual(server_selection.timezone_distance(2, -7), 9)
+
+    def test_rtt_picks_fastest(self):
+        rtts = {('1.2.3.4', 2323): 0.3,
+                ('2.3.4.5', 2323): 0.1,
+                ('3.4.5.6', 2323): None}
+        with patch.object(server_selection, 'probe',
+                          return_value=rtts) as probe:
+            strategy = server_selection.get_strategy('rtt')
+            self.assertEqual(strategy.pick(sample_hosts), 'host2')
+            # cached
+            self.assertEqual(strategy.pick(sample_hosts), 'host2')
+            self.assertEqual(probe.call_count, 1)
+
+    def test_rtt_falls_back_when_unreachable(self):
+        rtts = dict((server_selection.get_address(h), None)
+                    for h in sample_hosts.values())
+        fallback = server_selection.get_strategy('first')
+        with patch.object(server_selection, 'probe', return_value=rtts):
+            strategy = server_selection.get_strategy('rtt', fallback=fallback)
+            self.assertEqual(strategy.pick(sample_hosts), 'host1')
+
+    def test_rtt_cache_per_network(self):
+        address = ('1.2.3.4', 443)
+        cache = server_selection.rtt_cache
+        cache.update({address: 0.1}, network='10.0.0.2')
+        self.assertEqual(cache.get([address], 60, '10.0.0.2'),
+                         {address: 0.1})
+        self.assertEqual(cache.get([address], 60, '192.168.1.7'), None)
+        self.assertEqual(cache.get([address], 60), None)
+
+    def test_probe_unreachable(self):
+        # a port on localhost where hopefully nobody is listening
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        address = sock.getsockname()
+        sock.close()
+
+        results = server_selection.probe([address], timeout=1)
+        self.assertEqual(results, {address: None})
+
+    def test_probe_reachable(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        address = sock.getsockname()
+        try:
+            results = server_selection.probe([address], timeout=1)
+        finally:
+            sock.close()
+        self.assertTrue(results[address] is not None)
+
+    def test_unknown_strategy(self):
+        self.assertRaises(
+            ValueError, server_selection.get_strategy, 'fastest-ever')
+
+    def test_strategy_errors_are_not_hidden(self):
+        def broken():
+            raise KeyError('timezone')
+        with patch.dict(server_selection.STRATEGIES, broken=broken):
+            self.assertRaises(
+                KeyError, server_selection.get_strategy, 'broken')
+
+    def test_probe_does_not_wait_for_slow_names(self):
+        def resolve_many(hosts, timeout):
+            time.sleep(timeout)
+            return {}
+        with patch.object(server_selection.dns_cache, 'resolve_many',
+                          side_effect=resolve_many):
+            start = time.time()
+            addresses = [('host%d.example.org' % i, 443) for i in range(5)]
+            results = server_selection.probe(addresses, timeout=0.2)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(results, dict((a, None) for a in addresses))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)